@@ -0,0 +1,86 @@
+"""
+Pre-encoded animations for the full-picture mode.
+
+All frames are encoded into block commands up front, together with the list
+of blocks that change from one frame to the next, so playback only has to
+write ready-made buffers and the frame rate depends on the BLE link alone.
+"""
+import asyncio
+import numpy as np
+from codec import (CHARACTERISTIC_UUID, BLOCK_COUNT, BLOCK_COMMAND_SIZE, START_PICTURE_COMMAND,
+                   encode_full_picture, new_picture_buffer, to_frame)
+from pacing import paced
+
+# Frames without a usable duration are shown this long, like browsers do
+DEFAULT_FRAME_DURATION = 0.1
+
+class EncodedAnimation:
+    """
+    An animation as an (n, 8, 100) array of block commands plus the
+    duration of each frame in seconds.
+
+    `deltas[i]` holds the indices of the blocks that differ between frame
+    i - 1 and frame i; for frame 0 that is against the last frame, which is
+    what is on the display when the animation loops.
+    """
+    def __init__(self, blocks, durations):
+        self.blocks = blocks
+        self.durations = np.asarray(durations, dtype=np.float64)
+        pixels = blocks[:, :, 3:-1]
+        changed = (pixels != np.roll(pixels, 1, axis=0)).any(axis=2)
+        self.deltas = [np.flatnonzero(row) for row in changed]
+
+    @classmethod
+    def from_frames(cls, frames, durations):
+        """
+        Encodes a list of pictures (anything codec.to_frame accepts).
+        """
+        blocks = np.empty((len(frames), BLOCK_COUNT, BLOCK_COMMAND_SIZE), dtype=np.uint8)
+        blocks[:] = new_picture_buffer()
+        for i, frame in enumerate(frames):
+            encode_full_picture(to_frame(frame), blocks[i])
+        return cls(blocks, durations)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def frame(self, index) -> np.ndarray:
+        """
+        Returns the pixels of frame `index` as a (256, 3) uint8 array.
+        """
+        return self.blocks[index, :, 3:-1].reshape(-1, 3)
+
+    def frame_commands(self, index, full=False):
+        """
+        Returns the block commands to write to go from the previous frame to
+        frame `index`, or all eight blocks with `full`.
+        """
+        blocks = range(BLOCK_COUNT) if full else self.deltas[index]
+        return [self.blocks[index, block_index].data for block_index in blocks]
+
+async def play_animation(client, animation: EncodedAnimation, loops=None):
+    """
+    Plays an animation, looping forever or `loops` times. Each frame is
+    shown for its duration measured from when it was due, so time spent
+    writing is not added on top; if the link cannot keep up the schedule is
+    reset instead of rushing through frames.
+    """
+    client = paced(client)
+    loop = asyncio.get_running_loop()
+    await client.write_gatt_char(CHARACTERISTIC_UUID, START_PICTURE_COMMAND)
+
+    full = True
+    count = 0
+    deadline = loop.time()
+    while loops is None or count < loops:
+        for index in range(len(animation)):
+            for command in animation.frame_commands(index, full):
+                await client.write_gatt_char(CHARACTERISTIC_UUID, command)
+            full = False
+            deadline += animation.durations[index]
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                deadline = loop.time()
+        count += 1
@@ -0,0 +1,246 @@
+"""
+Throughput and latency benchmark for the send paths.
+
+Runs the pixel, packed pixel, full-picture, hybrid, plasma and animation
+paths against the emulator (default) or a real display and reports
+frames/s, pixels/s, bytes written, p50/p99 frame latency and CPU time per
+frame. Results can be saved
+as JSON and compared against an earlier run to catch regressions:
+
+    python3 benchmark.py --frames 200 --output results.json
+    python3 benchmark.py --compare results.json
+    python3 benchmark.py --device --paths pixels picture
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import numpy as np
+import plasma
+from animation import EncodedAnimation
+from codec import CHARACTERISTIC_UUID, GRAFFITI_COMMANDS, START_PICTURE_COMMAND, PIXEL_COUNT, encode_frame_pixels, iter_commands, new_pixel_buffer
+from delta import PictureStream
+from emulator import EmulatedClient
+from pacing import paced
+from packing import iter_packed, max_write_size
+from planner import HybridStream
+
+class CountingClient:
+    """
+    Passes writes through to a client, counting writes and bytes.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.writes = 0
+        self.bytes_written = 0
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    async def write_gatt_char(self, char_uuid, data, response=None):
+        self.writes += 1
+        self.bytes_written += len(data)
+        await self.client.write_gatt_char(char_uuid, data, response=response)
+
+def moving_bar(index):
+    """
+    A test frame with a two pixel high bar that moves down one row per
+    frame, so consecutive frames differ in three rows.
+    """
+    frame = np.zeros((16, 16, 3), dtype=np.uint8)
+    frame[index % 16] = (255, 255, 255)
+    frame[(index + 1) % 16] = (255, 0, 0)
+    return frame.reshape(PIXEL_COUNT, 3)
+
+# Each path is an async generator that sends one frame per step and yields
+# the number of pixels that frame updated
+
+async def pixel_path(client, frames, rng):
+    await client.write_commands(GRAFFITI_COMMANDS)
+    buffer = new_pixel_buffer(plasma.UPDATE_PIXEL_COUNT)
+    picture = rng.integers(0, 256, (PIXEL_COUNT, 3), dtype=np.uint8)
+    for _ in range(frames):
+        indices = rng.choice(PIXEL_COUNT, plasma.UPDATE_PIXEL_COUNT, replace=False)
+        for command in iter_commands(encode_frame_pixels(picture, indices, buffer)):
+            await client.write_gatt_char(CHARACTERISTIC_UUID, command)
+        yield len(indices)
+
+async def packed_path(client, frames, rng):
+    # Like the pixel path, with as many commands per write as the MTU allows
+    await client.write_commands(GRAFFITI_COMMANDS)
+    buffer = new_pixel_buffer(plasma.UPDATE_PIXEL_COUNT)
+    picture = rng.integers(0, 256, (PIXEL_COUNT, 3), dtype=np.uint8)
+    for _ in range(frames):
+        indices = rng.choice(PIXEL_COUNT, plasma.UPDATE_PIXEL_COUNT, replace=False)
+        for data in iter_packed(encode_frame_pixels(picture, indices, buffer), max_write_size(client)):
+            await client.write_gatt_char(CHARACTERISTIC_UUID, data)
+        yield len(indices)
+
+async def picture_path(client, frames, rng):
+    stream = PictureStream(client, block_delay=0, command_delay=0, finish=False)
+    for _ in range(frames):
+        await stream.send(rng.integers(0, 256, (PIXEL_COUNT, 3), dtype=np.uint8), force=True)
+        yield PIXEL_COUNT
+
+async def hybrid_path(client, frames, rng):
+    stream = HybridStream(client, delays=dict.fromkeys(["pixel", "block", "start", "end", "graffiti"], 0))
+    for index in range(frames):
+        plan = await stream.send(moving_bar(index))
+        yield len(plan.pixels) + 32 * len(plan.blocks)
+
+async def plasma_path(client, frames, rng):
+    await client.write_commands(GRAFFITI_COMMANDS)
+    buffer = new_pixel_buffer(plasma.UPDATE_PIXEL_COUNT)
+    t = float(rng.integers(0, 1000000))
+    for _ in range(frames):
+        plasma.update_plasma(t)
+        plasma.update_error()
+        plasma.update_display()
+        sent = plasma.top_error_positions[-plasma.UPDATE_PIXEL_COUNT:]
+        for command in iter_commands(encode_frame_pixels(plasma.display_pixels, sent, buffer)):
+            await client.write_gatt_char(CHARACTERISTIC_UUID, command)
+        t += 0.01
+        yield len(sent)
+
+async def animation_path(client, frames, rng):
+    animation = EncodedAnimation.from_frames([moving_bar(i) for i in range(16)], [0.0] * 16)
+    await client.write_gatt_char(CHARACTERISTIC_UUID, START_PICTURE_COMMAND)
+    for index in range(frames):
+        commands = animation.frame_commands(index % len(animation), full=index == 0)
+        for command in commands:
+            await client.write_gatt_char(CHARACTERISTIC_UUID, command)
+        yield 32 * len(commands)
+
+PATHS = {
+    "pixels": pixel_path,
+    "packed": packed_path,
+    "picture": picture_path,
+    "hybrid": hybrid_path,
+    "plasma": plasma_path,
+    "animation": animation_path,
+}
+
+async def measure(name, client, frames, seed=0) -> dict:
+    """
+    Runs one path for `frames` frames and returns its measurements. On the
+    emulator with a virtual clock, times are virtual: the emulated link
+    time plus the waits of the pacer, which pass on the same clock instead
+    of sleeping, so the numbers reflect the modelled link alone.
+    """
+    counter = CountingClient(client)
+    rng = np.random.default_rng(seed)
+    if isinstance(client, EmulatedClient) and not client.realtime:
+        waited = 0.0
+
+        def now():
+            return client.clock + waited
+
+        async def sleep(seconds):
+            nonlocal waited
+            waited += max(seconds, 0.0)
+            await asyncio.sleep(0)
+
+        pacer = paced(counter, timer=now, sleep=sleep)
+    else:
+        now = time.perf_counter
+        pacer = paced(counter)
+
+    latencies = []
+    cpu_times = []
+    pixels = 0
+    steps = PATHS[name](pacer, frames, rng)
+    start = now()
+    while True:
+        frame_start = now()
+        cpu_start = time.process_time()
+        try:
+            pixels += await steps.__anext__()
+        except StopAsyncIteration:
+            break
+        latencies.append(now() - frame_start)
+        cpu_times.append(time.process_time() - cpu_start)
+    seconds = now() - start
+
+    return {
+        "path": name,
+        "frames": len(latencies),
+        "seconds": seconds,
+        "frames_per_second": len(latencies) / seconds if seconds else 0.0,
+        "pixels_per_second": pixels / seconds if seconds else 0.0,
+        "writes": counter.writes,
+        "bytes": counter.bytes_written,
+        "latency_p50": float(np.percentile(latencies, 50)),
+        "latency_p99": float(np.percentile(latencies, 99)),
+        "cpu_per_frame": float(np.mean(cpu_times)),
+    }
+
+def compare(results, baseline, tolerance) -> bool:
+    """
+    Prints the change against a baseline run and returns False if any path
+    lost more than `tolerance` of its frame rate.
+    """
+    previous = {result["path"]: result for result in baseline["results"]}
+    ok = True
+    for result in results:
+        before = previous.get(result["path"])
+        if not before or not before["frames_per_second"]:
+            continue
+        change = result["frames_per_second"] / before["frames_per_second"] - 1
+        regressed = change < -tolerance
+        ok = ok and not regressed
+        print(f"{result['path']:>10}: {change:+.1%} frames/s{'  REGRESSION' if regressed else ''}")
+    return ok
+
+def print_results(results):
+    print(f"{'path':>10} {'frames/s':>9} {'pixels/s':>9} {'bytes':>8} {'p50 ms':>7} {'p99 ms':>7} {'cpu ms':>7}")
+    for r in results:
+        print(f"{r['path']:>10} {r['frames_per_second']:9.1f} {r['pixels_per_second']:9.0f} {r['bytes']:8d} "
+              f"{r['latency_p50'] * 1000:7.2f} {r['latency_p99'] * 1000:7.2f} {r['cpu_per_frame'] * 1000:7.3f}")
+
+async def run(args):
+    results = []
+    if args.device:
+        from connection import DisplayConnection
+        async with DisplayConnection() as connection:
+            for name in args.paths:
+                results.append(await measure(name, connection, args.frames))
+    else:
+        for name in args.paths:
+            client = EmulatedClient(latency=args.latency, bandwidth=args.bandwidth, realtime=args.realtime,
+                                    accept_concatenated=True)
+            results.append(await measure(name, client, args.frames))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MI Matrix Display send paths.")
+    parser.add_argument("--paths", nargs="+", choices=list(PATHS), default=list(PATHS))
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--device", action="store_true", help="run against a real display")
+    parser.add_argument("--latency", type=float, default=0.003, help="emulated per-write latency in seconds")
+    parser.add_argument("--bandwidth", type=float, default=20000.0, help="emulated bandwidth in bytes per second")
+    parser.add_argument("--realtime", action="store_true", help="let the emulator sleep instead of using a virtual clock")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare", help="compare against a saved JSON run")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed frame rate loss when comparing")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "time": time.time(),
+                "transport": "device" if args.device else "emulator",
+                "frames": args.frames,
+                "results": results,
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            if not compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Calibration of the send parameters for this Bluetooth adapter and display.
+
+Sweeps write sizes (one pixel command, or several packed per write when the
+display accepts it, see packing.py), gaps between writes and write with or
+without response. Each setting writes a short burst of pixel commands and
+counts failed writes, disconnects and (on the emulator) pixels that did not
+arrive. Smaller gaps are only tried while the larger ones are stable.
+
+Writes without response only queue locally and a real link does not report
+the ones it drops, so each setting ends with a write with response, which
+returns once everything before it went out, and the rates are the delivered
+rates. Before the fastest stable setting is saved, with some margin on the
+gap, the display is filled at that setting and the user is asked whether
+every pixel arrived; if not, the next fastest setting is tried. The saved
+profile is what the senders load at startup (see link_profile.py).
+
+Usage:
+    python3 calibrate.py
+    python3 calibrate.py --packed --writes 100
+    python3 calibrate.py --emulator --packed
+"""
+import argparse
+import asyncio
+import time
+import numpy as np
+from codec import CHARACTERISTIC_UUID, GRAFFITI_COMMANDS, PIXEL_COMMAND_SIZE, PIXEL_COUNT, encode_set_pixels, iter_commands
+from link_profile import save_profile
+from packing import iter_packed, max_write_size
+from pacing import MIN_GAP, MODE_SETTLE
+
+GAPS = (0.02, 0.01, 0.006, 0.004, 0.003, 0.002, 0.001, 0.0)
+# The profile gap is the smallest stable gap times this
+GAP_MARGIN = 1.25
+FPS = 30
+
+async def measure(client, write_size, gap, response, writes, verify=None, rng=None) -> dict:
+    """
+    Writes `writes` writes of `write_size` bytes of pixel commands with a
+    fixed `gap`, and returns the throughput and whether the link stayed
+    stable. `verify` is called with the indices of the pixels written and
+    the colors they should show, if the display state can be checked.
+    """
+    rng = rng or np.random.default_rng()
+    per_write = max(1, write_size // PIXEL_COMMAND_SIZE)
+    frame = np.zeros((PIXEL_COUNT, 3), dtype=np.uint8)
+    written = np.zeros(PIXEL_COUNT, dtype=bool)
+    disconnects = getattr(client, "disconnects", 0)
+    latencies = []
+    errors = 0
+    pixels = 0
+
+    start = time.perf_counter()
+    for index in range(writes):
+        indices = (np.arange(per_write) + index * per_write) % PIXEL_COUNT
+        colors = rng.integers(1, 256, (per_write, 3), dtype=np.uint8)
+        data = encode_set_pixels(indices, colors).tobytes()
+        write_start = time.perf_counter()
+        try:
+            await client.write_gatt_char(CHARACTERISTIC_UUID, data, response=response)
+            frame[indices] = colors
+            written[indices] = True
+            pixels += per_write
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - write_start)
+        if gap:
+            await asyncio.sleep(gap)
+    # Returns once the queued writes went out, so the time covers delivery
+    try:
+        await client.write_gatt_char(CHARACTERISTIC_UUID, data, response=True)
+    except Exception:
+        errors += 1
+    seconds = time.perf_counter() - start
+
+    disconnects = getattr(client, "disconnects", 0) - disconnects
+    verified = verify(np.flatnonzero(written), frame[written]) if verify is not None else True
+    return {
+        "write_size": per_write * PIXEL_COMMAND_SIZE,
+        "gap": gap,
+        "response": response,
+        "pixels_per_second": pixels / seconds if seconds else 0.0,
+        "latency_p50": float(np.percentile(latencies, 50)),
+        "latency_p99": float(np.percentile(latencies, 99)),
+        "errors": errors,
+        "disconnects": disconnects,
+        "stable": errors == 0 and disconnects == 0 and verified,
+    }
+
+async def sweep(client, packed=False, writes=50, verify=None) -> list:
+    """
+    Runs the sweep and returns the measurement of every setting tried.
+    """
+    # Pixel commands per write
+    sizes = [1]
+    if packed:
+        largest = max_write_size(client) // PIXEL_COMMAND_SIZE
+        sizes += sorted({max(2, largest // 4), max(2, largest // 2), largest} - {1})
+
+    for command in GRAFFITI_COMMANDS:
+        await client.write_gatt_char(CHARACTERISTIC_UUID, command, response=True)
+        await asyncio.sleep(MODE_SETTLE)
+
+    results = []
+    for response in (False, True):
+        for size in sizes:
+            for gap in GAPS:
+                result = await measure(client, size * PIXEL_COMMAND_SIZE, gap, response, writes, verify)
+                results.append(result)
+                print(f"size {result['write_size']:3d} gap {gap * 1000:4.1f} ms response {str(response):5}: "
+                      f"{result['pixels_per_second']:7.0f} px/s, {result['errors']} errors, "
+                      f"{result['disconnects']} disconnects{'' if result['stable'] else '  UNSTABLE'}")
+                if not result["stable"]:
+                    # Let the link settle, smaller gaps will not do better
+                    await asyncio.sleep(1.0)
+                    break
+    return results
+
+def fastest(results) -> dict:
+    """
+    Returns the fastest stable measurement, or None.
+    """
+    stable = [result for result in results if result["stable"]]
+    if not stable:
+        return None
+    return max(stable, key=lambda result: result["pixels_per_second"])
+
+def best_profile(results) -> dict:
+    """
+    Returns the link profile for the fastest stable setting, or None.
+    """
+    best = fastest(results)
+    if best is None:
+        return None
+    gap = max(best["gap"] * GAP_MARGIN, MIN_GAP)
+    # The pixel rate at the profile gap, assuming the write time stays the same
+    write_time = best["write_size"] / PIXEL_COMMAND_SIZE / best["pixels_per_second"] - best["gap"]
+    pixels_per_second = best["write_size"] / PIXEL_COMMAND_SIZE / (max(write_time, 0.0) + gap)
+    return {
+        "gap": gap,
+        "min_gap": max(best["gap"], MIN_GAP),
+        "response": best["response"],
+        "write_size": best["write_size"],
+        "pixel_count": max(1, int(pixels_per_second / FPS)),
+        "pixels_per_second": pixels_per_second,
+        "calibrated": time.time(),
+    }
+
+async def check_delivery(client, profile, color=(0, 255, 0), confirm=None) -> bool:
+    """
+    Clears the display with writes with response, fills it in `color` at
+    the settings of `profile` and returns whether every pixel arrived. A
+    failed write fails the check.
+    `confirm` is called with the color and returns whether the whole
+    display shows it; by default the user is asked.
+    """
+    indices = np.arange(PIXEL_COUNT)
+    try:
+        for command in iter_commands(encode_set_pixels(indices, np.zeros((PIXEL_COUNT, 3)))):
+            await client.write_gatt_char(CHARACTERISTIC_UUID, command, response=True)
+        for data in iter_packed(encode_set_pixels(indices, [color] * PIXEL_COUNT), profile["write_size"]):
+            await client.write_gatt_char(CHARACTERISTIC_UUID, data, response=profile["response"])
+            await asyncio.sleep(profile["gap"])
+        await client.write_gatt_char(CHARACTERISTIC_UUID, data, response=True)
+    except Exception as e:
+        print(f"Write failed: {e}")
+        return False
+
+    if confirm is None:
+        def confirm(color):
+            answer = input(f"Is the whole display lit in {color}? [y/n] ")
+            return answer.strip().lower().startswith("y")
+    return bool(confirm(color))
+
+async def choose_profile(client, results, confirm=None) -> dict:
+    """
+    Returns the profile of the fastest stable setting that passes
+    check_delivery, or None. Settings that fail are marked unstable.
+    """
+    while True:
+        best = fastest(results)
+        if best is None:
+            return None
+        profile = best_profile([best])
+        if await check_delivery(client, profile, confirm=confirm):
+            return profile
+        print(f"Pixels were lost at {profile['write_size']} bytes per write, {profile['gap'] * 1000:.1f} ms gap, "
+              f"response {profile['response']}, trying the next setting")
+        best["stable"] = False
+
+async def run(args):
+    if args.emulator:
+        from emulator import EmulatedClient
+        client = EmulatedClient(latency=args.latency, accept_concatenated=args.packed)
+
+        def verify(indices, colors):
+            return bool((client.framebuffer[indices] == colors).all())
+
+        def confirm(color):
+            return bool((client.framebuffer == color).all())
+
+        results = await sweep(client, args.packed, args.writes, verify)
+        profile = await choose_profile(client, results, confirm)
+    else:
+        from connection import DisplayConnection
+        async with DisplayConnection() as client:
+            results = await sweep(client, args.packed, args.writes)
+            profile = await choose_profile(client, results)
+
+    if profile is None:
+        print("No stable setting found, keeping the defaults")
+        return
+    print(f"Best: {profile['write_size']} bytes per write, {profile['gap'] * 1000:.1f} ms gap, "
+          f"response {profile['response']}, {profile['pixel_count']} pixels per frame at {FPS} fps")
+    if args.emulator:
+        print("Not saved, emulator run")
+    else:
+        save_profile(client.address, profile)
+        print(f"Saved profile for {client.address}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the fastest stable send parameters for the display.")
+    parser.add_argument("--packed", action="store_true", help="also try packed writes (check with packing.py first)")
+    parser.add_argument("--writes", type=int, default=50, help="writes per setting")
+    parser.add_argument("--emulator", action="store_true", help="calibrate against the emulator, without saving")
+    parser.add_argument("--latency", type=float, default=0.003, help="emulated per-write latency in seconds")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Command encoding for the MI Matrix Display.
+
+Frames are handled as NumPy arrays of shape (256, 3) with dtype uint8, in
+row-major order, so a whole picture or a whole batch of pixels can be encoded
+with a handful of array operations into a preallocated buffer instead of one
+byte at a time.
+"""
+import numpy as np
+
+# Service and characteristic UUIDs as discovered
+SERVICE_UUID = "0000ffd0-0000-1000-8000-00805f9b34fb"
+CHARACTERISTIC_UUID = "0000ffd1-0000-1000-8000-00805f9b34fb"
+
+WIDTH, HEIGHT = 16, 16
+PIXEL_COUNT = WIDTH * HEIGHT
+
+# A full picture is sent as 8 blocks of 2 rows, i.e. 32 pixels per block
+BLOCK_COUNT = 8
+BLOCK_PIXELS = PIXEL_COUNT // BLOCK_COUNT
+BLOCK_COMMAND_SIZE = 3 + BLOCK_PIXELS * 3 + 1
+PIXEL_COMMAND_SIZE = 10
+
+POWER_OFF_COMMAND = bytes.fromhex("bcff00ff55")
+POWER_ON_COMMAND = bytes.fromhex("bcff010055")
+GRAFFITI_COMMANDS = [bytes.fromhex("bc00010155"), bytes.fromhex("bc000d0d55")]
+SLIDESHOW_COMMAND = bytes.fromhex("bc00121255")
+START_PICTURE_COMMAND = bytes.fromhex("bc0ff1080855")
+END_PICTURE_COMMAND = bytes.fromhex("bc0ff2080955")
+# Wrapped around a picture to save it to the device, see store_image_commands.txt
+STORE_BEGIN_COMMAND = bytes.fromhex("bc0011f10355")
+STORE_END_COMMAND = bytes.fromhex("bc0011f20455")
+
+# The "end" byte of a set pixel command, see get_set_pixel_command
+PIXEL_END_INDEX = (np.arange(PIXEL_COUNT) + 1) % 256
+PIXEL_END_INDEX[0] = 0xFF
+PIXEL_END_INDEX = PIXEL_END_INDEX.astype(np.uint8)
+
+def to_frame(picture) -> np.ndarray:
+    """
+    Converts a picture to a (256, 3) uint8 array.
+
+    Accepts a list of 256 (r, g, b) tuples, nested rows of [r, g, b] lists
+    (like plasma.display_pixels) or any array with 768 values. Values are
+    masked to 0-255 the same way the byte-wise builders did. Arrays that are
+    already in the right format are returned as is, without copying.
+    """
+    frame = np.asarray(picture)
+    if frame.dtype != np.uint8:
+        frame = (frame.astype(np.int64) & 0xFF).astype(np.uint8)
+    if frame.size != PIXEL_COUNT * 3:
+        raise ValueError("picture must contain exactly 256 pixels.")
+    return frame.reshape(PIXEL_COUNT, 3)
+
+def new_picture_buffer() -> np.ndarray:
+    """
+    Allocates an (8, 100) buffer with the block headers and terminators
+    already filled in, ready to be passed as `out` to encode_full_picture.
+    """
+    out = np.empty((BLOCK_COUNT, BLOCK_COMMAND_SIZE), dtype=np.uint8)
+    out[:, 0] = 0xBC
+    out[:, 1] = 0x0F
+    out[:, 2] = np.arange(1, BLOCK_COUNT + 1)
+    out[:, -1] = 0x55
+    return out
+
+def encode_full_picture(picture, out=None) -> np.ndarray:
+    """
+    Encodes a whole 16x16 picture into the eight full-picture block commands.
+
+    Returns an (8, 100) uint8 array where row i is the command for block i:
+      - Header (3 bytes): 0xBC 0x0F block_index+1
+      - Pixel Data (96 bytes): 32 pixels x 3 bytes per pixel (RGB)
+      - Terminator (1 byte): 0x55
+
+    `out` should be a buffer from new_picture_buffer; only the pixel data is
+    written into it, so reusing one buffer per sender avoids all allocation.
+    """
+    frame = to_frame(picture)
+    if out is None:
+        out = new_picture_buffer()
+    out[:, 3:-1] = frame.reshape(BLOCK_COUNT, BLOCK_PIXELS * 3)
+    return out
+
+def new_pixel_buffer(count: int) -> np.ndarray:
+    """
+    Allocates a (count, 10) buffer with the fixed bytes of the set pixel
+    command filled in, ready to be passed as `out` to encode_set_pixels.
+    """
+    out = np.empty((count, PIXEL_COMMAND_SIZE), dtype=np.uint8)
+    out[:, 0:4] = (0xBC, 0x01, 0x01, 0x00)
+    out[:, 9] = 0x55
+    return out
+
+def encode_set_pixels(indices, colors, out=None) -> np.ndarray:
+    """
+    Encodes a batch of graffiti mode set pixel commands.
+
+    `indices` are pixel positions (0-255) and `colors` the matching (r, g, b)
+    values. Returns an (n, 10) uint8 array with one command per row. When
+    `out` is given it must have at least n rows and a view of its first n
+    rows is returned.
+    """
+    indices = np.asarray(indices, dtype=np.intp).reshape(-1)
+    colors = np.asarray(colors)
+    if colors.dtype != np.uint8:
+        colors = (colors.astype(np.int64) & 0xFF).astype(np.uint8)
+    colors = colors.reshape(-1, 3)
+    if len(colors) != len(indices):
+        raise ValueError("indices and colors must have the same length.")
+    count = len(indices)
+    if out is None:
+        out = new_pixel_buffer(count)
+    elif len(out) < count:
+        raise ValueError("out is too small for the number of pixels.")
+    out = out[:count]
+    out[:, 4] = indices
+    out[:, 5:8] = colors
+    out[:, 8] = PIXEL_END_INDEX[indices]
+    return out
+
+def encode_frame_pixels(picture, indices, out=None) -> np.ndarray:
+    """
+    Encodes set pixel commands for the given positions of a picture.
+    """
+    indices = np.asarray(indices, dtype=np.intp).reshape(-1)
+    return encode_set_pixels(indices, to_frame(picture)[indices], out)
+
+def iter_commands(buffer: np.ndarray):
+    """
+    Yields each row of an encoded command buffer as a memoryview, which can
+    be passed straight to write_gatt_char without copying.
+    """
+    for row in buffer:
+        yield row.data
+
+def get_full_picture_command(block_index: int, block_pixels: list) -> bytearray:
+    """
+    Constructs a full-picture update command for a block of pixels.
+
+    The command is 100 bytes in total:
+      - Header (3 bytes):
+          Byte 0: 0xBC (command identifier)
+          Byte 1: 0x0F (full-picture update indicator)
+          Byte 2: block_index + 1 (1 to 8)
+      - Pixel Data (96 bytes): 32 pixels × 3 bytes per pixel (RGB)
+      - Terminator (1 byte): 0x55
+
+    `block_pixels` should be a list of exactly 32 (r, g, b) tuples.
+    """
+    if len(block_pixels) != BLOCK_PIXELS:
+        raise ValueError("block_pixels must contain exactly 32 pixels.")
+
+    pixels = np.asarray(block_pixels).astype(np.int64) & 0xFF
+    command = bytearray(BLOCK_COMMAND_SIZE)
+    command[0] = 0xBC
+    command[1] = 0x0F
+    command[2] = (block_index + 1) & 0xFF
+    command[3:-1] = pixels.astype(np.uint8).tobytes()
+    command[-1] = 0x55
+    return command
+
+def get_set_pixel_command(pixel_index: int, r: int, g: int, b: int) -> bytearray:
+    """
+    Constructs a command to set a pixel on the MI Matrix Display.
+
+    Command structure (10 bytes):
+      Byte 0: 0xBC            -> Command identifier.
+      Byte 1: 0x01            -> Fixed parameter.
+      Byte 2: 0x01            -> Fixed parameter.
+      Byte 3: 0x00            -> Fixed parameter.
+      Byte 4: pixel_index     -> Pixel index (0-255).
+      Byte 5: r               -> Red (0-255).
+      Byte 6: g               -> Green (0-255).
+      Byte 7: b               -> Blue (0-255).
+      Byte 8: end_index       -> Typically pixel_index + 1 (special-case for 255).
+      Byte 9: 0x55            -> Terminator.
+    """
+    return bytearray([
+        0xBC, 0x01, 0x01, 0x00,
+        pixel_index,
+        r, g, b,
+        PIXEL_END_INDEX[pixel_index],
+        0x55
+    ])
+
+def block_checksum(command) -> int:
+    """
+    Returns the checksum byte the vendor app appends to block commands (the
+    byte before the 0x55 terminator): the sum of all bytes after 0xBC.
+    The display also accepts block commands without it.
+    """
+    return sum(command[1:-2]) & 0xFF
+
+def decode_command(data) -> tuple:
+    """
+    Decodes a single command into a (kind, fields) tuple.
+
+    Kinds are "power", "mode", "store", "pixel", "picture_start",
+    "picture_end", "block", "animation_start", "animation_end",
+    "animation_block" and "unknown". Block commands are accepted both with
+    and without the vendor checksum byte.
+    """
+    data = bytes(data)
+    if len(data) < 5 or data[0] != 0xBC or data[-1] != 0x55:
+        return "unknown", {"data": data}
+    group, a, b = data[1], data[2], data[3]
+
+    if group == 0xFF and len(data) == 5:
+        return "power", {"on": a == 0x01}
+    if group == 0x00 and len(data) == 5:
+        return "mode", {"code": a}
+    if group == 0x00 and a == 0x11 and len(data) == 6:
+        return "store", {"begin": b == 0xF1}
+    if group == 0x01 and len(data) == PIXEL_COMMAND_SIZE:
+        return "pixel", {"index": data[4], "color": tuple(data[5:8])}
+    if group == 0x0F and len(data) == 6:
+        return ("picture_start" if a == 0xF1 else "picture_end"), {}
+    if group == 0x0F and len(data) in (BLOCK_COMMAND_SIZE, BLOCK_COMMAND_SIZE + 1) and 1 <= a <= BLOCK_COUNT:
+        return "block", {
+            "index": a - 1,
+            "pixels": data[3:3 + BLOCK_PIXELS * 3],
+            "checksum": data[-2] if len(data) > BLOCK_COMMAND_SIZE else None,
+        }
+    if group == 0x02 and len(data) == 6:
+        return ("animation_start" if a == 0xF1 else "animation_end"), {}
+    if group == 0x02 and len(data) >= 4 + BLOCK_PIXELS * 3 + 1 and 1 <= b <= BLOCK_COUNT:
+        return "animation_block", {"frame": a, "index": b - 1, "pixels": data[4:4 + BLOCK_PIXELS * 3]}
+    return "unknown", {"data": data}
+
+def command_size(data, start=0) -> int:
+    """
+    Returns the size of the command starting at `start` in a buffer of
+    concatenated commands, from its kind. Unrecognized commands extend to
+    the next 0x55 that is followed by 0xBC or the end of the buffer.
+    """
+    end = len(data)
+    if end - start >= 3 and data[start] == 0xBC:
+        group, a = data[start + 1], data[start + 2]
+        if group == 0x01:
+            return PIXEL_COMMAND_SIZE
+        if group in (0x00, 0xFF) and end - start >= 5 and data[start + 4] == 0x55:
+            return 5
+        if group in (0x00, 0x0F, 0x02) and end - start >= 6 and data[start + 5] == 0x55:
+            return 6
+        if group == 0x0F and 1 <= a <= BLOCK_COUNT:
+            # With or without the vendor checksum byte. A checksum can be
+            # 0x55 itself, then the block only ends there if no second 0x55
+            # closes a checksummed block right after it
+            checked = start + BLOCK_COMMAND_SIZE + 1
+            if checked <= end and data[checked - 1] == 0x55 and (checked == end or data[checked] == 0xBC):
+                return BLOCK_COMMAND_SIZE + 1
+            if end - start >= BLOCK_COMMAND_SIZE and data[start + BLOCK_COMMAND_SIZE - 1] == 0x55:
+                return BLOCK_COMMAND_SIZE
+            return BLOCK_COMMAND_SIZE + 1
+    for index in range(start + 1, end):
+        if data[index] == 0x55 and (index + 1 == end or data[index + 1] == 0xBC):
+            return index + 1 - start
+    return end - start
+
+def split_commands(data) -> list:
+    """
+    Splits a buffer of concatenated commands into the single commands.
+    """
+    commands = []
+    start = 0
+    while start < len(data):
+        size = command_size(data, start)
+        commands.append(bytes(data[start:start + size]))
+        start += size
+    return commands
@@ -0,0 +1,225 @@
+"""
+Layered compositing with dirty-rectangle tracking.
+
+A Compositor stacks layers (a background effect, text, sprites, overlays)
+bottom to top. Each layer is a pair of flat buffers, an RGB uint8 array and
+an alpha uint8 array, and remembers the rectangle changed since the last
+composite. compose() only re-blends the union of those rectangles, in bulk,
+and the send stage only diffs and transmits that region.
+
+Rectangles are (x0, y0, x1, y1) tuples with exclusive x1 and y1.
+
+Usage:
+    compositor = Compositor()
+    background = compositor.add_layer()
+    text = compositor.add_layer()
+    background.fill((0, 0, 80))
+    text.draw_mask(FONT.render("HI"), 4, 5, (255, 255, 255))
+    await compositor.send(client)
+"""
+import numpy as np
+from codec import WIDTH, HEIGHT
+from planner import HybridStream
+
+def union(a, b):
+    """
+    Returns the bounding rectangle of two rectangles, either may be None.
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def clip(rect, width, height):
+    """
+    Clips a rectangle to the canvas, returning None if nothing is left.
+    """
+    x0, y0, x1, y1 = max(rect[0], 0), max(rect[1], 0), min(rect[2], width), min(rect[3], height)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+class Layer:
+    """
+    One layer of a Compositor. Draw into it through its methods, which
+    record the dirty rectangle; after writing to `rgb` or `alpha` directly,
+    call mark_dirty.
+    """
+    def __init__(self, width=WIDTH, height=HEIGHT, opacity=1.0):
+        self.width = width
+        self.height = height
+        self.rgb = np.zeros((height, width, 3), dtype=np.uint8)
+        self.alpha = np.zeros((height, width), dtype=np.uint8)
+        self._opacity = opacity
+        self._visible = True
+        self.dirty = None
+
+    def mark_dirty(self, rect=None):
+        """
+        Marks a rectangle (the whole layer by default) as changed.
+        """
+        rect = clip(rect or (0, 0, self.width, self.height), self.width, self.height)
+        self.dirty = union(self.dirty, rect)
+
+    @property
+    def opacity(self):
+        return self._opacity
+
+    @opacity.setter
+    def opacity(self, value):
+        if value != self._opacity:
+            self._opacity = value
+            self.mark_dirty(self.bounds())
+
+    @property
+    def visible(self):
+        return self._visible
+
+    @visible.setter
+    def visible(self, value):
+        if value != self._visible:
+            self._visible = value
+            self.mark_dirty(self.bounds())
+
+    def bounds(self):
+        """
+        Returns the bounding rectangle of the non-transparent pixels.
+        """
+        rows = np.flatnonzero(self.alpha.any(axis=1))
+        if len(rows) == 0:
+            return None
+        columns = np.flatnonzero(self.alpha.any(axis=0))
+        return (int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1)
+
+    def clear(self, rect=None):
+        rect = clip(rect or (0, 0, self.width, self.height), self.width, self.height)
+        if rect is None:
+            return
+        x0, y0, x1, y1 = rect
+        if self.alpha[y0:y1, x0:x1].any():
+            self.alpha[y0:y1, x0:x1] = 0
+            self.mark_dirty(rect)
+
+    def fill(self, color, alpha=255, rect=None):
+        rect = clip(rect or (0, 0, self.width, self.height), self.width, self.height)
+        if rect is None:
+            return
+        x0, y0, x1, y1 = rect
+        self.rgb[y0:y1, x0:x1] = color
+        self.alpha[y0:y1, x0:x1] = alpha
+        self.mark_dirty(rect)
+
+    def draw_image(self, image, x, y, alpha=None):
+        """
+        Copies an (h, w, 3) image with an optional (h, w) uint8 alpha at
+        (x, y), clipped to the layer. Only the pixels that actually change
+        are marked dirty.
+        """
+        image = np.asarray(image, dtype=np.uint8)
+        h, w = image.shape[:2]
+        rect = clip((x, y, x + w, y + h), self.width, self.height)
+        if rect is None:
+            return
+        x0, y0, x1, y1 = rect
+        source = image[y0 - y:y1 - y, x0 - x:x1 - x]
+        source_alpha = 255 if alpha is None else np.asarray(alpha, dtype=np.uint8)[y0 - y:y1 - y, x0 - x:x1 - x]
+        changed = (self.rgb[y0:y1, x0:x1] != source).any(axis=2) | (self.alpha[y0:y1, x0:x1] != source_alpha)
+        if not changed.any():
+            return
+        self.rgb[y0:y1, x0:x1] = source
+        self.alpha[y0:y1, x0:x1] = source_alpha
+        rows, columns = np.flatnonzero(changed.any(axis=1)), np.flatnonzero(changed.any(axis=0))
+        self.mark_dirty((x0 + columns[0], y0 + rows[0], x0 + columns[-1] + 1, y0 + rows[-1] + 1))
+
+    def draw_mask(self, mask, x, y, color):
+        """
+        Draws a float alpha mask (e.g. text.Font.render) in a solid color.
+        """
+        mask = np.asarray(mask)
+        image = np.empty(mask.shape + (3,), dtype=np.uint8)
+        image[:] = color
+        self.draw_image(image, x, y, (mask * 255).round().astype(np.uint8))
+
+class Compositor:
+    """
+    Blends layers bottom to top over a solid background into `frame`, a
+    (height, width, 3) uint8 array.
+    """
+    def __init__(self, width=WIDTH, height=HEIGHT, background=(0, 0, 0)):
+        self.width = width
+        self.height = height
+        self.background = np.asarray(background, dtype=np.float32)
+        self.layers = []
+        self.frame = np.empty((height, width, 3), dtype=np.uint8)
+        self.frame[:] = background
+        # Changes that belong to no layer, like a removed layer
+        self._dirty = None
+        self.stream = None
+        self._stream_client = None
+
+    def add_layer(self, opacity=1.0) -> Layer:
+        layer = Layer(self.width, self.height, opacity)
+        self.layers.append(layer)
+        return layer
+
+    def remove_layer(self, layer):
+        self.layers.remove(layer)
+        bounds = layer.bounds()
+        if bounds is not None:
+            self.invalidate(bounds)
+
+    def invalidate(self, rect=None):
+        """
+        Forces a rectangle (everything by default) to be recomposed.
+        """
+        rect = clip(rect or (0, 0, self.width, self.height), self.width, self.height)
+        self._dirty = union(self._dirty, rect)
+
+    def dirty(self):
+        """
+        Returns the union of the dirty rectangles of all layers and the
+        invalidated rectangles, or None.
+        """
+        rect = self._dirty
+        for layer in self.layers:
+            rect = union(rect, layer.dirty)
+        return rect
+
+    def compose(self):
+        """
+        Recomposes the dirty region into `frame` and returns that region, or
+        None if nothing changed.
+        """
+        rect = self.dirty()
+        if rect is None:
+            return None
+        self._dirty = None
+        x0, y0, x1, y1 = rect
+        out = np.empty((y1 - y0, x1 - x0, 3), dtype=np.float32)
+        out[:] = self.background
+        for layer in self.layers:
+            layer.dirty = None
+            if not layer.visible or layer.opacity <= 0:
+                continue
+            alpha = layer.alpha[y0:y1, x0:x1]
+            if not alpha.any():
+                continue
+            a = alpha[..., None] * np.float32(layer.opacity / 255)
+            out += (layer.rgb[y0:y1, x0:x1] - out) * a
+        self.frame[y0:y1, x0:x1] = out.round()
+        return rect
+
+    async def send(self, client):
+        """
+        Composes and sends the changes to the display with a HybridStream,
+        which only diffs the dirty region. Returns the plan sent, or None.
+        """
+        if self.stream is None or self._stream_client is not client:
+            self.stream = HybridStream(client)
+            self._stream_client = client
+            self.invalidate()
+        rect = self.compose()
+        if rect is None:
+            return None
+        return await self.stream.send(self.frame, region=rect)
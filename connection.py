@@ -0,0 +1,225 @@
+"""
+Connection management for the MI Matrix Display.
+
+The address of the display is cached on disk after the first successful
+connection, so later runs connect to it directly without scanning. Scanning
+is only a fallback when the cached address fails, and it uses a detection
+callback that stops as soon as the display is seen. DisplayConnection also
+reconnects automatically, with backoff, when the link drops.
+"""
+import asyncio
+import json
+import os
+from bleak import BleakScanner, BleakClient, BleakError
+import metrics
+
+DEVICE_NAME = "MI Matrix Display"
+ADDRESS_CACHE = os.path.expanduser("~/.mi_led_display.json")
+
+async def find_device(name=DEVICE_NAME, timeout=20, address=None):
+    """
+    Scans for a device called `name` (or with the given address) and returns
+    it as soon as it is seen, or None after `timeout` seconds.
+    """
+    devices = await find_devices(name, 1, timeout, address)
+    return devices[0] if devices else None
+
+async def find_devices(name=DEVICE_NAME, count=1, timeout=20, address=None):
+    """
+    Scans until `count` devices called `name` have been seen, or until
+    `timeout` seconds have passed, and returns the devices found. With
+    `address` set only the device with that address is looked for.
+    """
+    found = asyncio.Event()
+    target = {}
+
+    def detection_callback(device, advertisement_data):
+        if device.address in target:
+            return
+        if address is not None:
+            matches = device.address.upper() == address.upper()
+        else:
+            matches = device.name == name or advertisement_data.local_name == name
+        if matches:
+            target[device.address] = device
+            if len(target) >= count:
+                found.set()
+
+    print("Scanning for BLE devices...")
+    scanner = BleakScanner(detection_callback)
+    await scanner.start()
+    try:
+        await asyncio.wait_for(found.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        await scanner.stop()
+    return list(target.values())
+
+def load_cached_address(name=DEVICE_NAME, path=ADDRESS_CACHE):
+    """
+    Returns the cached address of the device called `name`, if any.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f).get(name)
+    except (OSError, ValueError):
+        return None
+
+def save_cached_address(address, name=DEVICE_NAME, path=ADDRESS_CACHE):
+    """
+    Stores the address of the device called `name` in the cache file.
+    """
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache[name] = address
+    with open(path, "w") as f:
+        json.dump(cache, f, indent=2)
+
+class DisplayConnection:
+    """
+    A connection to the display that survives drops.
+
+    Use it as an async context manager or call connect()/disconnect(). It
+    can be passed wherever a client is expected: write_gatt_char waits for a
+    reconnect if the link is down. `on_connect` is an optional coroutine
+    function called with the new client after every (re)connect, e.g. to
+    send the graffiti mode init commands again.
+
+    With `address` set the connection is pinned to that display, which is
+    needed when several displays with the same name are in range. The
+    fallback scan then only looks for that address and the cache is not
+    touched.
+    """
+    def __init__(self, name=DEVICE_NAME, cache_path=ADDRESS_CACHE, connect_timeout=5.0,
+                 scan_timeout=20.0, backoff=0.25, max_backoff=8.0, auto_reconnect=True, on_connect=None,
+                 address=None):
+        self.name = name
+        self.cache_path = cache_path
+        self.connect_timeout = connect_timeout
+        self.scan_timeout = scan_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.auto_reconnect = auto_reconnect
+        self.on_connect = on_connect
+        self.client = None
+        self.pinned = address is not None
+        self.address = address if self.pinned else load_cached_address(name, cache_path)
+        self.connects = 0
+        self.disconnects = 0
+        self._closing = False
+        self._lock = asyncio.Lock()
+        self._reconnect_task = None
+
+    @property
+    def is_connected(self):
+        return self.client is not None and self.client.is_connected
+
+    @property
+    def services(self):
+        return self.client.services
+
+    @property
+    def mtu_size(self):
+        return self.client.mtu_size
+
+    def _disconnected(self, client):
+        if client is not self.client:
+            return
+        self.disconnects += 1
+        if metrics.recorder is not None:
+            metrics.recorder.disconnect()
+        print("Lost connection")
+        if self.auto_reconnect and not self._closing and self._reconnect_task is None:
+            self._reconnect_task = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self):
+        try:
+            await self.ensure_connected()
+        except Exception as e:
+            print(f"Reconnect failed: {e}")
+        finally:
+            self._reconnect_task = None
+
+    async def _connect_to(self, address_or_device):
+        client = BleakClient(address_or_device, disconnected_callback=self._disconnected,
+                             timeout=self.connect_timeout)
+        await client.connect()
+        return client
+
+    async def _connect_once(self):
+        """
+        Connects to the cached address, falling back to a scan.
+        """
+        if self.address:
+            try:
+                return await self._connect_to(self.address)
+            except (BleakError, asyncio.TimeoutError, OSError) as e:
+                print(f"Could not connect to cached address {self.address}: {e}")
+
+        device = await find_device(self.name, self.scan_timeout, self.address if self.pinned else None)
+        if device is None:
+            raise BleakError(f"{self.name} ({self.address or 'any address'}) not found.")
+        client = await self._connect_to(device)
+        if not self.pinned:
+            self.address = device.address
+            save_cached_address(device.address, self.name, self.cache_path)
+        return client
+
+    async def connect(self, retries=None):
+        """
+        Connects to the display, retrying with exponential backoff. With
+        `retries` set, gives up after that many failed attempts.
+        """
+        async with self._lock:
+            if self.is_connected:
+                return self.client
+            delay = self.backoff
+            attempt = 0
+            while True:
+                try:
+                    print(f"Connecting to {self.name} ({self.address or 'unknown address'})...")
+                    self.client = await self._connect_once()
+                    break
+                except (BleakError, asyncio.TimeoutError, OSError) as e:
+                    attempt += 1
+                    if retries is not None and attempt > retries:
+                        raise
+                    print(f"Connection failed ({e}), retrying in {delay:.2f} s")
+                    await asyncio.sleep(delay)
+                    delay = min(self.max_backoff, delay * 2)
+            self.connects += 1
+            if metrics.recorder is not None:
+                metrics.recorder.connect()
+            print("Connected!")
+            if self.on_connect is not None:
+                await self.on_connect(self.client)
+            return self.client
+
+    async def ensure_connected(self):
+        if self.is_connected:
+            return self.client
+        return await self.connect()
+
+    async def disconnect(self):
+        self._closing = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        if self.client is not None:
+            await self.client.disconnect()
+        self.client = None
+
+    async def write_gatt_char(self, char_uuid, data, response=None):
+        client = await self.ensure_connected()
+        await client.write_gatt_char(char_uuid, data, response=response)
+
+    async def __aenter__(self):
+        self._closing = False
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
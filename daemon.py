@@ -0,0 +1,358 @@
+"""
+Local display daemon that owns the BLE link.
+
+The daemon connects to the display once and keeps the connection, and local
+clients send it frames, pixel updates and raw commands over a Unix socket.
+Frames and pixel updates from all clients are merged into one target frame,
+and a single sender task streams the difference between what the display
+shows and the target with a HybridStream over the paced connection, so
+updates that arrive faster than the link can take them coalesce instead of
+queueing up. Raw commands are passed through in the order they arrive,
+relative to the updates.
+
+Messages in both directions are a 3-byte header, the message type (uint8)
+and payload length (uint16, little endian), followed by the payload:
+
+  - FRAME (0x01): 768 bytes, a whole 16x16 RGB frame in row-major order
+  - PIXELS (0x02): n x 4 bytes of (index, r, g, b)
+  - COMMAND (0x03): one raw display command
+  - STATS (0x04): empty, answered with a STATS message holding JSON
+
+Usage:
+    python3 daemon.py
+    python3 daemon.py --emulator
+    python3 daemon.py --command bcff00ff55    # send a command through a running daemon
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import struct
+import tempfile
+import numpy as np
+from codec import CHARACTERISTIC_UUID, PIXEL_COUNT, decode_command, split_commands, to_frame
+from pacing import paced
+from planner import BLOCK, PIXEL, HybridStream
+
+SOCKET_PATH = os.path.join(os.environ.get("XDG_RUNTIME_DIR", tempfile.gettempdir()), "mi-led-display.sock")
+
+HEADER = struct.Struct("<BH")
+FRAME = 0x01
+PIXELS = 0x02
+COMMAND = 0x03
+STATS = 0x04
+
+# Queued events before the daemon stops reading from its clients
+MAX_PENDING = 1024
+
+def encode_message(kind, payload=b"") -> bytes:
+    return HEADER.pack(kind, len(payload)) + bytes(payload)
+
+async def read_message(reader):
+    """
+    Reads one message and returns (kind, payload), or None at end of stream.
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+        kind, length = HEADER.unpack(header)
+        return kind, await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+async def daemon_running(path=SOCKET_PATH) -> bool:
+    """
+    Returns whether a daemon is listening on the socket at `path`.
+    """
+    try:
+        _, writer = await asyncio.open_unix_connection(path)
+    except OSError:
+        return False
+    writer.close()
+    return True
+
+class DisplayDaemon:
+    """
+    Serves one display connection to any number of local clients.
+
+    `client` is a connected client (a DisplayConnection, or an
+    EmulatedClient for testing).
+
+    Messages become events in one ordered queue. Frame and pixel updates
+    are merged into `target` and need at most one pending frame event at
+    the end of the queue; a command queued after a frame event freezes that
+    event's frame, so a client's updates and commands go out in the order
+    they were sent. When `max_pending` events are queued, reading from the
+    clients pauses until the sender catches up.
+    """
+    def __init__(self, client, path=SOCKET_PATH, max_pending=MAX_PENDING):
+        self.client = client
+        self.path = path
+        self.max_pending = max_pending
+        self.pacer = paced(client)
+        # The pacer spaces pixel and block writes, mode switches keep their delays
+        self.stream = HybridStream(self.pacer, delays={PIXEL: 0, BLOCK: 0})
+        self.target = np.zeros((PIXEL_COUNT, 3), dtype=np.uint8)
+        # [kind, data] events, data is None for a frame event sending the live target
+        self.events = collections.deque()
+        self.changed = asyncio.Event()
+        self.space = asyncio.Event()
+        self.server = None
+        self.sender = None
+        self.clients = 0
+        self.messages = 0
+        self.frames_sent = 0
+        self.commands_sent = 0
+        self.updates_merged = 0
+        self.resets = 0
+
+    def _frame_pending(self) -> bool:
+        return bool(self.events) and self.events[-1][0] == FRAME and self.events[-1][1] is None
+
+    def _queue_frame(self):
+        if self._frame_pending():
+            self.updates_merged += 1
+        else:
+            self.events.append([FRAME, None])
+        self.changed.set()
+
+    def reset(self):
+        """
+        Forgets what the display shows, e.g. after a reconnect, so the
+        target is sent again in full.
+        """
+        self.stream.reset()
+        if not self._frame_pending():
+            self.events.append([FRAME, None])
+        self.changed.set()
+
+    def handle(self, kind, payload):
+        """
+        Applies one client message. Returns a reply payload for STATS.
+        """
+        self.messages += 1
+        if kind == FRAME and len(payload) == PIXEL_COUNT * 3:
+            self.target[:] = to_frame(np.frombuffer(payload, dtype=np.uint8))
+            self._queue_frame()
+        elif kind == PIXELS and len(payload) % 4 == 0:
+            pixels = np.frombuffer(payload, dtype=np.uint8).reshape(-1, 4)
+            self.target[pixels[:, 0]] = pixels[:, 1:]
+            self._queue_frame()
+        elif kind == COMMAND and payload:
+            if self._frame_pending():
+                # Later updates must not go out before this command
+                self.events[-1][1] = self.target.copy()
+            self.events.append([COMMAND, bytes(payload)])
+            self.changed.set()
+        elif kind == STATS:
+            return json.dumps(self.stats()).encode()
+        else:
+            print(f"Ignoring message {kind:#04x} with {len(payload)} bytes")
+        return None
+
+    def _applied(self, data):
+        """
+        Updates what the stream knows the display shows after a raw write.
+        Pixel commands patch the shown and target frames, anything else
+        (modes, pictures, power, ...) makes the next frame a full one.
+        """
+        for command in split_commands(data):
+            kind, fields = decode_command(command)
+            if kind == "pixel":
+                self.target[fields["index"]] = fields["color"]
+                if self.stream.mode == PIXEL and self.stream.last_frame is not None:
+                    self.stream.last_frame[fields["index"]] = fields["color"]
+            else:
+                self.stream.reset()
+                self.resets += 1
+
+    async def serve_client(self, reader, writer):
+        self.clients += 1
+        try:
+            while True:
+                while len(self.events) >= self.max_pending:
+                    self.space.clear()
+                    await self.space.wait()
+                message = await read_message(reader)
+                if message is None:
+                    break
+                reply = self.handle(*message)
+                if reply is not None:
+                    writer.write(encode_message(STATS, reply))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+
+    async def send_loop(self):
+        """
+        Sends the queued events in order: raw commands as they are, frame
+        events as the difference to their frame.
+        """
+        while True:
+            await self.changed.wait()
+            self.changed.clear()
+            while self.events:
+                kind, data = self.events.popleft()
+                self.space.set()
+                try:
+                    if kind == COMMAND:
+                        await self.pacer.write_gatt_char(CHARACTERISTIC_UUID, data)
+                        self._applied(data)
+                        self.commands_sent += 1
+                    else:
+                        # Snapshot, messages handled during the writes change the target
+                        await self.stream.send(self.target.copy() if data is None else data)
+                        self.frames_sent += 1
+                except Exception as e:
+                    print(f"Send failed: {e}")
+                    self.reset()
+                    await asyncio.sleep(0.5)
+
+    async def start(self):
+        if os.path.exists(self.path):
+            if await daemon_running(self.path):
+                raise RuntimeError(f"A daemon is already listening on {self.path}")
+            # Left behind by a daemon that did not stop cleanly
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.serve_client, self.path)
+        self.sender = asyncio.ensure_future(self.send_loop())
+        print(f"Listening on {self.path}")
+
+    async def stop(self):
+        if self.sender is not None:
+            self.sender.cancel()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def stats(self) -> dict:
+        return {
+            "clients": self.clients,
+            "messages": self.messages,
+            "frames_sent": self.frames_sent,
+            "commands_sent": self.commands_sent,
+            "updates_merged": self.updates_merged,
+            "resets": self.resets,
+            "pending": len(self.events),
+            "pacer": self.pacer.stats(),
+        }
+
+class DaemonClient:
+    """
+    A client of a running daemon. Besides frames and pixels it has a
+    write_gatt_char method that sends raw commands, so it can stand in for
+    a BleakClient in the existing senders.
+    """
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+        self.reader = None
+        self.writer = None
+
+    @property
+    def is_connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        return True
+
+    async def disconnect(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.writer = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    async def _send(self, kind, payload=b""):
+        self.writer.write(encode_message(kind, payload))
+        await self.writer.drain()
+
+    async def send_frame(self, picture):
+        await self._send(FRAME, to_frame(picture).tobytes())
+
+    async def set_pixels(self, indices, colors):
+        pixels = np.empty((len(indices), 4), dtype=np.uint8)
+        pixels[:, 0] = indices
+        pixels[:, 1:] = colors
+        await self._send(PIXELS, pixels.tobytes())
+
+    async def write_gatt_char(self, char_uuid, data, response=None):
+        await self._send(COMMAND, data)
+
+    async def stats(self) -> dict:
+        await self._send(STATS)
+        message = await read_message(self.reader)
+        if message is None:
+            raise ConnectionError("The daemon closed the connection")
+        kind, payload = message
+        if kind != STATS:
+            raise ConnectionError(f"Expected a stats reply, got message {kind:#04x}")
+        return json.loads(payload)
+
+async def serve(args):
+    # Checked before connecting, so a second daemon never takes the link
+    if await daemon_running(args.socket):
+        print(f"A daemon is already listening on {args.socket}")
+        return
+    if args.emulator:
+        from emulator import EmulatedClient
+        client = EmulatedClient()
+        daemon = DisplayDaemon(client, args.socket)
+        await daemon.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await daemon.stop()
+        return
+
+    from connection import DisplayConnection
+    daemon = None
+
+    async def on_connect(client):
+        # After a reconnect the display state is unknown
+        if daemon is not None:
+            daemon.reset()
+
+    async with DisplayConnection(on_connect=on_connect) as connection:
+        daemon = DisplayDaemon(connection, args.socket)
+        await daemon.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await daemon.stop()
+
+async def send_command(args):
+    try:
+        async with DaemonClient(args.socket) as client:
+            if args.command:
+                await client.write_gatt_char(CHARACTERISTIC_UUID, bytes.fromhex(args.command))
+            print(json.dumps(await client.stats(), indent=2))
+    except OSError as e:
+        # ConnectionError included, no daemon or it went away
+        print(f"Could not reach the daemon on {args.socket}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the MI Matrix Display connected and serve local clients.")
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    parser.add_argument("--emulator", action="store_true", help="serve the emulator instead of a display")
+    parser.add_argument("--command", help="send a hex command to a running daemon and print its stats")
+    parser.add_argument("--stats", action="store_true", help="print the stats of a running daemon")
+    args = parser.parse_args()
+    try:
+        asyncio.run(send_command(args) if args.command or args.stats else serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Block-level delta streaming for the full-picture mode.
+
+The display keeps the last picture it was sent, so when only a few rows
+change there is no need to resend all eight blocks. A PictureStream remembers
+what was last sent over one connection and only writes the blocks whose
+pixels differ.
+"""
+import asyncio
+import weakref
+import numpy as np
+from codec import (CHARACTERISTIC_UUID, BLOCK_COUNT, START_PICTURE_COMMAND, END_PICTURE_COMMAND,
+                   encode_full_picture, new_picture_buffer, to_frame)
+
+class PictureStream:
+    """
+    Sends full pictures over one connection, writing only changed blocks.
+
+    The `bc 0f f1` start command is only sent before the first picture (or
+    after reset), and the `bc 0f f2` end command only after updates that
+    actually wrote blocks, and only if `finish` is set. Pass `started` when
+    the caller has already put the display in picture mode.
+    """
+    def __init__(self, client, block_delay=0.025, command_delay=0.002, finish=True, started=False):
+        self.client = client
+        self.block_delay = block_delay
+        self.command_delay = command_delay
+        self.finish = finish
+        self.buffer = new_picture_buffer()
+        self.last_frame = None
+        self.started = started
+
+    def reset(self):
+        """
+        Forgets what is on the display, e.g. after a reconnect or after
+        another mode has been used. The next picture is sent in full.
+        """
+        self.last_frame = None
+        self.started = False
+
+    def changed_blocks(self, picture) -> np.ndarray:
+        """
+        Returns the indices (0-7) of the blocks that differ from the last
+        picture sent.
+        """
+        frame = to_frame(picture)
+        if self.last_frame is None:
+            return np.arange(BLOCK_COUNT)
+        changed = (frame.reshape(BLOCK_COUNT, -1) != self.last_frame.reshape(BLOCK_COUNT, -1)).any(axis=1)
+        return np.flatnonzero(changed)
+
+    async def send(self, picture, force=False) -> int:
+        """
+        Sends the blocks of `picture` that changed since the last call and
+        returns how many blocks were written. With `force` all blocks are
+        sent regardless.
+        """
+        frame = to_frame(picture)
+        blocks = np.arange(BLOCK_COUNT) if force else self.changed_blocks(frame)
+        if len(blocks) == 0:
+            return 0
+
+        if not self.started:
+            await self.client.write_gatt_char(CHARACTERISTIC_UUID, START_PICTURE_COMMAND)
+            await asyncio.sleep(self.command_delay)
+            self.started = True
+
+        commands = encode_full_picture(frame, self.buffer)
+        for block_index in blocks:
+            await self.client.write_gatt_char(CHARACTERISTIC_UUID, commands[block_index].data)
+            await asyncio.sleep(self.block_delay)
+
+        if self.finish:
+            await self.client.write_gatt_char(CHARACTERISTIC_UUID, END_PICTURE_COMMAND)
+            await asyncio.sleep(self.command_delay)
+
+        self.last_frame = frame.copy()
+        return len(blocks)
+
+# One stream per connection, dropped together with the client. The streams
+# hold a proxy of their client, a strong reference would keep the key alive.
+_streams = weakref.WeakKeyDictionary()
+
+def get_picture_stream(client, **kwargs) -> PictureStream:
+    """
+    Returns the PictureStream for `client`, creating it on first use.
+    Keyword arguments are only used when the stream is created.
+    """
+    stream = _streams.get(client)
+    if stream is None:
+        stream = _streams[client] = PictureStream(weakref.proxy(client), **kwargs)
+    return stream
+
+async def send_picture_delta(client, picture, **kwargs) -> int:
+    """
+    Sends only the changed blocks of `picture` to `client`, see PictureStream.send.
+    """
+    return await get_picture_stream(client, **kwargs).send(picture)
@@ -1,89 +1,115 @@
 import asyncio
 import sys
+from concurrent.futures import ProcessPoolExecutor
 import time
-from PIL import Image
+import numpy as np
 from bleak import BleakScanner, BleakClient
+from animation import DEFAULT_FRAME_DURATION, EncodedAnimation, play_animation
+import image_cache
+from codec import CHARACTERISTIC_UUID, encode_full_picture, iter_commands
+from delta import get_picture_stream
+from pacing import paced
 
-# Service and characteristic UUIDs as discovered
-SERVICE_UUID = "0000ffd0-0000-1000-8000-00805f9b34fb"
-CHARACTERISTIC_UUID = "0000ffd1-0000-1000-8000-00805f9b34fb"
+def resize_frame(img):
+    """
+    Resize a PIL image to 16x16 pixels and return it as a (256, 3) uint8
+    array of RGB values in row-major order.
+    """
+    from PIL import Image
+
+    # Convert palette and transparent frames first so they resize cleanly
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA')
+    
+    # Resize the image to 16x16 pixels
+    img = img.resize((16, 16), Image.Resampling.LANCZOS)
+    
+    # Convert to RGB mode to ensure we have RGB values
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    
+    return np.asarray(img, dtype=np.uint8).reshape(256, 3)
 
-def load_and_resize_image(image_path):
+def load_animation(image_path):
     """
-    Load an image file (jpg, png, gif) and resize it to 16x16 pixels.
-    Returns a list of (r, g, b) tuples in row-major order.
+    Load all frames of an image file and resize them to 16x16 pixels.
+    Returns the list of frames and the duration of each frame in seconds.
+    A still image gives a single frame.
     """
+    # PIL is only imported when an image actually has to be decoded
+    from PIL import Image, ImageSequence
+
     try:
-        # Open the image file
         img = Image.open(image_path)
-        
-        # Handle GIF animation - just take the first frame
-        if img.format == 'GIF' and 'duration' in img.info:
-            img = img.convert('RGBA')
-        
-        # Resize the image to 16x16 pixels
-        img = img.resize((16, 16), Image.Resampling.LANCZOS)
-        
-        # Convert to RGB mode to ensure we have RGB values
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Extract RGB values for each pixel
-        picture = []
-        for y in range(16):
-            for x in range(16):
-                r, g, b = img.getpixel((x, y))
-                picture.append((r, g, b))
-        
-        return picture
+        frames = []
+        durations = []
+        for frame in ImageSequence.Iterator(img):
+            frames.append(resize_frame(frame))
+            duration = frame.info.get('duration', 0) / 1000
+            durations.append(duration if duration > 0.01 else DEFAULT_FRAME_DURATION)
+        return frames, durations
     
     except Exception as e:
-        print(f"Error loading image: {e}")
-        sys.exit(1)
+        raise ValueError(f"Error loading image: {e}") from e
 
-def get_full_picture_command(block_index: int, block_pixels: list) -> bytearray:
+def encode_animation(image_path):
     """
-    Constructs a full-picture update command for a block of pixels.
+    Decode an image file and encode it as an EncodedAnimation, without the
+    cache. This is the slow part, which main() runs in a worker process.
     """
-    if len(block_pixels) != 32:
-        raise ValueError("block_pixels must contain exactly 32 pixels.")
-    
-    header = bytearray(3)
-    header[0] = 0xBC
-    header[1] = 0x0F
-    header[2] = (block_index+1) & 0xFF  # block index (1-8)
-    
-    pixel_data = bytearray()
-    for (r, g, b) in block_pixels:
-        pixel_data.extend([r & 0xFF, g & 0xFF, b & 0xFF])
-    
-    terminator = bytearray([0x55])
-    return header + pixel_data + terminator
+    frames, durations = load_animation(image_path)
+    return EncodedAnimation.from_frames(frames, durations)
+
+def store_in_cache(key, animation):
+    try:
+        image_cache.store(key, animation)
+    except OSError as e:
+        print(f"Could not cache image: {e}")
+
+def load_encoded_animation(image_path, use_cache=True):
+    """
+    Load an image file as an EncodedAnimation, from the on-disk cache when
+    the same file has been encoded before. Only a cache miss decodes the
+    file, and then stores the result for next time.
+    """
+    key = image_cache.cache_key(image_path) if use_cache else None
+    if key is not None:
+        animation = image_cache.load(key)
+        if animation is not None:
+            return animation
+
+    animation = encode_animation(image_path)
+    if key is not None:
+        store_in_cache(key, animation)
+    return animation
 
 async def send_command(client, hex_cmd):
     """Send a raw command to the device"""
     data = bytes.fromhex(hex_cmd)
-    await client.write_gatt_char(CHARACTERISTIC_UUID, data)
-    await asyncio.sleep(0.02)  # Minimal delay
+    await paced(client).write_gatt_char(CHARACTERISTIC_UUID, data)
 
-async def send_image_blocks_only(client, picture):
+async def send_image_blocks_only(client, picture, delta=False):
     """
     Send only the image data blocks in rapid succession.
     No initialization or finalization commands.
+    With `delta` only the blocks that changed since the last call are sent.
     """
-    for block_index in range(8):
-        start = block_index * 32
-        end = start + 32
-        block_pixels = picture[start:end]
-        command = get_full_picture_command(block_index, block_pixels)
+    client = paced(client)
+    if delta:
+        stream = get_picture_stream(client, block_delay=0, finish=False, started=True)
+        await stream.send(picture)
+        return
+
+    for command in iter_commands(encode_full_picture(picture)):
         await client.write_gatt_char(CHARACTERISTIC_UUID, command)
-        await asyncio.sleep(0.02)  # Minimal delay between blocks
 
-async def continuous_refresh(client, picture):
+async def continuous_refresh(client, picture, delta=False):
     """
     Continuously refresh the display with extremely rapid updates.
     This tries to create a persistent display by sending refreshes so
-    quickly that the blank period isn't noticeable.
+    quickly that the blank period isn't noticeable. With `delta` a refresh
+    only writes the blocks that changed, so an unchanged picture is only
+    written once.
     """
     start_time = time.time()
     count = 0
@@ -95,7 +121,7 @@ async def continuous_refresh(client, picture):
         await send_command(client, "bc0ff1080855")  # Start image mode
 
         while True:
-            await send_image_blocks_only(client, picture)
+            await send_image_blocks_only(client, picture, delta)
             
             # Very short delay to prevent overwhelming the BLE connection
             await asyncio.sleep(10.0)
@@ -108,28 +134,53 @@ async def continuous_refresh(client, picture):
 
 async def main():
     # Check if image file path is provided
-    if len(sys.argv) != 2:
-        print("Usage: python image_to_matrix.py <image_file>")
+    args = [arg for arg in sys.argv[1:] if arg != "--delta"]
+    if len(args) != 1:
+        print("Usage: python draw_file.py <image_file> [--delta]")
         print("Supported formats: JPG, PNG, GIF")
         return
     
-    image_path = sys.argv[1]
+    image_path = args[0]
+    delta = "--delta" in sys.argv[1:]
     
-    # Load and resize the image
+    # A cache hit is only a memory map, anything else is decoded in a
+    # worker process while scanning so it never blocks the event loop
     print(f"Loading and resizing image: {image_path}")
-    picture = load_and_resize_image(image_path)
-    print(f"Loaded image with {len(picture)} pixels")
-    
-    # Scan for BLE devices
-    print("Scanning for BLE devices...")
-    devices = await BleakScanner.discover()
-    target = None
+    try:
+        key = image_cache.cache_key(image_path)
+    except OSError as e:
+        print(f"Error loading image: {e}")
+        return
+    animation = image_cache.load(key)
+    executor = ProcessPoolExecutor(max_workers=1) if animation is None else None
+    try:
+        if executor is not None:
+            loading = asyncio.get_running_loop().run_in_executor(executor, encode_animation, image_path)
+
+        # Scan for BLE devices
+        print("Scanning for BLE devices...")
+        devices = await BleakScanner.discover()
+        target = None
+
+        for d in devices:
+            print(f"Found: {d.name} [{d.address}]")
+            if d.name and "MI Matrix Display" in d.name:
+                target = d
+                break
 
-    for d in devices:
-        print(f"Found: {d.name} [{d.address}]")
-        if d.name and "MI Matrix Display" in d.name:
-            target = d
-            break
+        if executor is not None:
+            try:
+                animation = await loading
+            except (OSError, ValueError) as e:
+                print(e)
+                return
+            store_in_cache(key, animation)
+    finally:
+        # Also when scanning fails, so the worker never outlives main()
+        if executor is not None:
+            executor.shutdown()
+    picture = animation.frame(0)
+    print(f"Loaded image with {len(picture)} pixels and {len(animation)} frame(s)")
 
     if target is None:
         print("MI Matrix Display not found.")
@@ -142,8 +193,12 @@ async def main():
             if client.is_connected:
                 print("Connected!")
                 
-                # Run in continuous refresh mode
-                await continuous_refresh(client, picture)
+                if len(animation) > 1:
+                    print("Playing animation (press Ctrl+C to exit)...")
+                    await play_animation(client, animation)
+                else:
+                    # Run in continuous refresh mode
+                    await continuous_refresh(client, picture, delta)
             else:
                 print("Failed to connect.")
     except Exception as e:
@@ -1,10 +1,10 @@
 import asyncio
+import sys
 import time
 from bleak import BleakScanner, BleakClient
-
-# Service and characteristic UUIDs as discovered
-SERVICE_UUID = "0000ffd0-0000-1000-8000-00805f9b34fb"
-CHARACTERISTIC_UUID = "0000ffd1-0000-1000-8000-00805f9b34fb"
+from codec import CHARACTERISTIC_UUID, encode_full_picture, iter_commands
+from delta import send_picture_delta
+from pacing import paced
 
 def create_picture(n : int) -> list:
     """
@@ -22,46 +22,20 @@ def create_picture(n : int) -> list:
             picture.append((r, g, b))
     return picture
 
-def get_full_picture_command(block_index: int, block_pixels: list) -> bytearray:
-    """
-    Constructs a full-picture update command for a block of pixels.
-    
-    The command is 113 bytes in total:
-      - Header (16 bytes):
-          Byte 0: 0xBC (command identifier)
-          Byte 1: 0x0F (full-picture update indicator)
-          Byte 2: block_index (0 to 7)
-          Byte 3: 0x00
-          Bytes 4-15: Reserved (set to 0x00)
-      - Pixel Data (96 bytes): 32 pixels × 3 bytes per pixel (RGB)
-      - Terminator (1 byte): 0x55
-       
-    `block_pixels` should be a list of exactly 32 (r, g, b) tuples.
-    """
-    if len(block_pixels) != 32:
-        raise ValueError("block_pixels must contain exactly 32 pixels.")
-    
-    header = bytearray(3)
-    header[0] = 0xBC
-    header[1] = 0x0F
-    header[2] = (block_index+1) & 0xFF  # block index (0-7)
-    
-    pixel_data = bytearray()
-    for (r, g, b) in block_pixels:
-        pixel_data.extend([r & 0xFF, g & 0xFF, b & 0xFF])
-    # Ensure pixel_data is 96 bytes (32 pixels * 3 bytes)
-    if len(pixel_data) != 96:
-        raise ValueError("Pixel data length is not 96 bytes.")
-
-    terminator = bytearray([0x55])
-    return header + pixel_data + terminator
-
-async def send_picture(client: BleakClient, picture: list):
+async def send_picture(client: BleakClient, picture: list, delta: bool = False):
     """
     Sends a full 16x16 picture to the display.
     The picture is a list of 256 (r, g, b) tuples in row-major order.
     The display is updated in 8 blocks (2 rows each, i.e. 32 pixels per block).
+    With `delta` only the blocks that changed since the last picture sent
+    over this connection are written.
+    Writes are paced adaptively per connection, see pacing.WritePacer.
     """
+    client = paced(client)
+    if delta:
+        await send_picture_delta(client, picture, block_delay=0, command_delay=0)
+        return
+
     # Send initialization commands (if required)
     init_commands = [
         #"bc00121255",
@@ -76,22 +50,14 @@ async def send_picture(client: BleakClient, picture: list):
         data = bytes.fromhex(cmd)
         #print(f"Sending init command: {cmd}")
         await client.write_gatt_char(CHARACTERISTIC_UUID, data)
-        await asyncio.sleep(0.002)
     #print("Initialization complete.\n")
     print("Sending full-picture update...", time.time())
 
     # For a 16x16 image, we have 16 rows.
-    # Each block covers 2 rows = 32 pixels.
-    num_blocks = 8  # 16 rows / 2 rows per block = 8 blocks
-    for block_index in range(num_blocks):
-        start = block_index * 32
-        end = start + 32
-        block_pixels = picture[start:end]
-        command = get_full_picture_command(block_index, block_pixels)
-        #print(f"Block {block_index}: Command {command.hex()}")
+    # Each block covers 2 rows = 32 pixels, all 8 blocks are encoded at once.
+    for command in iter_commands(encode_full_picture(picture)):
+        #print(f"Block command: {command.hex()}")
         await client.write_gatt_char(CHARACTERISTIC_UUID, command)
-        # Delay between blocks (adjust as needed)
-        await asyncio.sleep(0.025)
     #print("Full picture update sent!")
     # Send end commands (if required)
     end_commands = [
@@ -112,10 +78,9 @@ async def send_picture(client: BleakClient, picture: list):
             data = bytes.fromhex(cmd)
             #print(f"Sending end command: {cmd}")
             await client.write_gatt_char(CHARACTERISTIC_UUID, data)
-            await asyncio.sleep(0.002)
     #print("End complete.\n")
 
-async def main():
+async def main(delta=False):
     print("Scanning for BLE devices...")
     devices = await BleakScanner.discover()
     target = None
@@ -148,13 +113,14 @@ async def main():
             #await send_picture(client, picture0)
             while True:
                 # Send the full picture update in 8 blocks
-                await send_picture(client, picture0)
+                await send_picture(client, picture0, delta)
                 await asyncio.sleep(0.1)
-                await send_picture(client, picture1)
+                await send_picture(client, picture1, delta)
                 await asyncio.sleep(0.1)
 
         else:
             print("Failed to connect.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # --delta only writes the blocks that changed since the last picture
+    asyncio.run(main("--delta" in sys.argv[1:]))
@@ -1,41 +1,12 @@
 import asyncio
 import random
+import sys
 from bleak import BleakScanner, BleakClient
+from codec import CHARACTERISTIC_UUID, PIXEL_COMMAND_SIZE, get_set_pixel_command
+from pacing import MODE_SETTLE, paced
+from packing import pack_commands, packed_write_size
 
-# Service and characteristic UUIDs as discovered
-SERVICE_UUID = "0000ffd0-0000-1000-8000-00805f9b34fb"
-CHARACTERISTIC_UUID = "0000ffd1-0000-1000-8000-00805f9b34fb"
-
-def get_set_pixel_command(pixel_index: int, r: int, g: int, b: int) -> bytearray:
-    """
-    Constructs a command to set a pixel on the MI Matrix Display.
-    
-    Command structure (10 bytes):
-      Byte 0: 0xBC            -> Command identifier.
-      Byte 1: 0x01            -> Fixed parameter.
-      Byte 2: 0x01            -> Fixed parameter.
-      Byte 3: 0x00            -> Fixed parameter.
-      Byte 4: pixel_index     -> Pixel index (0-255).
-      Byte 5: r               -> Red (0-255).
-      Byte 6: g               -> Green (0-255).
-      Byte 7: b               -> Blue (0-255).
-      Byte 8: end_index       -> Typically pixel_index + 1 (special-case for 255).
-      Byte 9: 0x55            -> Terminator.
-    """
-    # Compute the "end" parameter
-    end_index = (pixel_index + 1) % 256
-    if pixel_index == 0:
-        end_index = 0xFF
-
-    return bytearray([
-        0xBC, 0x01, 0x01, 0x00,
-        pixel_index,
-        r, g, b,
-        end_index,
-        0x55
-    ])
-
-async def main():
+async def main(packed=False):
     retries_left = 10
     target = None
     while target is None:
@@ -65,6 +36,9 @@ async def main():
                 for char in service.characteristics:
                     print(f"  Characteristic: {char.uuid}")
 
+            # All writes are paced adaptively instead of with fixed delays
+            pacer = paced(client)
+
             # Send initialization commands before starting pixel updates.
             init_commands = [
                 #"bc00011255",
@@ -75,28 +49,37 @@ async def main():
             for cmd in init_commands:
                 data = bytes.fromhex(cmd)
                 print(f"Sending init command: {cmd}")
-                await client.write_gatt_char(CHARACTERISTIC_UUID, data)
-                await asyncio.sleep(0.2)  # Short delay between commands
+                await pacer.write_gatt_char(CHARACTERISTIC_UUID, data)
+                await asyncio.sleep(MODE_SETTLE)  # Let the display switch modes
 
             print("\nInitialization complete. Starting pixel updates...")
 
+            # With --packed as many pixel commands as fit go into each write,
+            # if the link profile or a probe shows the display takes them
+            write_size = await packed_write_size(client) if packed else PIXEL_COMMAND_SIZE
+            if packed and write_size == PIXEL_COMMAND_SIZE:
+                print("The display does not take packed writes, sending one command per write")
+            per_write = write_size // PIXEL_COMMAND_SIZE
+
             # Now continuously update pixels with random colors.
             pixel_index = 0
             screen = 0
             while True:
-                r = random.randint(0, 255)
-                g = random.randint(0, 31) + (screen % 2) * (255 - 31)
-                b = random.randint(0, 255)
+                commands = []
+                for _ in range(per_write):
+                    r = random.randint(0, 255)
+                    g = random.randint(0, 31) + (screen % 2) * (255 - 31)
+                    b = random.randint(0, 255)
 
-                command = get_set_pixel_command(pixel_index, r, g, b)
-                # print(f"Pixel {pixel_index:3}: Color ({r:02X} {g:02X} {b:02X}), Command: {command.hex()}")
-                await client.write_gatt_char(CHARACTERISTIC_UUID, command)
+                    commands.append(get_set_pixel_command(pixel_index, r, g, b))
+                    # print(f"Pixel {pixel_index:3}: Color ({r:02X} {g:02X} {b:02X}), Command: {commands[-1].hex()}")
 
-                pixel_index = (pixel_index + 1) % 256
-                if pixel_index == 0:
-                    screen += 1
-                await asyncio.sleep(0.003)
-                # Takes about 0.7 sec to update all 256 pixels
+                    pixel_index = (pixel_index + 1) % 256
+                    if pixel_index == 0:
+                        screen += 1
+                for data in pack_commands(commands, write_size):
+                    await pacer.write_gatt_char(CHARACTERISTIC_UUID, data)
+                # With a fixed 3 ms delay it takes about 0.7 sec to update all 256 pixels
                 # That's 360 pixels per second
                 # So if we want 30 fps that means we only have time to update 12 pixels per frame.. 
                 # Enough for snake, pong, etc. Perhaps tetris. But not fast scrolling backgrounds. 
@@ -104,4 +87,4 @@ async def main():
             print("Failed to connect.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(main("--packed" in sys.argv))
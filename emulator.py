@@ -0,0 +1,200 @@
+"""
+In-process emulator of the MI Matrix Display.
+
+EmulatedClient accepts the same write_gatt_char(CHARACTERISTIC_UUID, data)
+calls as a connected BleakClient, decodes the commands documented in
+protocol.txt and store_image_commands.txt and keeps the resulting display
+state, so senders can be tested and benchmarked without the hardware.
+
+Each write takes `latency` seconds plus its size divided by `bandwidth`
+(bytes per second), with an extra `response_latency` for writes with
+response. Writes are serialized like on a real link. With `realtime` off
+the time is only accounted on a virtual clock, which makes runs instant.
+"""
+import asyncio
+import random
+import numpy as np
+from codec import CHARACTERISTIC_UUID, BLOCK_PIXELS, PIXEL_COUNT, decode_command, split_commands
+
+class EmulatorError(Exception):
+    """
+    Raised for failed writes, like BleakError on a real link.
+    """
+
+class EmulatedCharacteristic:
+    def __init__(self, uuid):
+        self.uuid = uuid
+        self.properties = ["write", "write-without-response"]
+
+class EmulatedServices:
+    def __init__(self):
+        self.characteristic = EmulatedCharacteristic(CHARACTERISTIC_UUID)
+
+    def get_characteristic(self, uuid):
+        return self.characteristic if uuid == CHARACTERISTIC_UUID else None
+
+    def __iter__(self):
+        return iter([])
+
+class EmulatedClient:
+    """
+    A BleakClient stand-in backed by an emulated display.
+
+    `framebuffer` is what the display currently shows, as a (256, 3) uint8
+    array. `slots` holds pictures saved with the store sequence and
+    `animation_frames` the frames received in animation mode. `error_rate`
+    makes a share of writes raise EmulatorError and `drop_rate` makes a
+    share of writes without response silently lost (a lost write with
+    response fails instead), to exercise retry and pacing logic.
+
+    Writes larger than `mtu_size` - 3 bytes fail. With `accept_concatenated`
+    a write holding several concatenated commands applies all of them;
+    without it such a write does not decode as a command and is ignored,
+    which is what firmware that expects one command per write would do.
+    """
+    def __init__(self, latency=0.003, bandwidth=20000.0, response_latency=0.015, realtime=True,
+                 error_rate=0.0, drop_rate=0.0, seed=None, mtu_size=247, accept_concatenated=False):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.response_latency = response_latency
+        self.realtime = realtime
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.mtu_size = mtu_size
+        self.accept_concatenated = accept_concatenated
+        self.services = EmulatedServices()
+        self.is_connected = True
+        self.address = "EMULATED"
+        self.name = "MI Matrix Display"
+
+        self.clock = 0.0
+        self.writes = 0
+        self.bytes_written = 0
+        self.errors = 0
+        self.dropped = 0
+        self.commands = {}
+        self.unknown = []
+        self._lock = asyncio.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Resets the display state, like power cycling the device.
+        """
+        self.power = True
+        self.mode = None
+        self.storing = False
+        self.framebuffer = np.zeros((PIXEL_COUNT, 3), dtype=np.uint8)
+        self.slots = []
+        self.animation_frames = {}
+
+    def write_time(self, size, response=False) -> float:
+        """
+        Returns how long a write of `size` bytes takes on the emulated link.
+        """
+        seconds = self.latency + size / self.bandwidth
+        if response:
+            seconds += self.response_latency
+        return seconds
+
+    async def connect(self):
+        self.is_connected = True
+        return True
+
+    async def disconnect(self):
+        self.is_connected = False
+        return True
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    async def write_gatt_char(self, char_uuid, data, response=None):
+        if not self.is_connected:
+            raise EmulatorError("Not connected")
+        if str(char_uuid).lower() != CHARACTERISTIC_UUID:
+            raise EmulatorError(f"Characteristic {char_uuid} was not found!")
+        data = bytes(data)
+        if len(data) > self.mtu_size - 3:
+            raise EmulatorError(f"Write of {len(data)} bytes exceeds the MTU of {self.mtu_size}")
+
+        async with self._lock:
+            seconds = self.write_time(len(data), bool(response))
+            self.clock += seconds
+            if self.realtime:
+                await asyncio.sleep(seconds)
+            else:
+                await asyncio.sleep(0)
+            self.writes += 1
+            self.bytes_written += len(data)
+
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors += 1
+                raise EmulatorError("Write failed")
+            if self.drop_rate and self.random.random() < self.drop_rate:
+                self.dropped += 1
+                if response:
+                    raise EmulatorError("Write was not acknowledged")
+                return
+            if self.accept_concatenated:
+                for command in split_commands(data):
+                    self.apply(command)
+            else:
+                self.apply(data)
+
+    def apply(self, data):
+        """
+        Applies one command to the display state.
+        """
+        kind, fields = decode_command(data)
+        self.commands[kind] = self.commands.get(kind, 0) + 1
+
+        if kind == "power":
+            self.power = fields["on"]
+            if not self.power:
+                self.framebuffer[:] = 0
+        elif kind == "mode":
+            code = fields["code"]
+            if code in (0x01, 0x0D):
+                self.mode = "graffiti"
+            elif code == 0x12:
+                self.mode = "slideshow"
+                if self.slots:
+                    self.framebuffer[:] = self.slots[0]
+        elif kind == "store":
+            if fields["begin"]:
+                self.storing = True
+            elif self.storing:
+                self.slots.append(self.framebuffer.copy())
+                self.storing = False
+        elif kind == "pixel":
+            self.framebuffer[fields["index"]] = fields["color"]
+        elif kind == "picture_start":
+            self.mode = "picture"
+        elif kind == "block":
+            start = fields["index"] * BLOCK_PIXELS
+            pixels = np.frombuffer(fields["pixels"], dtype=np.uint8).reshape(-1, 3)
+            self.framebuffer[start:start + BLOCK_PIXELS] = pixels
+        elif kind == "animation_start":
+            self.mode = "animation"
+        elif kind == "animation_block":
+            frame = self.animation_frames.setdefault(fields["frame"], np.zeros((PIXEL_COUNT, 3), dtype=np.uint8))
+            start = fields["index"] * BLOCK_PIXELS
+            frame[start:start + BLOCK_PIXELS] = np.frombuffer(fields["pixels"], dtype=np.uint8).reshape(-1, 3)
+        elif kind == "unknown":
+            self.unknown.append(data)
+
+    def stats(self) -> dict:
+        return {
+            "clock": self.clock,
+            "writes": self.writes,
+            "bytes": self.bytes_written,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "commands": dict(self.commands),
+            "unknown": len(self.unknown),
+        }
@@ -0,0 +1,145 @@
+"""
+Latest-frame-wins pipeline between frame producers and the BLE sender.
+
+Producers put frames into a FrameMailbox without ever waiting on the link.
+The mailbox holds at most `capacity` pending frames; when it is full the
+oldest pending frame is dropped and counted, so a slow link never builds up
+a backlog of stale frames. A FrameSender task takes frames out and sends
+them one at a time, so a slow frame never stalls the link either.
+
+Frames are copied into preallocated slots, so putting and getting frames
+does not allocate. The frame returned by get() stays valid until the next
+call to get().
+"""
+import asyncio
+import time
+from collections import deque
+import numpy as np
+
+class FrameMailbox:
+    """
+    A bounded mailbox of frames of a fixed shape where the latest frame
+    wins. With the default capacity of 1 the sender always gets the newest
+    frame.
+    """
+    def __init__(self, shape, dtype=np.uint8, capacity=1):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1.")
+        self.capacity = capacity
+        # One slot more than the capacity, for the frame the sender is using
+        self.slots = [np.zeros(shape, dtype=dtype) for _ in range(capacity + 1)]
+        self.put_times = [0.0] * (capacity + 1)
+        self.free = list(range(capacity + 1))
+        self.pending = deque()
+        self.current = None
+        self.available = asyncio.Event()
+        self.puts = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.max_age = 0.0
+        self.total_age = 0.0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, frame) -> bool:
+        """
+        Copies `frame` into the mailbox. Returns False if an older pending
+        frame had to be dropped to make room.
+        """
+        self.puts += 1
+        if self.free:
+            slot = self.free.pop()
+            kept = True
+        else:
+            slot = self.pending.popleft()
+            self.dropped += 1
+            kept = False
+        np.copyto(self.slots[slot], frame)
+        self.put_times[slot] = time.perf_counter()
+        self.pending.append(slot)
+        self.available.set()
+        return kept
+
+    async def get(self) -> np.ndarray:
+        """
+        Waits for a pending frame and returns it. The frame returned by the
+        previous call goes back to the free slots.
+        """
+        while not self.pending:
+            self.available.clear()
+            await self.available.wait()
+        if self.current is not None:
+            self.free.append(self.current)
+        self.current = self.pending.popleft()
+        age = time.perf_counter() - self.put_times[self.current]
+        self.delivered += 1
+        self.total_age += age
+        self.max_age = max(self.max_age, age)
+        return self.slots[self.current]
+
+    def stats(self) -> dict:
+        return {
+            "puts": self.puts,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "pending": len(self.pending),
+            "mean_age": self.total_age / self.delivered if self.delivered else 0.0,
+            "max_age": self.max_age,
+        }
+
+class FrameSender:
+    """
+    A task that sends the frames of a mailbox with `send`, a coroutine
+    function taking one frame. Errors from `send` are printed and counted
+    and the sender carries on with the next frame.
+    """
+    def __init__(self, mailbox: FrameMailbox, send):
+        self.mailbox = mailbox
+        self.send = send
+        self.sent = 0
+        self.errors = 0
+        self.send_time = 0.0
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        while True:
+            frame = await self.mailbox.get()
+            start = time.perf_counter()
+            try:
+                await self.send(frame)
+                self.sent += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"Send failed: {e}")
+            self.send_time += time.perf_counter() - start
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    def stats(self) -> dict:
+        stats = self.mailbox.stats()
+        stats.update({
+            "sent": self.sent,
+            "errors": self.errors,
+            "mean_send_time": self.send_time / self.sent if self.sent else 0.0,
+        })
+        return stats
@@ -0,0 +1,80 @@
+"""
+Content-addressed on-disk cache of encoded images.
+
+The cache key is a hash of the image file contents and the resize settings,
+and each entry holds the ready-to-send block commands and frame durations
+in a small binary file that is memory-mapped on load. A cache hit needs
+neither PIL nor any re-encoding.
+
+File layout (little endian):
+  - Magic (4 bytes): b"MILD"
+  - Version (uint16), frame count (uint32), 2 bytes padding
+  - Durations: frame count float64 values in seconds
+  - Block commands: frame count x 8 x 100 bytes
+"""
+import hashlib
+import os
+import struct
+import tempfile
+import numpy as np
+from animation import EncodedAnimation
+from codec import BLOCK_COUNT, BLOCK_COMMAND_SIZE
+
+CACHE_DIR = os.path.expanduser("~/.cache/mi-led-display")
+CACHE_VERSION = 1
+MAGIC = b"MILD"
+HEADER = struct.Struct("<4sHI2x")
+
+def cache_key(image_path, settings="16x16 LANCZOS") -> str:
+    """
+    Returns the cache key for an image file: a SHA-256 over its contents,
+    the resize settings and the cache format version.
+    """
+    digest = hashlib.sha256(f"{CACHE_VERSION} {settings}\n".encode())
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_path(key, cache_dir=CACHE_DIR) -> str:
+    return os.path.join(cache_dir, key[:2], key + ".bin")
+
+def load(key, cache_dir=CACHE_DIR):
+    """
+    Returns the cached EncodedAnimation for `key`, memory-mapped from disk,
+    or None if there is no valid entry.
+    """
+    path = cache_path(key, cache_dir)
+    try:
+        with open(path, "rb") as f:
+            magic, version, count = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    if magic != MAGIC or version != CACHE_VERSION or count == 0:
+        return None
+
+    expected = HEADER.size + count * 8 + count * BLOCK_COUNT * BLOCK_COMMAND_SIZE
+    if os.path.getsize(path) != expected:
+        return None
+    durations = np.memmap(path, dtype="<f8", mode="r", offset=HEADER.size, shape=(count,))
+    blocks = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER.size + count * 8,
+                       shape=(count, BLOCK_COUNT, BLOCK_COMMAND_SIZE))
+    return EncodedAnimation(blocks, durations)
+
+def store(key, animation: EncodedAnimation, cache_dir=CACHE_DIR):
+    """
+    Writes an encoded animation to the cache. The file is written under a
+    temporary name and renamed, so readers never see a partial entry.
+    """
+    path = cache_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, CACHE_VERSION, len(animation)))
+            f.write(np.ascontiguousarray(animation.durations, dtype="<f8").tobytes())
+            f.write(np.ascontiguousarray(animation.blocks, dtype=np.uint8).tobytes())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
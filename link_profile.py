@@ -0,0 +1,63 @@
+"""
+Link profiles: the send parameters calibrate.py found to be fastest and
+stable for one Bluetooth adapter and display.
+
+Profiles are stored in ~/.mi_led_profiles.json keyed by
+"<adapter>/<display address>". Every new WritePacer starts from the profile
+of its display (see pacing.paced), and the pixel senders take their pixel
+budget and packing from it.
+"""
+import json
+import os
+import platform
+
+PROFILE_PATH = os.path.expanduser("~/.mi_led_profiles.json")
+
+# What the senders used before there were profiles
+DEFAULT_PROFILE = {
+    "gap": 0.003,
+    "min_gap": 0.001,
+    "response": False,
+    "write_size": 10,
+    "pixel_count": 12,
+}
+
+def adapter_id() -> str:
+    """
+    Identifies the host Bluetooth adapter: its address where the system
+    exposes it (Linux), otherwise the host name.
+    """
+    try:
+        with open("/sys/class/bluetooth/hci0/address") as f:
+            return f.read().strip().upper()
+    except OSError:
+        return platform.node()
+
+def profile_key(address) -> str:
+    return f"{adapter_id()}/{address}"
+
+def load_profile(address, path=PROFILE_PATH) -> dict:
+    """
+    Returns the profile for the display with the given address on this
+    adapter, filled up with DEFAULT_PROFILE, or DEFAULT_PROFILE if there is
+    none.
+    """
+    profile = dict(DEFAULT_PROFILE)
+    if address is None:
+        return profile
+    try:
+        with open(path) as f:
+            profile.update(json.load(f).get(profile_key(address), {}))
+    except (OSError, ValueError):
+        pass
+    return profile
+
+def save_profile(address, profile, path=PROFILE_PATH):
+    try:
+        with open(path) as f:
+            profiles = json.load(f)
+    except (OSError, ValueError):
+        profiles = {}
+    profiles[profile_key(address)] = profile
+    with open(path, "w") as f:
+        json.dump(profiles, f, indent=2)
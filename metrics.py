@@ -0,0 +1,211 @@
+"""
+Write-level instrumentation of the link to the display.
+
+When enabled, every GATT write made through a WritePacer records its size,
+command kind, queue wait (time spent waiting for the pacing gap), write
+latency and whether it failed or was a retry, and DisplayConnection records
+connects and disconnects. Latencies go into fixed-bucket histograms, so
+recording is a few additions per write. When disabled (the default) the
+only cost is one `recorder is not None` check per write.
+
+The metrics can be served as Prometheus text over HTTP, dumped to a JSON
+file periodically, or both. Long-running scripts enable them from the
+environment:
+
+    MI_LED_METRICS_PORT=9105 python3 draw_plasma.py
+    MI_LED_METRICS_JSON=/tmp/mi-led.json python3 draw_plasma_clock.py
+"""
+import asyncio
+import bisect
+import json
+import os
+import tempfile
+import time
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, float("inf"))
+
+# Command kind by the byte after 0xBC, see protocol.txt
+COMMAND_KINDS = {0x00: "mode", 0x01: "pixel", 0x02: "animation", 0x0F: "picture", 0xFF: "power"}
+
+# The active recorder, None when instrumentation is disabled
+recorder = None
+
+def command_kind(data) -> str:
+    """
+    Classifies a write by its command group without decoding it.
+    """
+    if len(data) < 2 or data[0] != 0xBC:
+        return "unknown"
+    kind = COMMAND_KINDS.get(data[1], "other")
+    if kind == "picture" and len(data) > 6:
+        return "block"
+    return kind
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        total = 0
+        result = []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": {str(bound): count for bound, count in zip(self.buckets, self.cumulative())},
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+class WriteMetrics:
+    """
+    Counters and histograms for the writes of one process.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.writes = {}
+        self.bytes = {}
+        self.errors = 0
+        self.retries = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.latency = Histogram()
+        self.queue_wait = Histogram()
+
+    def write(self, data, queue_wait, latency, failed=False, retry=False):
+        kind = command_kind(data)
+        self.writes[kind] = self.writes.get(kind, 0) + 1
+        self.bytes[kind] = self.bytes.get(kind, 0) + len(data)
+        self.queue_wait.observe(queue_wait)
+        if failed:
+            self.errors += 1
+        else:
+            self.latency.observe(latency)
+        if retry:
+            self.retries += 1
+
+    def connect(self):
+        self.connects += 1
+
+    def disconnect(self):
+        self.disconnects += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self.started,
+            "writes": dict(self.writes),
+            "bytes": dict(self.bytes),
+            "errors": self.errors,
+            "retries": self.retries,
+            "connects": self.connects,
+            "disconnects": self.disconnects,
+            "write_latency_seconds": self.latency.to_dict(),
+            "queue_wait_seconds": self.queue_wait.to_dict(),
+        }
+
+    def prometheus_text(self) -> str:
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP mi_led_{name} {help_text}")
+            lines.append(f"# TYPE mi_led_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"mi_led_{name}{labels} {value}")
+
+        def histogram(name, help_text, histogram):
+            samples = []
+            for bound, count in zip(histogram.buckets, histogram.cumulative()):
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append((f'_bucket{{le="{le}"}}', count))
+            lines.append(f"# HELP mi_led_{name} {help_text}")
+            lines.append(f"# TYPE mi_led_{name} histogram")
+            for suffix, value in samples + [("_sum", histogram.sum), ("_count", histogram.count)]:
+                lines.append(f"mi_led_{name}{suffix} {value}")
+
+        metric("writes_total", "counter", "GATT writes by command kind",
+               [(f'{{kind="{kind}"}}', count) for kind, count in sorted(self.writes.items())])
+        metric("write_bytes_total", "counter", "Bytes written by command kind",
+               [(f'{{kind="{kind}"}}', count) for kind, count in sorted(self.bytes.items())])
+        metric("write_errors_total", "counter", "Failed GATT writes", [("", self.errors)])
+        metric("write_retries_total", "counter", "Retried GATT writes", [("", self.retries)])
+        metric("connects_total", "counter", "Connections made", [("", self.connects)])
+        metric("disconnects_total", "counter", "Connections lost", [("", self.disconnects)])
+        histogram("write_latency_seconds", "Time a GATT write takes", self.latency)
+        histogram("queue_wait_seconds", "Time a write waits for the pacing gap", self.queue_wait)
+        return "\n".join(lines) + "\n"
+
+def enable() -> WriteMetrics:
+    """
+    Turns instrumentation on and returns the recorder.
+    """
+    global recorder
+    if recorder is None:
+        recorder = WriteMetrics()
+    return recorder
+
+def disable():
+    global recorder
+    recorder = None
+
+async def serve_prometheus(port, host="127.0.0.1"):
+    """
+    Serves the metrics as Prometheus text on every HTTP request to
+    host:port. Returns the asyncio server.
+    """
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        body = enable().prometheus_text().encode()
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+async def dump_json(path, interval=10.0):
+    """
+    Writes the metrics as JSON to `path` every `interval` seconds, replacing
+    the file atomically.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    while True:
+        await asyncio.sleep(interval)
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+            json.dump(enable().to_dict(), f, indent=2)
+        os.replace(f.name, path)
+
+def start_from_env():
+    """
+    Enables instrumentation if MI_LED_METRICS_PORT or MI_LED_METRICS_JSON
+    (with MI_LED_METRICS_INTERVAL in seconds) is set, starting the server or
+    dump task on the running loop. Returns the tasks started.
+    """
+    port = os.environ.get("MI_LED_METRICS_PORT")
+    path = os.environ.get("MI_LED_METRICS_JSON")
+    tasks = []
+    if port:
+        enable()
+        tasks.append(asyncio.ensure_future(serve_prometheus(int(port))))
+        print(f"Serving metrics on port {port}")
+    if path:
+        enable()
+        interval = float(os.environ.get("MI_LED_METRICS_INTERVAL", 10))
+        tasks.append(asyncio.ensure_future(dump_json(path, interval)))
+        print(f"Writing metrics to {path} every {interval:g} s")
+    return tasks
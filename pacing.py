@@ -0,0 +1,222 @@
+"""
+Adaptive pacing of GATT writes.
+
+Instead of a fixed asyncio.sleep after every write, WritePacer wraps a
+BleakClient and adjusts the gap between writes at runtime: the gap shrinks
+a little with every write that completes quickly and without errors, and backs off
+multiplicatively as soon as write latency rises above the link's baseline or
+a write fails. Writes use write-without-response whenever the characteristic
+supports it.
+
+A write without response returns as soon as it is queued locally, so its
+latency says nothing about the link. In that mode every `probe_interval`th
+write is sent with response instead: it returns once everything queued
+before it went out, so no more than `probe_interval` writes are ever queued
+ahead of the link, and only these probes move the gap. The gap never goes
+below MIN_GAP. Mode commands are written with write_commands(...,
+settle=MODE_SETTLE) so the display has switched before the next write, like
+the fixed delays the scripts used before.
+"""
+import asyncio
+import time
+import weakref
+import metrics
+from codec import CHARACTERISTIC_UUID
+from link_profile import load_profile
+
+# Smallest gap between writes, whatever the measurements say
+MIN_GAP = 0.001
+# Pause after commands that switch the display mode
+MODE_SETTLE = 0.2
+
+class WritePacer:
+    """
+    Wraps a client so that every write_gatt_char call is paced.
+
+    Any other attribute (is_connected, services, ...) is passed through to
+    the wrapped client, so a WritePacer can be used wherever a client is.
+    `response` forces writes with (True) or without (False) response; by
+    default write-without-response is used when supported, with a probe
+    write with response every `probe_interval` writes. `timer` and `sleep`
+    replace time.perf_counter and asyncio.sleep, e.g. to pace on the
+    virtual clock of the emulator.
+    """
+    def __init__(self, client, gap=0.003, min_gap=MIN_GAP, max_gap=0.25, step=0.0002,
+                 backoff=1.5, congestion=2.0, retries=1, smoothing=0.1, response=None, probe_interval=25,
+                 timer=time.perf_counter, sleep=asyncio.sleep):
+        self.client = client
+        self.timer = timer
+        self.sleep = sleep
+        self.gap = gap
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.step = step
+        self.backoff = backoff
+        self.congestion = congestion
+        self.retries = retries
+        self.smoothing = smoothing
+        self.response = response
+        self.response_checked = False
+        self.probe_interval = probe_interval
+        self.latency = None
+        self.baseline = None
+        self.probe_latency = None
+        self.probe_baseline = None
+        self.probes = 0
+        self.error_rate = 0.0
+        self.writes = 0
+        self.errors = 0
+        self.last_write = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _write_response(self, char_uuid):
+        """
+        Returns the response flag to write with: False if the characteristic
+        supports write-without-response, otherwise None to let bleak decide.
+        """
+        if self.response is None and not self.response_checked:
+            # Looked up once, also when the answer is to let bleak decide
+            self.response_checked = True
+            self.response = False
+            try:
+                characteristic = self.client.services.get_characteristic(char_uuid)
+                if characteristic is not None and "write-without-response" not in characteristic.properties:
+                    self.response = None
+            except Exception:
+                # Services not resolved (or not a BleakClient), try without response
+                pass
+        return self.response
+
+    def _record(self, latency, failed, queued=False, probe=False):
+        """
+        Updates the error rate, latency and gap after a write. `queued`
+        writes (without response) only update the statistics, the gap
+        follows the other writes and the probes.
+        """
+        self.writes += 1
+        self.error_rate += self.smoothing * ((1.0 if failed else 0.0) - self.error_rate)
+        if failed:
+            self.errors += 1
+            self.gap = min(self.max_gap, max(self.gap, self.step) * self.backoff * 2)
+            return
+
+        if probe:
+            self.probes += 1
+            self.probe_latency = latency
+            congested = self._congested(latency, "probe_baseline")
+            if congested:
+                self.gap = min(self.max_gap, max(self.gap, self.step) * self.backoff)
+            else:
+                # One probe stands for probe_interval writes
+                self.gap = max(self.min_gap, self.gap * (1 - self.smoothing) - self.step)
+            return
+
+        self.latency = latency if self.latency is None else self.latency + self.smoothing * (latency - self.latency)
+        congested = self._congested(latency, "baseline")
+        if queued:
+            return
+        if congested:
+            self.gap = min(self.max_gap, max(self.gap, self.step) * self.backoff)
+        else:
+            self.gap = max(self.min_gap, self.gap - self.step - self.gap * self.smoothing * 0.5)
+
+    def _congested(self, latency, name) -> bool:
+        """
+        Updates the baseline attribute `name` with `latency` and returns
+        whether the latency is well above it.
+        """
+        baseline = getattr(self, name)
+        # The baseline follows the fastest writes and slowly drifts up so an
+        # early lucky measurement does not pin it forever
+        if baseline is None or latency < baseline:
+            baseline = latency
+        else:
+            baseline += self.smoothing * 0.1 * (latency - baseline)
+        setattr(self, name, baseline)
+        return latency > baseline * self.congestion + 0.001
+
+    async def write_gatt_char(self, char_uuid, data, response=None):
+        """
+        Waits until the current gap has passed since the previous write, then
+        writes `data`, measuring how long the write takes. Failed writes are
+        retried up to `retries` times before the error is raised.
+        """
+        probe = False
+        if response is None:
+            response = self._write_response(char_uuid)
+            probe = response is False and bool(self.probe_interval) and \
+                self.writes % self.probe_interval == self.probe_interval - 1
+            if probe:
+                response = True
+        queued = response is False
+        attempt = 0
+        while True:
+            wait = self.last_write + self.gap - self.timer()
+            if wait > 0:
+                await self.sleep(wait)
+            start = self.timer()
+            try:
+                await self.client.write_gatt_char(char_uuid, data, response=response)
+            except Exception:
+                self.last_write = self.timer()
+                self._record(self.last_write - start, True, queued, probe)
+                if metrics.recorder is not None:
+                    metrics.recorder.write(data, max(wait, 0.0), self.last_write - start, True, attempt > 0)
+                attempt += 1
+                if attempt > self.retries or not getattr(self.client, "is_connected", True):
+                    raise
+                continue
+            self.last_write = self.timer()
+            self._record(self.last_write - start, False, queued, probe)
+            if metrics.recorder is not None:
+                metrics.recorder.write(data, max(wait, 0.0), self.last_write - start, False, attempt > 0)
+            return
+
+    async def write_commands(self, commands, settle=0.0):
+        """
+        Writes a list of hex strings or byte strings to the display, waiting
+        `settle` seconds after each one (MODE_SETTLE after mode commands).
+        """
+        for command in commands:
+            if isinstance(command, str):
+                command = bytes.fromhex(command)
+            await self.write_gatt_char(CHARACTERISTIC_UUID, command)
+            if settle:
+                await self.sleep(settle)
+
+    def stats(self) -> dict:
+        return {
+            "gap": self.gap,
+            "latency": self.latency,
+            "baseline": self.baseline,
+            "probe_latency": self.probe_latency,
+            "probes": self.probes,
+            "error_rate": self.error_rate,
+            "writes": self.writes,
+            "errors": self.errors,
+            "response": self.response,
+        }
+
+# One pacer per connection so the learned gap survives between calls. The
+# pacers hold a proxy of their client, so both go when the client does.
+_pacers = weakref.WeakKeyDictionary()
+
+def paced(client, **kwargs) -> WritePacer:
+    """
+    Returns the WritePacer for `client`, creating it on first use. A client
+    that already is a WritePacer is returned as is. A new pacer starts from
+    the calibrated link profile of the display, if there is one, unless
+    `kwargs` say otherwise.
+    """
+    if isinstance(client, WritePacer):
+        return client
+    pacer = _pacers.get(client)
+    if pacer is None:
+        profile = load_profile(getattr(client, "address", None))
+        settings = {"gap": max(profile["gap"], MIN_GAP), "min_gap": max(profile["min_gap"], MIN_GAP),
+                    "response": profile["response"] or None}
+        settings.update(kwargs)
+        pacer = _pacers[client] = WritePacer(weakref.proxy(client), **settings)
+    return pacer
@@ -0,0 +1,132 @@
+"""
+Packing several commands into one GATT write.
+
+Every write costs a fixed overhead on the link, and a 10-byte pixel command
+uses only a fraction of what a write can carry. If the firmware accepts
+concatenated commands in one write, packing as many as the negotiated MTU
+allows (MTU - 3 bytes of ATT header per write) multiplies the pixel rate.
+
+Whether the firmware does is not documented, so probe_concatenation checks
+it: it draws a row of pixels with one packed write and asks whether they
+all appeared (on the emulator this is checked against its framebuffer).
+
+Usage:
+    python3 packing.py
+    python3 packing.py --emulator --accept-concatenated
+"""
+import argparse
+import asyncio
+import numpy as np
+from codec import CHARACTERISTIC_UUID, GRAFFITI_COMMANDS, PIXEL_COMMAND_SIZE, WIDTH, encode_set_pixels, iter_commands
+from link_profile import load_profile
+from pacing import MODE_SETTLE, paced
+
+# The ATT default MTU, and the ATT header of a write
+DEFAULT_MTU = 23
+ATT_HEADER_SIZE = 3
+
+def max_write_size(client, default_mtu=DEFAULT_MTU) -> int:
+    """
+    Returns the largest write the link to `client` carries in one packet.
+    """
+    try:
+        mtu = client.mtu_size or default_mtu
+    except Exception:
+        # Not connected, or not a BleakClient
+        mtu = default_mtu
+    return mtu - ATT_HEADER_SIZE
+
+def iter_packed(buffer: np.ndarray, max_size: int):
+    """
+    Yields the rows of an encoded command buffer (e.g. from encode_set_pixels)
+    packed into memoryviews of at most `max_size` bytes, as many whole
+    commands per write as fit. The buffer rows must be contiguous, which
+    they are for buffers from codec; nothing is copied.
+    """
+    per_write = max(1, max_size // buffer.shape[1])
+    for start in range(0, len(buffer), per_write):
+        yield buffer[start:start + per_write].reshape(-1).data
+
+def pack_commands(commands, max_size: int) -> list:
+    """
+    Concatenates a list of commands into as few writes of at most
+    `max_size` bytes as possible, keeping commands whole and in order.
+    """
+    writes = []
+    current = bytearray()
+    for command in commands:
+        if current and len(current) + len(command) > max_size:
+            writes.append(bytes(current))
+            current = bytearray()
+        current += command
+    if current:
+        writes.append(bytes(current))
+    return writes
+
+async def probe_concatenation(client, color=(0, 255, 0), confirm=None) -> bool:
+    """
+    Checks whether the display applies all commands of a packed write.
+
+    Clears the top row with single writes, then sets as many of its pixels
+    as fit in one write to `color` with a single packed write. `confirm` is
+    called with the pixel indices and color and returns whether they all
+    show; by default the user is asked.
+    """
+    pacer = paced(client)
+    count = min(WIDTH, max(2, max_write_size(client) // 10))
+    indices = np.arange(count)
+    await pacer.write_commands(GRAFFITI_COMMANDS, settle=MODE_SETTLE)
+    for command in iter_commands(encode_set_pixels(np.arange(WIDTH), np.zeros((WIDTH, 3)))):
+        await pacer.write_gatt_char(CHARACTERISTIC_UUID, command)
+    await pacer.write_gatt_char(CHARACTERISTIC_UUID, encode_set_pixels(indices, [color] * count).tobytes())
+
+    if confirm is None:
+        def confirm(indices, color):
+            answer = input(f"Are the first {len(indices)} pixels of the top row lit in {color}? [y/n] ")
+            return answer.strip().lower().startswith("y")
+    return bool(confirm(indices, color))
+
+async def packed_write_size(client, confirm=None) -> int:
+    """
+    Returns the size to pack writes to `client` up to: the write size of
+    its calibrated link profile if that packs commands, otherwise the
+    largest write if probe_concatenation finds that the display takes
+    packed writes, and a single command if it does not.
+    """
+    size = max_write_size(client)
+    profile = load_profile(getattr(client, "address", None))
+    if profile["write_size"] > PIXEL_COMMAND_SIZE:
+        return min(size, profile["write_size"])
+    if await probe_concatenation(client, confirm=confirm):
+        return size
+    return PIXEL_COMMAND_SIZE
+
+async def run(args):
+    if args.emulator:
+        from emulator import EmulatedClient
+        client = EmulatedClient(realtime=False, mtu_size=args.mtu, accept_concatenated=args.accept_concatenated)
+
+        def confirm(indices, color):
+            return bool((client.framebuffer[indices] == color).all())
+
+        accepted = await probe_concatenation(client, confirm=confirm)
+    else:
+        from connection import DisplayConnection
+        async with DisplayConnection() as client:
+            accepted = await probe_concatenation(client)
+
+    size = max_write_size(client)
+    if accepted:
+        print(f"Concatenated commands are accepted: {size // 10} pixel commands per write of up to {size} bytes")
+    else:
+        print("Concatenated commands are not accepted, send one command per write")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check whether the display accepts packed writes.")
+    parser.add_argument("--emulator", action="store_true", help="probe the emulator instead of a display")
+    parser.add_argument("--accept-concatenated", action="store_true", help="let the emulator accept packed writes")
+    parser.add_argument("--mtu", type=int, default=247, help="emulated MTU")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
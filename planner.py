@@ -0,0 +1,201 @@
+"""
+Hybrid frame updates that pick between pixel and block commands.
+
+The display can be updated with 10 byte graffiti pixel commands or with 100
+byte full-picture block commands. Which is cheaper depends on how many pixels
+changed, so for each new frame HybridStream works out the cheapest mix from
+the (measured) cost of each kind of write and sends that plan.
+"""
+import asyncio
+import time
+import numpy as np
+from codec import (CHARACTERISTIC_UUID, BLOCK_COUNT, BLOCK_PIXELS, PIXEL_COUNT, WIDTH, HEIGHT, GRAFFITI_COMMANDS,
+                   START_PICTURE_COMMAND, END_PICTURE_COMMAND, encode_full_picture, encode_set_pixels,
+                   new_picture_buffer, new_pixel_buffer, to_frame)
+from pacing import MODE_SETTLE
+
+# Kinds of writes, used as keys for costs and delays
+PIXEL = "pixel"
+BLOCK = "block"
+START = "start"
+END = "end"
+GRAFFITI = "graffiti"
+
+# Seconds per write, from the timings in draw_pixels.py and draw_picture.py
+DEFAULT_WRITE_COSTS = {
+    PIXEL: 1 / 360,
+    BLOCK: 0.03,
+    START: 0.005,
+    END: 0.005,
+    GRAFFITI: 0.01,
+}
+
+# Pause after each kind of write, graffiti mode needs time to switch
+DEFAULT_WRITE_DELAYS = {
+    PIXEL: 0.003,
+    BLOCK: 0.025,
+    START: 0.002,
+    END: 0.002,
+    GRAFFITI: MODE_SETTLE,
+}
+
+class WriteCosts:
+    """
+    Cost in seconds of each kind of write, kept as a moving average of
+    measured write times so the planner adapts to the link.
+    """
+    def __init__(self, costs=None, smoothing=0.1):
+        self.costs = dict(DEFAULT_WRITE_COSTS)
+        if costs:
+            self.costs.update(costs)
+        self.smoothing = smoothing
+
+    def __getitem__(self, kind):
+        return self.costs[kind]
+
+    def record(self, kind, seconds):
+        self.costs[kind] += self.smoothing * (seconds - self.costs[kind])
+
+class UpdatePlan:
+    """
+    The writes chosen for one frame: the blocks (0-7) and pixel indices to
+    send, the resulting list of (kind, data) commands, the estimated cost
+    and a copy of the frame the commands were encoded from.
+    """
+    def __init__(self, blocks, pixels, commands, cost, frame=None):
+        self.blocks = blocks
+        self.pixels = pixels
+        self.commands = commands
+        self.cost = cost
+        self.frame = frame
+
+    def __len__(self):
+        return len(self.commands)
+
+class HybridStream:
+    """
+    Sends frames over one connection using the cheapest mix of pixel and
+    block commands for each frame.
+
+    Block commands need the display in picture mode (`bc 0f f1`) and pixel
+    commands in graffiti mode, so the cost of switching between the two is
+    part of the plan.
+    """
+    def __init__(self, client, costs=None, delays=None, finish=True):
+        self.client = client
+        self.costs = costs if costs is not None else WriteCosts()
+        self.delays = dict(DEFAULT_WRITE_DELAYS)
+        if delays:
+            self.delays.update(delays)
+        self.finish = finish
+        self.picture_buffer = new_picture_buffer()
+        self.pixel_buffer = new_pixel_buffer(PIXEL_COUNT)
+        self.last_frame = None
+        self.mode = None
+
+    def reset(self):
+        """
+        Forgets the display state, the next frame is sent in full.
+        """
+        self.last_frame = None
+        self.mode = None
+
+    def _block_overhead(self):
+        cost = 0 if self.mode == BLOCK else self.costs[START]
+        if self.finish:
+            cost += self.costs[END]
+        return cost
+
+    def _graffiti_overhead(self, after_blocks):
+        if self.mode == PIXEL and not after_blocks:
+            return 0
+        return self.costs[GRAFFITI] * len(GRAFFITI_COMMANDS)
+
+    def plan(self, picture, region=None) -> UpdatePlan:
+        """
+        Works out the cheapest way to get from the last frame to `picture`.
+
+        Once the fixed cost of entering picture mode has been paid, each
+        block is independently cheaper as a block or as pixels, so only three
+        candidates need to be compared: pixels only, every changed block as
+        a block, and blocks only where a block beats its changed pixels.
+
+        `region` is an optional (x0, y0, x1, y1) rectangle that the caller
+        knows holds all changes (e.g. from compositor dirty tracking); only
+        that part of the frame is compared.
+        """
+        frame = to_frame(picture)
+        if self.last_frame is None:
+            changed = np.ones(PIXEL_COUNT, dtype=bool)
+        elif region is not None:
+            x0, y0, x1, y1 = region
+            changed = np.zeros((HEIGHT, WIDTH), dtype=bool)
+            grid, last = frame.reshape(HEIGHT, WIDTH, 3), self.last_frame.reshape(HEIGHT, WIDTH, 3)
+            changed[y0:y1, x0:x1] = (grid[y0:y1, x0:x1] != last[y0:y1, x0:x1]).any(axis=2)
+            changed = changed.reshape(-1)
+        else:
+            changed = (frame != self.last_frame).any(axis=1)
+        per_block = changed.reshape(BLOCK_COUNT, BLOCK_PIXELS).sum(axis=1)
+        total = int(per_block.sum())
+        if total == 0:
+            return UpdatePlan(np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), [], 0.0)
+
+        pixel_cost, block_cost = self.costs[PIXEL], self.costs[BLOCK]
+        changed_blocks = per_block > 0
+        cheaper_blocks = per_block * pixel_cost > block_cost
+
+        candidates = [(total * pixel_cost + self._graffiti_overhead(False), np.zeros(BLOCK_COUNT, dtype=bool))]
+        candidates.append((changed_blocks.sum() * block_cost + self._block_overhead(), changed_blocks))
+        if cheaper_blocks.any():
+            remaining = total - int(per_block[cheaper_blocks].sum())
+            cost = cheaper_blocks.sum() * block_cost + self._block_overhead()
+            if remaining:
+                cost += remaining * pixel_cost + self._graffiti_overhead(True)
+            candidates.append((cost, cheaper_blocks))
+        cost, use_blocks = min(candidates, key=lambda candidate: candidate[0])
+
+        blocks = np.flatnonzero(use_blocks)
+        pixels = np.flatnonzero(changed & ~np.repeat(use_blocks, BLOCK_PIXELS))
+        commands = []
+        if len(blocks):
+            if self.mode != BLOCK:
+                commands.append((START, START_PICTURE_COMMAND))
+            encoded = encode_full_picture(frame, self.picture_buffer)
+            commands.extend((BLOCK, encoded[block_index].data) for block_index in blocks)
+            if self.finish:
+                commands.append((END, END_PICTURE_COMMAND))
+        if len(pixels):
+            if self.mode != PIXEL or len(blocks):
+                commands.extend((GRAFFITI, command) for command in GRAFFITI_COMMANDS)
+            encoded = encode_set_pixels(pixels, frame[pixels], self.pixel_buffer)
+            commands.extend((PIXEL, command.data) for command in encoded)
+        return UpdatePlan(blocks, pixels, commands, float(cost), frame.copy())
+
+    async def send_plan(self, plan: UpdatePlan, frame=None):
+        """
+        Writes the commands of a plan, recording how long each kind of write
+        takes so later plans use measured costs.
+
+        The display then shows the frame the plan was encoded from, not
+        whatever `frame` holds after the writes: callers may keep changing
+        their frame while the writes are awaited.
+        """
+        for kind, data in plan.commands:
+            start = time.perf_counter()
+            await self.client.write_gatt_char(CHARACTERISTIC_UUID, data)
+            await asyncio.sleep(self.delays[kind])
+            self.costs.record(kind, time.perf_counter() - start)
+        if len(plan.pixels):
+            self.mode = PIXEL
+        elif len(plan.blocks):
+            self.mode = BLOCK
+        self.last_frame = plan.frame if plan.frame is not None else to_frame(frame).copy()
+
+    async def send(self, picture, region=None) -> UpdatePlan:
+        """
+        Plans and sends the update to `picture`, returning the plan used.
+        """
+        plan = self.plan(picture, region)
+        if plan.commands:
+            await self.send_plan(plan, picture)
+        return plan
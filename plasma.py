@@ -4,6 +4,7 @@
 import math
 import random
 import colorsys
+import numpy as np
 
 # Constants
 UPDATE_PIXEL_COUNT = 12
@@ -13,98 +14,28 @@ FPS = 30
 UPDATE_DELAY = math.floor(1000 / FPS)
 
 # Data structures
-plasma_pixels = [[[0, 0, 0] for _ in range(WIDTH)] for _ in range(HEIGHT)]
-error_values = [[0 for _ in range(WIDTH)] for _ in range(HEIGHT)]
-top_error_positions = [i for i in range(256)]
-display_pixels = [[[0, 0, 0] for _ in range(WIDTH)] for _ in range(HEIGHT)]
+# The pixel buffers are contiguous (HEIGHT, WIDTH, 3) uint8 arrays, they can
+# still be indexed as [y][x] and reshaped to a flat frame without copying
+plasma_pixels = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+error_values = np.zeros((HEIGHT, WIDTH), dtype=np.int64)
+top_error_positions = np.arange(WIDTH * HEIGHT)
+display_pixels = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
 
 # ============================== #
 #     PURE FUNCTIONS (IMPORTABLE)
 # ============================== #
 from datetime import datetime
 
-# 3x5 pixel representations of digits 0-9
-DIGIT_MAP = {
-    '0': [
-        "cfc",
-        "f f",
-        "f f",
-        "f f",
-        "cfc"
-    ],
-    '1': [
-        " f ",
-        "ff ",
-        " f ",
-        " f ",
-        "fff"
-    ],
-    '2': [
-        "cfc",
-        "  f",
-        "cfc",
-        "f  ",
-        "fff"
-    ],
-    '3': [
-        "ffc",
-        "  f",
-        " ff",
-        "  f",
-        "ffc"
-    ],
-    '4': [
-        "c f",
-        "f f",
-        "fff",
-        "  f",
-        "  f"
-    ],
-    '5': [
-        "fff",
-        "f  ",
-        "ffc",
-        "  f",
-        "ffc"
-    ],
-    '6': [
-        "cff",
-        "f  ",
-        "ffc",
-        "f f",
-        "cfc"
-    ],
-    '7': [
-        "fff",
-        "  f",
-        " f ",
-        " f ",
-        " f "
-    ],
-    '8': [
-        "cfc",
-        "f f",
-        "cfc",
-        "f f",
-        "cfc"
-    ],
-    '9': [
-        "cfc",
-        "f f",
-        "cff",
-        "  f",
-        "ffc"
-    ]
-}
+# 3x5 pixel representations of digits 0-9, compiled into alpha masks once
+from text import DIGIT_MAP, DIGIT_FONT, blit
 
 def clamp(value, min_val=0, max_val=255):
     return max(min(value, max_val), min_val)
 
 def draw_alpha_pixel(x, y, color, alpha):
-    plasma_pixels[y][x] = [
-        clamp(int((1 - alpha) * plasma_pixels[y][x][j] + alpha * color[j])) 
-        for j in range(3)
-    ]
+    # Blended in place, for whole layers see compositor.py
+    pixel = plasma_pixels[y, x]
+    pixel[:] = np.clip((1 - alpha) * pixel + alpha * np.asarray(color), 0, 255).astype(np.int64)
 
 def update_clock():
     now = datetime.now()
@@ -117,14 +48,7 @@ def update_clock():
     for i, digit in enumerate(time_string):
         x_offset = start_x + (i * 4) + (0 if i>1 else 1)  # Space between digits
         y_offset = start_y + (6 if i>1 else 0)  # Space between digits
-        
-        digit_pattern = DIGIT_MAP[digit]
-        for dy, row in enumerate(digit_pattern):
-            for dx, pixel in enumerate(row):
-                if pixel != " " :
-                    pixel_value = int(pixel, 16)
-                    #plasma_pixels[y_offset + dy][x_offset + dx] = [0, 0, 0]  
-                    draw_alpha_pixel(x_offset + dx, y_offset + dy, color, alpha*pixel_value/15.0)
+        blit(plasma_pixels, DIGIT_FONT.glyph(digit), x_offset, y_offset, color, alpha)
 
     progress_x = start_x + int((WIDTH-1)*(now.second / 59.0))
     progress_y = HEIGHT - 1
@@ -140,53 +64,367 @@ def rgb_to_hex(rgb):
     #return '#%02x%02x%02x' % (int(rgb[0] * 255), int(rgb[1] * 255), int(rgb[2] * 255))
     return '#%02x%02x%02x' % (rgb[0], rgb[1], rgb[2])
 
+def hue_table(steps):
+    """
+    Returns a (steps + 1, 3) uint8 table of fully saturated colors for hues
+    0/steps .. steps/steps, the last entry wrapping around to the first.
+    """
+    table = np.empty((steps + 1, 3), dtype=np.uint8)
+    for i in range(steps + 1):
+        table[i] = [int(c * 255) for c in colorsys.hsv_to_rgb((i % steps) / steps, 1, 1)]
+    return table
+
+class Plasma:
+    """
+    Vectorized plasma effect for a canvas of any size.
+
+    Each of the four waves is sin(a * (u + s * t)) for a fixed coordinate
+    grid u, which is expanded to sin(a*u) * cos(a*s*t) + cos(a*u) * sin(a*s*t).
+    The sin/cos grids are computed once, so a frame costs eight scalar
+    trigonometric calls, one matrix-vector product and a hue table lookup.
+    """
+    # (frequency, time direction, coordinate grid as a function of x, y)
+    WAVES = [
+        (0.04, 1, lambda x, y: -x),
+        (0.05, -1, lambda x, y: y),
+        (0.06, 1, lambda x, y: -(x + 0.5 * y)),
+        (0.07, -1, lambda x, y: 0.5 * x + y),
+    ]
+
+    def __init__(self, width=WIDTH, height=HEIGHT, hue_steps=1536):
+        self.width = width
+        self.height = height
+        self.hue_steps = hue_steps
+        self.hues = hue_table(hue_steps)
+        y, x = np.mgrid[0:height, 0:width].astype(np.float64)
+        grids = [frequency * grid(x, y) for frequency, _, grid in self.WAVES]
+        self.basis = np.stack([np.sin(g).ravel() for g in grids] + [np.cos(g).ravel() for g in grids])
+        self.weights = np.empty(len(self.basis))
+        self.values = np.empty(width * height)
+        self.indices = np.empty(width * height, dtype=np.intp)
+
+    def render(self, t, out=None) -> np.ndarray:
+        """
+        Renders the plasma at time `t` into `out`, a (height, width, 3) uint8
+        array that is allocated if not given, and returns it.
+        """
+        if out is None:
+            out = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        count = len(self.WAVES)
+        for i, (frequency, direction, _) in enumerate(self.WAVES):
+            phase = frequency * direction * t
+            self.weights[i] = math.cos(phase)
+            self.weights[count + i] = math.sin(phase)
+        values = np.dot(self.weights, self.basis, out=self.values)
+        # hue = ((value + 4) / 8 + t * 0.05) % 1.0
+        values += 4
+        values *= 1 / 8
+        values += (t * 0.05) % 1.0
+        values %= 1.0
+        values *= self.hue_steps
+        self.indices[:] = values
+        np.take(self.hues, self.indices, axis=0, out=out.reshape(-1, 3))
+        return out
+
+_plasma = Plasma(WIDTH, HEIGHT)
+
 def update_plasma(t):
-    for y in range(HEIGHT):
-        for x in range(WIDTH):
-            color_value = (
-                math.sin(0.04*(-x + t)) +
-                math.sin(0.05*(y - t)) +
-                math.sin(0.06*(-(x + 0.5*y) + t)) +
-                math.sin(0.07*((0.5*x + y) - t)) 
-            )
-            normalized = (color_value + 4) / 8
-            hue = (normalized + t * 0.05) % 1.0
-            #r, g, b = colorsys.hsv_to_rgb(hue, 1, 1)
-            r, g, b = [int(c * 255) for c in colorsys.hsv_to_rgb(hue, 1, 1)]
-            pixel = plasma_pixels[y][x]
-            pixel[0] = r
-            pixel[1] = g
-            pixel[2] = b
-
-def partial_sort_error_positions():
-    #for i in range(len(top_error_positions) - 2, -1, -1):
-    for i in range(len(top_error_positions) - 1):
-        idx_a = top_error_positions[i]
-        idx_b = top_error_positions[i + 1]
-        y_a, x_a = divmod(idx_a, WIDTH)
-        y_b, x_b = divmod(idx_b, WIDTH)
-        if error_values[y_a][x_a] < error_values[y_b][x_b]:
-            top_error_positions[i], top_error_positions[i + 1] = top_error_positions[i + 1], top_error_positions[i]
+    _plasma.render(t, plasma_pixels)
+
+def set_update_pixel_count(count):
+    """
+    Sets how many pixels update_display picks per frame, e.g. from the
+    pixel budget of the calibrated link profile.
+    """
+    global UPDATE_PIXEL_COUNT
+    UPDATE_PIXEL_COUNT = max(1, min(int(count), WIDTH * HEIGHT))
+
+def rank_error_positions(count=None):
+    """
+    Moves the `count` positions with the highest error to the front of
+    top_error_positions, largest first. The selection is an O(n)
+    argpartition over the flat error array, so the pixels picked are
+    exactly the ones with the most error. `count` defaults to
+    UPDATE_PIXEL_COUNT.
+    """
+    if count is None:
+        count = UPDATE_PIXEL_COUNT
+    errors = error_values.reshape(-1)
+    split = errors.size - count
+    top = np.argpartition(errors, split)[split:]
+    top = top[np.argsort(errors[top])[::-1]]
+    rest = np.ones(errors.size, dtype=bool)
+    rest[top] = False
+    top_error_positions[:count] = top
+    top_error_positions[count:] = np.flatnonzero(rest)
+
+# Error metrics take the target and shown (HEIGHT, WIDTH, 3) uint8 buffers and
+# return the per-pixel error, scaled so black against white scores 765 like
+# the sum of absolute RGB differences does
+
+def absolute_error(target, shown):
+    """
+    Sum of absolute RGB differences.
+    """
+    return np.abs(target.astype(np.int16) - shown).sum(axis=2)
+
+# sRGB value to linear light, and the luminance weights of each channel
+SRGB_TO_LINEAR = np.array([
+    (c / 255) / 12.92 if c <= 10 else ((c / 255 + 0.055) / 1.055) ** 2.4 for c in range(256)
+])
+LUMINANCE_WEIGHTS = np.array([0.2126, 0.7152, 0.0722])
+
+def gamma_error(target, shown):
+    """
+    Absolute differences in linear light, weighted by how much each channel
+    contributes to luminance.
+    """
+    difference = np.abs(SRGB_TO_LINEAR[target] - SRGB_TO_LINEAR[shown])
+    return (difference @ LUMINANCE_WEIGHTS * 765).astype(np.int64)
+
+# CIE-Lab coordinates for a 32x32x32 RGB cube, built on first use
+LAB_LEVELS = 32
+_lab_table = None
+
+def lab_table():
+    """
+    Returns a (LAB_LEVELS ** 3, 3) table with the CIE-Lab (D65) coordinates
+    of the RGB cube, indexed by (r >> 3) * 1024 + (g >> 3) * 32 + (b >> 3).
+    """
+    global _lab_table
+    if _lab_table is None:
+        step = 256 // LAB_LEVELS
+        levels = SRGB_TO_LINEAR[np.arange(LAB_LEVELS) * step + step // 2]
+        rgb = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"), axis=-1).reshape(-1, 3)
+        xyz = rgb @ np.array([
+            [0.4124, 0.3576, 0.1805],
+            [0.2126, 0.7152, 0.0722],
+            [0.0193, 0.1192, 0.9505],
+        ]).T / np.array([0.9505, 1.0, 1.089])
+        f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+        _lab_table = np.stack([
+            116 * f[:, 1] - 16,
+            500 * (f[:, 0] - f[:, 1]),
+            200 * (f[:, 1] - f[:, 2]),
+        ], axis=-1).astype(np.float32)
+    return _lab_table
+
+def lab_error(target, shown):
+    """
+    CIE76 color difference (Euclidean distance in Lab), looked up from a
+    quantized RGB cube.
+    """
+    table = lab_table()
+    def lab(pixels):
+        quantized = pixels >> 3
+        return table[(quantized[..., 0].astype(np.intp) << 10) | (quantized[..., 1].astype(np.intp) << 5) | quantized[..., 2]]
+    distance = np.sqrt(((lab(target) - lab(shown)) ** 2).sum(axis=-1))
+    return (distance * 7.65).astype(np.int64)
+
+ERROR_METRICS = {
+    "absolute": absolute_error,
+    "gamma": gamma_error,
+    "lab": lab_error,
+}
+error_metric = absolute_error
+
+def set_error_metric(name):
+    """
+    Selects the error metric used by update_error, one of ERROR_METRICS.
+    """
+    global error_metric
+    if name not in ERROR_METRICS:
+        raise ValueError(f"Unknown error metric {name!r}, use one of {', '.join(ERROR_METRICS)}.")
+    error_metric = ERROR_METRICS[name]
 
 def update_error():
-    for y in range(HEIGHT):
-        for x in range(WIDTH):
-            plasma_pixel = plasma_pixels[y][x]
-            display_pixel = display_pixels[y][x]
-            error_values[y][x] += sum(abs(plasma_pixel[i] - display_pixel[i]) for i in range(3)) + random.randint(0,10)
-    partial_sort_error_positions()
-    partial_sort_error_positions()
+    difference = error_metric(plasma_pixels, display_pixels)
+    error_values[:] += difference + np.random.randint(0, 11, size=error_values.shape)
+    rank_error_positions()
+
+# Dithering between the target and the shown frame. With a strength above 0
+# the pixels sent carry part of the residual error (target - shown) of the
+# neighbouring pixels that are not sent this frame, so the local average of
+# what is shown converges on the target faster. The residual of a stale
+# pixel persists from frame to frame until it is sent, which makes this a
+# temporal error diffusion as well as a spatial one.
+dither_strength = 0.0
+_residual = np.zeros((HEIGHT + 2, WIDTH + 2, 3), dtype=np.int16)
+_neighbour_sum = np.zeros((HEIGHT, WIDTH, 3), dtype=np.int16)
+# Number of neighbours of each pixel within the frame (3 in corners, 5 at edges, 8 inside)
+_inside = np.pad(np.ones((HEIGHT, WIDTH)), 1)
+_neighbour_count = sum(_inside[dy:dy + HEIGHT, dx:dx + WIDTH] for dy in (0, 1, 2) for dx in (0, 1, 2) if dy != 1 or dx != 1)
+
+def set_dither_strength(strength):
+    """
+    Sets how much of the neighbouring residual error is diffused into the
+    pixels sent, 0 (off, the default) to 1.
+    """
+    global dither_strength
+    try:
+        strength = float(strength)
+    except (TypeError, ValueError):
+        strength = None
+    if strength is None or not 0.0 <= strength <= 1.0:
+        raise ValueError("Dither strength must be a number from 0 to 1.")
+    dither_strength = strength
+
+def dithered_values(top) -> np.ndarray:
+    """
+    Returns the values to show at the flat positions `top`: the target plus
+    `dither_strength` times the mean residual of their neighbours that are
+    not among `top`.
+    """
+    residual = _residual[1:-1, 1:-1]
+    np.subtract(plasma_pixels, display_pixels, out=residual, dtype=np.int16)
+    residual.reshape(-1, 3)[top] = 0
+    _neighbour_sum[:] = 0
+    for dy in (0, 1, 2):
+        for dx in (0, 1, 2):
+            if dy != 1 or dx != 1:
+                np.add(_neighbour_sum, _residual[dy:dy + HEIGHT, dx:dx + WIDTH], out=_neighbour_sum)
+    correction = _neighbour_sum.reshape(-1, 3)[top] / _neighbour_count.reshape(-1)[top, None]
+    values = plasma_pixels.reshape(-1, 3)[top] + dither_strength * correction
+    return np.clip(values.round(), 0, 255).astype(np.uint8)
 
 def update_display():
-    for i in range(UPDATE_PIXEL_COUNT):
-        p = top_error_positions[i]
-        y, x = divmod(p, WIDTH)
-        display_pixels[y][x][:] = plasma_pixels[y][x]
-        error_values[y][x] = 0
-    top_error_positions[:] = top_error_positions[UPDATE_PIXEL_COUNT:] + top_error_positions[:UPDATE_PIXEL_COUNT]
+    # Send the top positions and move them last, where the senders pick them up
+    top = top_error_positions[:UPDATE_PIXEL_COUNT]
+    if dither_strength:
+        display_pixels.reshape(-1, 3)[top] = dithered_values(top)
+    else:
+        display_pixels.reshape(-1, 3)[top] = plasma_pixels.reshape(-1, 3)[top]
+    error_values.reshape(-1)[top] = 0
+    top_error_positions[:] = np.roll(top_error_positions, -UPDATE_PIXEL_COUNT)
 
 def max_error_value():
-    return max(max(row) for row in error_values) + 1
+    return int(error_values.max()) + 1
+
+# ===================================== #
+#    BLE SENDER (draw_plasma*.py)
+# ===================================== #
+
+STATS_INTERVAL = 10
+
+def parse_args(argv, script, options="[--worker] [--packed] "):
+    """
+    Applies the optional error metric (absolute, the default, gamma or lab)
+    and --dither or --dither=<0-1> in `argv`, and returns the set of the
+    other --options. A bad argument prints the error and the usage of
+    `script`, with its `options`, and exits.
+    """
+    import sys
+    args = [arg for arg in argv if not arg.startswith("--")]
+    try:
+        if args:
+            set_error_metric(args[0])
+        for arg in argv:
+            if arg == "--dither" or arg.startswith("--dither="):
+                set_dither_strength(arg.partition("=")[2] or 1.0)
+    except ValueError as e:
+        print(e)
+        print(f"Usage: python3 {script} [absolute|gamma|lab] {options}[--dither[=<0-1>]]")
+        sys.exit(2)
+    return {arg for arg in argv if arg.startswith("--")}
+
+async def run_plasma(update_frame=None, speed=0.01, use_worker=False, packed=False):
+    """
+    Streams the plasma to the display until interrupted, advancing the
+    plasma time by `speed` per frame. `update_frame` is called on each
+    frame before the pixels to send are picked, e.g. to draw a clock on it.
+
+    With `use_worker` the plasma is rendered in a separate process, and
+    `packed` packs several pixel commands per write (see packing.py to check
+    the display takes it). The pixel budget and packing otherwise come from
+    the calibrated link profile.
+    """
+    import asyncio
+    import time
+    import metrics
+    from codec import CHARACTERISTIC_UUID, GRAFFITI_COMMANDS, encode_frame_pixels, iter_commands, new_pixel_buffer
+    from connection import DisplayConnection
+    from frame_queue import FrameMailbox, FrameSender
+    from link_profile import load_profile
+    from pacing import MODE_SETTLE, paced
+    from packing import iter_packed, max_write_size
+    from shared_frames import FrameWorker, PlasmaRenderer
+
+    async def start_graffiti(client):
+        # Called after every (re)connect
+        await paced(client).write_commands(GRAFFITI_COMMANDS, settle=MODE_SETTLE)
+
+    metrics.start_from_env()
+    # The connection reconnects by itself (and re-sends the init commands)
+    # when the link drops, writes made meanwhile wait for it. Failed writes
+    # are reported by the sender, which carries on with the latest frame
+    async with DisplayConnection(on_connect=start_graffiti) as connection:
+        pacer = paced(connection)
+
+        profile = load_profile(connection.address)
+        set_update_pixel_count(profile["pixel_count"])
+        write_size = max_write_size(connection)
+        if profile["write_size"] > 10:
+            # Calibrated to pack commands, up to the size found stable
+            packed = True
+            write_size = min(write_size, profile["write_size"])
+        pixel_buffer = new_pixel_buffer(UPDATE_PIXEL_COUNT)
+
+        async def send(frame):
+            # Pick the pixels to send against the latest frame, so frames
+            # dropped in the mailbox never leave the display out of sync
+            if frame is not plasma_pixels:
+                plasma_pixels[:] = frame
+            if update_frame is not None:
+                update_frame()
+            update_error()
+            update_display()
+
+            # Send the UPDATE_PIXEL_COUNT last positions from top_error_positions
+            commands = encode_frame_pixels(display_pixels, top_error_positions[-UPDATE_PIXEL_COUNT:], pixel_buffer)
+            # Packed writes carry several commands each, if the firmware takes them
+            writes = iter_packed(commands, write_size) if packed else iter_commands(commands)
+            for data in writes:
+                await pacer.write_gatt_char(CHARACTERISTIC_UUID, data)
+
+        t = random.randrange(0, 1000000)
+        if use_worker:
+            # The worker renders into a shared-memory ring, which already
+            # keeps only the latest frames, so it takes the mailbox's place
+            with FrameWorker(PlasmaRenderer(speed, t), fps=FPS) as worker:
+                print("\nStarting plasma effect in a worker process...")
+                async for sequence, frame in worker.ring.frames():
+                    # Copy the frame out of the ring, then drop it if the
+                    # worker overwrote the slot during the copy
+                    plasma_pixels[:] = frame
+                    if worker.ring.valid(sequence):
+                        await send(plasma_pixels)
+        else:
+            mailbox = FrameMailbox(plasma_pixels.shape)
+            async with FrameSender(mailbox, send) as sender:
+                print("\nStarting plasma effect...")
+                next_frame = next_stats = time.perf_counter()
+                while True:
+                    update_plasma(t)
+                    mailbox.put(plasma_pixels)
+                    t += speed
+
+                    next_frame += 1 / FPS
+                    now = time.perf_counter()
+                    if now >= next_stats:
+                        print(sender.stats())
+                        next_stats = now + STATS_INTERVAL
+                    await asyncio.sleep(max(0, next_frame - now))
+
+def send_plasma(update_frame=None, speed=0.01):
+    """
+    Entry point of the draw_plasma scripts: parses the command line (see
+    parse_args, plus --worker and --packed) and runs run_plasma.
+    """
+    import asyncio
+    import os
+    import sys
+    options = parse_args(sys.argv[1:], os.path.basename(sys.argv[0]))
+    asyncio.run(run_plasma(update_frame, speed, "--worker" in options, "--packed" in options))
 
 # ===================================== #
 #    TKINTER-DEPENDENT (NOT IMPORTABLE)
@@ -243,4 +481,7 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
+    import sys
+    # Same error metric and --dither options as the draw_plasma scripts
+    parse_args(sys.argv[1:], "plasma.py", options="")
     main()
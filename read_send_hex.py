@@ -1,10 +1,9 @@
 import asyncio
 import sys
-from bleak import BleakScanner, BleakClient
-
-# Service and characteristic UUIDs for MI Matrix Display
-SERVICE_UUID = "0000ffd0-0000-1000-8000-00805f9b34fb"
-CHARACTERISTIC_UUID = "0000ffd1-0000-1000-8000-00805f9b34fb"
+from bleak import BleakError
+from codec import CHARACTERISTIC_UUID
+from connection import DisplayConnection
+from replay import MAX, load_capture, replay
 
 def parse_hex_input(hex_str: str) -> bytearray:
     """
@@ -17,59 +16,45 @@ def parse_hex_input(hex_str: str) -> bytearray:
         print("Invalid hex input. Please enter a valid hex string.")
         return None
 
-async def find_device(name="MI Matrix Display", timeout=20):
-    """
-    Scans for the MI Matrix Display device.
-    """
-    print("Scanning for BLE devices...")
-    scanner = BleakScanner()
-    await scanner.start()
-    
-    target_device = None
-    start_time = asyncio.get_event_loop().time()
-    while (asyncio.get_event_loop().time() - start_time) < timeout:
-        for device in scanner.discovered_devices:
-            if device.name == name:
-                target_device = device
-                break
-        if target_device:
-            break
-        await asyncio.sleep(1)
-    
-    await scanner.stop()
-    return target_device
-
 async def main():
     """
     Main function that connects to the device and sends user input.
     """
-    device = await find_device()
-    if not device:
-        print("MI Matrix Display not found.")
+    try:
+        connection = DisplayConnection()
+        await connection.connect(retries=3)
+    except (BleakError, asyncio.TimeoutError, OSError) as e:
+        # The errors DisplayConnection.connect retries on, after the last retry
+        print(f"Failed to connect: {e}")
         return
-    
-    print(f"Connecting to {device.name} at {device.address}...")
-    async with BleakClient(device) as client:
-        if client.is_connected:
-            print("Connected to MI Matrix Display!")
-            
-            print("Device is ready. Enter hex commands to send (q or Ctrl+C to exit).")
-            
-            while True:
-                try:
-                    user_input = input("Enter hex command: ")
-                    if (user_input.startswith("q")):
-                        print("Exiting")
-                        break
-                    data = parse_hex_input(user_input)
-                    if data:
-                        await client.write_gatt_char(CHARACTERISTIC_UUID, data)
-                        print(f"Sent: {data.hex()}")
-                except KeyboardInterrupt:
-                    print("\nExiting...")
+
+    async with connection:
+        print("Connected to MI Matrix Display!")
+
+        print("Device is ready. Enter hex commands to send, or replay <file> (q or Ctrl+C to exit).")
+
+        while True:
+            try:
+                user_input = input("Enter hex command: ")
+                if (user_input.startswith("q")):
+                    print("Exiting")
                     break
-        else:
-            print("Failed to connect.")
+                if user_input.startswith("replay "):
+                    try:
+                        capture = load_capture(user_input[len("replay "):].strip())
+                    except (OSError, ValueError) as e:
+                        print(f"Could not load capture: {e}")
+                        continue
+                    seconds = await replay(connection, capture, MAX)
+                    print(f"Replayed {len(capture)} commands in {seconds:.2f} s")
+                    continue
+                data = parse_hex_input(user_input)
+                if data:
+                    await connection.write_gatt_char(CHARACTERISTIC_UUID, data)
+                    print(f"Sent: {data.hex()}")
+            except KeyboardInterrupt:
+                print("\nExiting...")
+                break
 
 if __name__ == "__main__":
     asyncio.run(main())
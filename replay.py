@@ -0,0 +1,194 @@
+"""
+Replay of captured command streams.
+
+A Capture holds a sequence of commands pre-encoded into one contiguous
+buffer, with precomputed views per command and the time of each command
+relative to the first. Captures can be built from snoop exports (see
+snoop.py), from files with one hex command per line (like
+store_image_commands.txt) or from a session recorded with RecordingClient.
+
+Replay modes:
+  - original: the captured inter-command timing
+  - scaled: the captured timing multiplied by a factor
+  - max: as fast as the (paced) link allows
+
+Usage:
+    python3 replay.py snoops/saves_to_device_with_summary.txt --kinds animation_start animation_block animation_end
+    python3 replay.py store_image_commands.txt --mode max --emulator
+"""
+import argparse
+import asyncio
+import time
+import numpy as np
+from codec import CHARACTERISTIC_UUID, decode_command
+from pacing import paced
+
+ORIGINAL = "original"
+SCALED = "scaled"
+MAX = "max"
+
+class Capture:
+    """
+    Commands in one contiguous uint8 buffer. `offsets` has one entry more
+    than there are commands, command i is buffer[offsets[i]:offsets[i + 1]],
+    and `times` holds its time in seconds relative to the first command.
+    """
+    def __init__(self, commands, times=None):
+        commands = [bytes(command) for command in commands]
+        self.offsets = np.zeros(len(commands) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum([len(command) for command in commands])
+        self.buffer = bytearray(b"".join(commands))
+        if times is None or len(times) == 0 or any(t is None for t in times):
+            self.times = np.zeros(len(commands))
+        else:
+            self.times = np.asarray(times, dtype=np.float64) - times[0]
+        view = memoryview(self.buffer)
+        self.views = [view[start:end] for start, end in zip(self.offsets[:-1], self.offsets[1:])]
+
+    def __len__(self):
+        return len(self.views)
+
+    @property
+    def duration(self):
+        return float(self.times[-1]) if len(self.times) else 0.0
+
+    def kinds(self):
+        return [decode_command(view)[0] for view in self.views]
+
+    @classmethod
+    def from_snoop(cls, source, kinds=None, handle=None):
+        """
+        Builds a capture from a snoop export, keeping the display commands
+        (those starting with 0xBC), optionally only the given kinds or ATT
+        handle. Timestamps are used when the export has them.
+        """
+        from snoop import read_commands
+        commands = []
+        times = []
+        for command in read_commands(source):
+            if not command.data.startswith(b"\xbc"):
+                continue
+            if kinds and command.kind not in kinds:
+                continue
+            if handle is not None and command.handle != handle:
+                continue
+            commands.append(command.data)
+            times.append(command.time)
+        return cls(commands, times)
+
+    @classmethod
+    def from_hex_file(cls, path):
+        """
+        Builds a capture from a text file with one hex command per line.
+        Empty lines and lines starting with // or # are skipped. A line may
+        start with a timestamp in seconds followed by the command.
+        """
+        commands = []
+        times = []
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith(("//", "#")):
+                    continue
+                first, _, rest = line.partition(" ")
+                if "." in first:
+                    times.append(float(first))
+                    line = rest
+                else:
+                    times.append(None)
+                commands.append(bytes.fromhex(line.replace(" ", "")))
+        return cls(commands, times)
+
+class RecordingClient:
+    """
+    Passes writes through to a client (if any) and records them with their
+    time, so a session can be turned into a Capture and replayed later.
+    """
+    def __init__(self, client=None):
+        self.client = client
+        self.commands = []
+        self.times = []
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    async def write_gatt_char(self, char_uuid, data, response=None):
+        self.commands.append(bytes(data))
+        self.times.append(time.perf_counter())
+        if self.client is not None:
+            await self.client.write_gatt_char(char_uuid, data, response=response)
+
+    def capture(self) -> Capture:
+        return Capture(self.commands, self.times)
+
+async def replay(client, capture: Capture, mode=ORIGINAL, scale=1.0, loops=1):
+    """
+    Writes the commands of a capture to a client. In original and scaled
+    mode each command is written at its (scaled) time from the start,
+    so write time does not accumulate; in max mode commands go out back to
+    back, paced by the adaptive pacer. Returns the time taken.
+    """
+    client = paced(client)
+    if mode == ORIGINAL:
+        scale = 1.0
+    times = capture.times * scale
+    loop = asyncio.get_running_loop()
+    write = client.write_gatt_char
+    views = capture.views
+
+    start = loop.time()
+    for _ in range(loops):
+        loop_start = loop.time()
+        if mode == MAX:
+            for view in views:
+                await write(CHARACTERISTIC_UUID, view)
+        else:
+            for view, at in zip(views, times.tolist()):
+                delay = loop_start + at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await write(CHARACTERISTIC_UUID, view)
+    return loop.time() - start
+
+def load_capture(path, kinds=None) -> Capture:
+    """
+    Loads a capture from a snoop export, or from a hex command file if the
+    file has no hex dumps in it.
+    """
+    capture = Capture.from_snoop(path, kinds=kinds)
+    if len(capture) == 0:
+        capture = Capture.from_hex_file(path)
+    return capture
+
+async def run(args):
+    if args.hex:
+        capture = Capture.from_hex_file(args.capture)
+    else:
+        capture = load_capture(args.capture, args.kinds)
+    print(f"Loaded {len(capture)} commands, {len(capture.buffer)} bytes, {capture.duration:.2f} s captured")
+
+    if args.emulator:
+        from emulator import EmulatedClient
+        client = EmulatedClient(realtime=False)
+        seconds = await replay(client, capture, args.mode, args.scale, args.loops)
+        print(f"Replayed in {seconds:.2f} s ({client.clock:.2f} s emulated link time): {client.stats()['commands']}")
+        return
+
+    from connection import DisplayConnection
+    async with DisplayConnection() as connection:
+        seconds = await replay(connection, capture, args.mode, args.scale, args.loops)
+        print(f"Replayed in {seconds:.2f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured commands to the MI Matrix Display.")
+    parser.add_argument("capture", help="snoop export or file with one hex command per line")
+    parser.add_argument("--mode", choices=[ORIGINAL, SCALED, MAX], default=ORIGINAL)
+    parser.add_argument("--scale", type=float, default=1.0, help="time scale for scaled mode, 0.5 is twice as fast")
+    parser.add_argument("--loops", type=int, default=1)
+    parser.add_argument("--kinds", nargs="+", help="only replay these command kinds, see codec.decode_command")
+    parser.add_argument("--hex", action="store_true", help="read the capture as hex command lines")
+    parser.add_argument("--emulator", action="store_true", help="replay against the emulator instead of a display")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Frame rendering in a worker process through a shared-memory ring.
+
+Effects like the plasma are CPU bound and, run on the event loop, every
+spike delays the next BLE write. A FrameWorker runs a render function in a
+separate process that writes frames straight into a ring of 768-byte slots
+in multiprocessing.shared_memory. The sender maps the same memory and reads
+the newest frame as a NumPy view, without pickling or a pipe. The view is
+not a snapshot: a reader that needs the frame to stay put copies it out
+(768 bytes) and checks valid() after the copy, like the plasma scripts do.
+
+The ring has a single writer and a single reader. Each slot has a sequence
+number that is odd while the slot is being written, so the reader can check
+that the frame it used was not overwritten meanwhile (see FrameRing.valid).
+
+Usage:
+    worker = FrameWorker(PlasmaRenderer(), fps=30)
+    worker.start()
+    async for sequence, frame in worker.ring.frames():
+        ...  # encode frame, then check worker.ring.valid(sequence)
+    worker.stop()
+"""
+import asyncio
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from codec import WIDTH, HEIGHT
+
+FRAME_SHAPE = (HEIGHT, WIDTH, 3)
+FRAME_SIZE = HEIGHT * WIDTH * 3
+DEFAULT_SLOTS = 8
+
+class FrameRing:
+    """
+    A ring of frame slots in shared memory.
+
+    The header is an int64 array: the number of frames written so far,
+    followed by the sequence number of each slot. Create the ring in the
+    sender with `create` set and attach to it by name in the worker.
+    """
+    def __init__(self, name=None, slots=DEFAULT_SLOTS, create=True):
+        self.slot_count = slots
+        header_size = (1 + slots) * 8
+        if create:
+            self.memory = shared_memory.SharedMemory(create=True, size=header_size + slots * FRAME_SIZE, name=name)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.owner = create
+        self.name = self.memory.name
+        self.header = np.ndarray(1 + slots, dtype=np.int64, buffer=self.memory.buf)
+        self.sequences = self.header[1:]
+        self.slots = np.ndarray((slots,) + FRAME_SHAPE, dtype=np.uint8, buffer=self.memory.buf, offset=header_size)
+        if create:
+            self.header[:] = 0
+
+    @property
+    def written(self) -> int:
+        return int(self.header[0])
+
+    def write(self, render):
+        """
+        Calls `render(out)` with the next free slot and publishes it. Only
+        the worker process writes.
+        """
+        count = int(self.header[0])
+        slot = count % self.slot_count
+        self.sequences[slot] = 2 * count + 1
+        render(self.slots[slot])
+        self.sequences[slot] = 2 * count + 2
+        self.header[0] = count + 1
+
+    def latest(self):
+        """
+        Returns (sequence, frame) for the newest complete frame, where
+        frame is a view into shared memory, or (None, None) if nothing
+        has been written yet.
+        """
+        count = int(self.header[0])
+        if count == 0:
+            return None, None
+        slot = (count - 1) % self.slot_count
+        return 2 * count, self.slots[slot]
+
+    def valid(self, sequence) -> bool:
+        """
+        Returns True if the frame returned with `sequence` has not been
+        overwritten since, i.e. whatever was read from it is consistent.
+        """
+        slot = (sequence // 2 - 1) % self.slot_count
+        return int(self.sequences[slot]) == sequence
+
+    async def frames(self, poll=0.001):
+        """
+        Yields (sequence, frame) for each new frame, skipping frames that
+        were overwritten before the reader got to them.
+        """
+        last = 0
+        while True:
+            sequence, frame = self.latest()
+            if sequence is None or sequence == last:
+                await asyncio.sleep(poll)
+                continue
+            last = sequence
+            yield sequence, frame
+
+    def close(self):
+        # Drop the views before closing the mapping
+        self.header = self.sequences = self.slots = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+class PlasmaRenderer:
+    """
+    Picklable render function for the plasma effect: called with a frame
+    number and an output slot.
+    """
+    def __init__(self, speed=0.01, start=0.0):
+        self.speed = speed
+        self.start = start
+        self.plasma = None
+
+    def __call__(self, index, out):
+        if self.plasma is None:
+            from plasma import Plasma
+            self.plasma = Plasma(WIDTH, HEIGHT)
+        self.plasma.render(self.start + index * self.speed, out)
+
+def _run_worker(name, slots, render, fps, stop):
+    ring = FrameRing(name, slots, create=False)
+    try:
+        interval = 1 / fps
+        next_frame = time.perf_counter()
+        index = 0
+        while not stop.is_set():
+            ring.write(lambda out: render(index, out))
+            index += 1
+            next_frame += interval
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                stop.wait(delay)
+            else:
+                next_frame = time.perf_counter()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+class FrameWorker:
+    """
+    Runs `render(index, out)` in a separate process at `fps` frames per
+    second, writing into a FrameRing available as `ring`.
+    """
+    def __init__(self, render, fps=30, slots=DEFAULT_SLOTS):
+        self.render = render
+        self.fps = fps
+        self.ring = FrameRing(slots=slots)
+        self.stop_event = multiprocessing.Event()
+        self.process = None
+
+    def start(self):
+        self.process = multiprocessing.Process(
+            target=_run_worker, args=(self.ring.name, self.ring.slot_count, self.render, self.fps, self.stop_event),
+            daemon=True)
+        self.process.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.process is not None:
+            self.process.join(timeout=2)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        self.ring.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
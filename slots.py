@@ -0,0 +1,155 @@
+"""
+Batch upload of pictures to the display's storage, for slideshow mode.
+
+Stored pictures stay on the display and slideshow mode cycles through them
+without any BLE traffic. The store sequence, as captured in
+store_image_commands.txt, is: end any picture in progress, STORE_BEGIN,
+a full picture (with the vendor checksum on each block), STORE_END. Each
+stored picture is appended after the ones already on the display; there is
+no known command to replace or delete a single stored picture.
+
+A local manifest in ~/.mi_led_slots.json records, per display address, the
+content hashes of the pictures stored so far. Uploading a playlist only
+sends the pictures after the ones the display already has, so re-running
+the same (or an extended) playlist is free.
+
+Usage:
+    python3 slots.py image1.png image2.png image3.gif
+    python3 slots.py --list
+    python3 slots.py --force image1.png image2.png   # after clearing the display
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+from codec import (CHARACTERISTIC_UUID, END_PICTURE_COMMAND, SLIDESHOW_COMMAND, START_PICTURE_COMMAND,
+                   STORE_BEGIN_COMMAND, STORE_END_COMMAND, block_checksum, encode_full_picture, to_frame)
+from pacing import paced
+
+MANIFEST_PATH = os.path.expanduser("~/.mi_led_slots.json")
+
+def picture_hash(picture) -> str:
+    """
+    Returns a hash of the pixels of a picture, so the same picture from
+    different files (or re-encoded) is recognized as the same content.
+    """
+    return hashlib.sha256(to_frame(picture).tobytes()).hexdigest()
+
+def store_commands(picture) -> list:
+    """
+    Returns the command sequence that stores `picture` on the display.
+    """
+    blocks = encode_full_picture(picture)
+    commands = [END_PICTURE_COMMAND, STORE_BEGIN_COMMAND, START_PICTURE_COMMAND]
+    for block in blocks:
+        # The block with a checksum byte before the terminator
+        command = bytearray(block[:-1].tobytes() + b"\x00\x55")
+        command[-2] = block_checksum(command)
+        commands.append(bytes(command))
+    commands += [END_PICTURE_COMMAND, STORE_END_COMMAND]
+    return commands
+
+def load_manifest(address, path=MANIFEST_PATH) -> list:
+    """
+    Returns the manifest entries ({"hash", "name"} dicts, in storage
+    order) of the display with the given address.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f).get(address, [])
+    except (OSError, ValueError):
+        return []
+
+def save_manifest(address, entries, path=MANIFEST_PATH):
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest[address] = entries
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+async def upload_playlist(client, pictures, names=None, address=None, manifest_path=MANIFEST_PATH,
+                          force=False, slideshow=True) -> tuple:
+    """
+    Stores a playlist of pictures on the display and returns the number of
+    pictures (uploaded, skipped).
+
+    Pictures the manifest says are already stored, in the same order, are
+    skipped. If the display holds something else than the start of the
+    playlist a ValueError is raised, since stored pictures cannot be
+    replaced; with `force` the whole playlist is uploaded and the manifest
+    reset to it, for a display that has been cleared with the vendor app.
+    The manifest is saved after every picture, so an interrupted upload
+    resumes where it stopped.
+    """
+    address = address or getattr(client, "address", None) or "unknown"
+    names = names or [str(i) for i in range(len(pictures))]
+    hashes = [picture_hash(picture) for picture in pictures]
+    stored = [] if force else load_manifest(address, manifest_path)
+
+    stored_hashes = [entry["hash"] for entry in stored]
+    if stored_hashes != hashes[:len(stored_hashes)]:
+        raise ValueError(f"The display holds {len(stored)} other picture(s) than the start of the playlist. "
+                         "Clear it with the vendor app and upload with force.")
+
+    pacer = paced(client)
+    entries = list(stored)
+    for picture, name, digest in list(zip(pictures, names, hashes))[len(stored):]:
+        print(f"Storing {name} in slot {len(entries)}")
+        await pacer.write_commands(store_commands(picture))
+        entries.append({"hash": digest, "name": name})
+        save_manifest(address, entries, manifest_path)
+
+    if slideshow:
+        await pacer.write_gatt_char(CHARACTERISTIC_UUID, SLIDESHOW_COMMAND)
+    return len(entries) - len(stored), len(stored)
+
+def load_pictures(paths) -> list:
+    # The first frame of each file, through the encoded image cache
+    from draw_file import load_encoded_animation
+    return [load_encoded_animation(path).frame(0) for path in paths]
+
+async def run(args):
+    if args.emulator:
+        from emulator import EmulatedClient
+        client = EmulatedClient(realtime=False)
+        connection = None
+    else:
+        from connection import DisplayConnection
+        connection = client = DisplayConnection()
+        if not args.list:
+            # Listing only needs the cached address
+            await connection.connect(retries=3)
+
+    try:
+        if args.list:
+            for slot, entry in enumerate(load_manifest(client.address, args.manifest)):
+                print(f"{slot:3d} {entry['hash'][:12]} {entry['name']}")
+            return
+        pictures = load_pictures(args.images)
+        uploaded, skipped = await upload_playlist(client, pictures, args.images, client.address, args.manifest,
+                                                  force=args.force, slideshow=not args.no_slideshow)
+        print(f"Uploaded {uploaded} picture(s), skipped {skipped} already stored")
+    finally:
+        if connection is not None:
+            await connection.disconnect()
+
+def main():
+    parser = argparse.ArgumentParser(description="Store pictures on the MI Matrix Display and start the slideshow.")
+    parser.add_argument("images", nargs="*", help="image files in playlist order")
+    parser.add_argument("--list", action="store_true", help="list the stored pictures from the manifest")
+    parser.add_argument("--force", action="store_true", help="upload everything and reset the manifest")
+    parser.add_argument("--no-slideshow", action="store_true", help="do not start slideshow mode after uploading")
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    parser.add_argument("--emulator", action="store_true", help="upload to the emulator instead of a display")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    except ValueError as e:
+        print(e)
+
+if __name__ == "__main__":
+    main()
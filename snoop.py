@@ -0,0 +1,163 @@
+"""
+Streaming parser for Wireshark plain-text exports of btatt snoop logs.
+
+Handles the export formats in snoops/: with a packet summary line per packet
+(which gives the frame number and timestamp), with only the "Frame N:" detail
+lines, or with nothing but the hex dumps. Everything is processed line by
+line with generators, so memory use stays constant for captures of any size.
+
+The pipeline is:
+  - iter_packets: hex dumps to raw HCI packets
+  - iter_att_writes: HCI ACL fragments and ATT prepared writes reassembled
+    into complete ATT write values
+  - read_commands: writes decoded into typed records with codec.decode_command
+
+Usage:
+    python3 snoop.py snoops/two_pictures.txt
+    python3 snoop.py --summary snoops/*.txt
+"""
+import re
+import sys
+from collections import namedtuple
+from codec import decode_command
+
+Packet = namedtuple("Packet", "frame time info data")
+AttWrite = namedtuple("AttWrite", "frame time handle opcode value")
+SnoopCommand = namedtuple("SnoopCommand", "frame time handle kind fields data")
+
+SUMMARY_LINE = re.compile(r"^\s*(\d+)\s+(\d+\.\d+)\s+(.*?)\s*$")
+FRAME_LINE = re.compile(r"^Frame (\d+):")
+HEX_LINE = re.compile(r"^([0-9a-f]{4})  ([0-9a-f]{2}(?: [0-9a-f]{2})*)")
+
+HCI_ACL = 0x02
+ATT_CID = 0x0004
+ATT_WRITE_REQUEST = 0x12
+ATT_WRITE_COMMAND = 0x52
+ATT_PREPARE_WRITE_REQUEST = 0x16
+ATT_EXECUTE_WRITE_REQUEST = 0x18
+ATT_WRITES = (ATT_WRITE_REQUEST, ATT_WRITE_COMMAND)
+
+def iter_packets(lines):
+    """
+    Yields a Packet for each hex dump in an export. `frame`, `time` and
+    `info` are None when the export does not include them.
+    """
+    frame = time = info = None
+    data = None
+    for line in lines:
+        match = HEX_LINE.match(line)
+        if match:
+            offset = int(match.group(1), 16)
+            if offset == 0:
+                if data:
+                    yield Packet(frame, time, info, bytes(data))
+                    frame = time = info = None
+                data = bytearray()
+            if data is not None:
+                data += bytes.fromhex(match.group(2))
+            continue
+
+        match = SUMMARY_LINE.match(line)
+        if match:
+            if data:
+                yield Packet(frame, time, info, bytes(data))
+                data = None
+            frame, time, info = int(match.group(1)), float(match.group(2)), match.group(3)
+            continue
+
+        match = FRAME_LINE.match(line)
+        if match:
+            if data:
+                yield Packet(frame, time, info, bytes(data))
+                data = None
+                time = info = None
+            frame = int(match.group(1))
+    if data:
+        yield Packet(frame, time, info, bytes(data))
+
+def iter_att_writes(packets):
+    """
+    Yields an AttWrite for each complete ATT write (request or command) in a
+    stream of HCI packets, reassembling fragmented ACL packets and long
+    writes made of prepare/execute requests.
+    """
+    fragments = {}
+    prepared = {}
+    for packet in packets:
+        data = packet.data
+        if len(data) < 5 or data[0] != HCI_ACL:
+            continue
+        header = int.from_bytes(data[1:3], "little")
+        connection = header & 0x0FFF
+        boundary = (header >> 12) & 0x3
+        payload = data[5:]
+
+        if boundary == 0x1:
+            # Continuation of a fragmented L2CAP packet
+            if connection not in fragments:
+                continue
+            start, buffer, expected = fragments[connection]
+            buffer += payload
+            if len(buffer) < expected:
+                continue
+            del fragments[connection]
+            packet, payload = start, bytes(buffer)
+        elif len(payload) >= 4:
+            expected = int.from_bytes(payload[0:2], "little") + 4
+            if len(payload) < expected:
+                fragments[connection] = (packet, bytearray(payload), expected)
+                continue
+        else:
+            continue
+
+        if int.from_bytes(payload[2:4], "little") != ATT_CID or len(payload) < 5:
+            continue
+        att = payload[4:]
+        opcode = att[0]
+        if opcode in ATT_WRITES and len(att) >= 3:
+            yield AttWrite(packet.frame, packet.time, int.from_bytes(att[1:3], "little"), opcode, att[3:])
+        elif opcode == ATT_PREPARE_WRITE_REQUEST and len(att) >= 5:
+            handle = int.from_bytes(att[1:3], "little")
+            offset = int.from_bytes(att[3:5], "little")
+            first, value = prepared.setdefault((connection, handle), (packet, bytearray()))
+            value[offset:offset + len(att) - 5] = att[5:]
+        elif opcode == ATT_EXECUTE_WRITE_REQUEST and len(att) >= 2:
+            for key in [key for key in prepared if key[0] == connection]:
+                first, value = prepared.pop(key)
+                if att[1] == 0x01:
+                    yield AttWrite(first.frame, first.time, key[1], ATT_PREPARE_WRITE_REQUEST, bytes(value))
+
+def read_commands(source):
+    """
+    Yields a SnoopCommand for each display command written in an export.
+    `source` is a file name or an iterable of lines.
+    """
+    if isinstance(source, str):
+        with open(source, errors="replace") as f:
+            yield from read_commands(f)
+        return
+    for write in iter_att_writes(iter_packets(source)):
+        kind, fields = decode_command(write.value)
+        yield SnoopCommand(write.frame, write.time, write.handle, kind, fields, write.value)
+
+def main():
+    args = sys.argv[1:]
+    summary = "--summary" in args
+    paths = [arg for arg in args if arg != "--summary"]
+    if not paths:
+        print("Usage: python3 snoop.py [--summary] <export.txt> ...")
+        return
+
+    for path in paths:
+        counts = {}
+        for command in read_commands(path):
+            counts[command.kind] = counts.get(command.kind, 0) + 1
+            if not summary:
+                time = f"{command.time:12.6f}" if command.time is not None else " " * 12
+                frame = command.frame if command.frame is not None else ""
+                print(f"{frame:>7} {time} {command.kind:<16} {command.data.hex()}")
+        if summary:
+            print(f"{path}: " + ", ".join(f"{kind} {count}" for kind, count in sorted(counts.items())))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import asyncio
+import benchmark
+from emulator import EmulatedClient
+
+def test_virtual_runs_only_count_virtual_time():
+    def run():
+        client = EmulatedClient(realtime=False)
+        return asyncio.run(benchmark.measure("pixels", client, 20)), client
+
+    first, client = run()
+    second, _ = run()
+    # No wall time in the numbers, so they repeat exactly
+    assert first["seconds"] == second["seconds"]
+    assert first["latency_p99"] == second["latency_p99"]
+    # The link time plus the pacer's gaps between the writes
+    assert first["seconds"] > client.clock
@@ -0,0 +1,40 @@
+import asyncio
+from calibrate import MIN_GAP, best_profile, choose_profile, sweep
+from codec import PIXEL_COMMAND_SIZE
+from emulator import EmulatedClient
+from packing import max_write_size
+
+def run_sweep(client, packed):
+    def verify(indices, colors):
+        return bool((client.framebuffer[indices] == colors).all())
+
+    return asyncio.run(sweep(client, packed, writes=5, verify=verify))
+
+def test_unpacked_sweep_writes_single_commands():
+    results = run_sweep(EmulatedClient(realtime=False), packed=False)
+    assert {result["write_size"] for result in results} == {PIXEL_COMMAND_SIZE}
+    assert all(result["stable"] for result in results)
+
+def test_packed_sweep_stays_within_the_mtu():
+    client = EmulatedClient(realtime=False, accept_concatenated=True)
+    results = run_sweep(client, packed=True)
+    sizes = {result["write_size"] for result in results}
+    assert PIXEL_COMMAND_SIZE in sizes and len(sizes) > 1
+    assert max(sizes) <= max_write_size(client)
+    assert all(result["stable"] for result in results)
+
+def test_dropped_writes_are_caught_without_verify():
+    # Like a real link: nothing reports the writes without response that are lost
+    client = EmulatedClient(realtime=False, drop_rate=0.05, seed=1)
+    results = asyncio.run(sweep(client, writes=5))
+
+    def confirm(color):
+        return bool((client.framebuffer == color).all())
+
+    profile = asyncio.run(choose_profile(client, results, confirm))
+    assert profile is None
+
+def test_profile_keeps_a_gap_floor():
+    results = run_sweep(EmulatedClient(realtime=False), packed=False)
+    profile = best_profile(results)
+    assert profile["gap"] >= MIN_GAP and profile["min_gap"] >= MIN_GAP
@@ -0,0 +1,104 @@
+import glob
+import os
+import numpy as np
+import pytest
+from codec import (BLOCK_COMMAND_SIZE, BLOCK_COUNT, END_PICTURE_COMMAND, BLOCK_PIXELS, PIXEL_END_INDEX, block_checksum, decode_command,
+                   encode_full_picture, encode_set_pixels, get_full_picture_command, get_set_pixel_command,
+                   split_commands, to_frame)
+from snoop import read_commands
+
+SNOOPS = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "snoops", "*.txt")))
+
+def snooped(kind):
+    return [command for path in SNOOPS for command in read_commands(path) if command.kind == kind]
+
+def snooped_pictures():
+    """
+    Yields the frames of the complete 8-block pictures in the snoops, with
+    the block commands they were sent as.
+    """
+    for path in SNOOPS:
+        blocks = []
+        for command in read_commands(path):
+            if command.kind != "block":
+                blocks = []
+                continue
+            blocks.append(command)
+            if len(blocks) == BLOCK_COUNT:
+                if [block.fields["index"] for block in blocks] == list(range(BLOCK_COUNT)):
+                    frame = np.frombuffer(b"".join(bytes(block.fields["pixels"]) for block in blocks), dtype=np.uint8)
+                    yield frame.reshape(-1, 3), [block.data for block in blocks]
+                blocks = []
+
+def without_checksum(data):
+    return data[:BLOCK_COMMAND_SIZE - 1] + data[-1:] if len(data) > BLOCK_COMMAND_SIZE else data
+
+def test_snooped_block_checksums():
+    blocks = [command for command in snooped("block") if command.fields["checksum"] is not None]
+    assert blocks
+    for command in blocks:
+        assert block_checksum(command.data) == command.fields["checksum"]
+
+def test_full_pictures_encode_like_the_vendor_app():
+    pictures = list(snooped_pictures())
+    assert pictures
+    for frame, blocks in pictures:
+        encoded = encode_full_picture(frame)
+        for index, data in enumerate(blocks):
+            assert encoded[index].tobytes() == without_checksum(data)
+            pixels = frame[index * BLOCK_PIXELS:(index + 1) * BLOCK_PIXELS].tolist()
+            assert bytes(get_full_picture_command(index, pixels)) == without_checksum(data)
+
+def test_pixel_commands_encode_like_the_vendor_app():
+    pixels = snooped("pixel")
+    assert pixels
+    for command in pixels:
+        index, color = command.fields["index"], command.fields["color"]
+        data = bytes(get_set_pixel_command(index, *color))
+        assert encode_set_pixels([index], [color])[0].tobytes() == data
+        # Byte 8 is the end index here, the vendor app sends the same
+        # checksum as on blocks there; the display takes both
+        assert data[:8] == command.data[:8] and data[9:] == command.data[9:]
+        assert data[8] == PIXEL_END_INDEX[index]
+        assert command.data[8] == block_checksum(command.data)
+
+def test_encoded_commands_decode_back():
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (256, 3), dtype=np.uint8)
+    decoded = np.empty_like(frame)
+    for data in encode_full_picture(frame):
+        kind, fields = decode_command(data)
+        assert kind == "block"
+        start = fields["index"] * BLOCK_PIXELS
+        decoded[start:start + BLOCK_PIXELS] = np.frombuffer(fields["pixels"], dtype=np.uint8).reshape(-1, 3)
+    assert (decoded == frame).all()
+
+    indices = rng.choice(256, 20, replace=False)
+    buffer = encode_set_pixels(indices, frame[indices])
+    commands = split_commands(buffer.tobytes())
+    assert len(commands) == 20
+    for index, data in zip(indices, commands):
+        kind, fields = decode_command(data)
+        assert kind == "pixel" and fields["index"] == index and fields["color"] == tuple(frame[index])
+
+def test_checksum_0x55_does_not_end_a_block_early():
+    frame = np.zeros((256, 3), dtype=np.uint8)
+    block = bytearray(encode_full_picture(frame)[0].tobytes()[:-1] + b"\x00\x55")
+    # Make the vendor checksum 0x55, like the terminator
+    block[3] = (0x55 - block_checksum(block)) & 0xFF
+    block[-2] = block_checksum(block)
+    block = bytes(block)
+    assert block[-2:] == b"\x55\x55"
+    pixel = get_set_pixel_command(3, 1, 2, 3)
+    for rest in ([], [END_PICTURE_COMMAND], [pixel]):
+        assert split_commands(block + b"".join(rest)) == [block] + rest
+    # Blocks without the checksum still end at their terminator
+    plain = encode_full_picture(frame)[1].tobytes()
+    assert split_commands(plain + block + plain) == [plain, block, plain]
+
+def test_to_frame_accepts_nested_rows_and_rejects_wrong_sizes():
+    rows = [[[x, y, 7] for x in range(16)] for y in range(16)]
+    frame = to_frame(rows)
+    assert frame.shape == (256, 3) and tuple(frame[17]) == (1, 1, 7)
+    with pytest.raises(ValueError):
+        to_frame(np.zeros((10, 3)))
@@ -0,0 +1,44 @@
+import asyncio
+import numpy as np
+from compositor import Compositor
+from emulator import EmulatedClient
+
+def test_compose_blends_layers_in_order():
+    compositor = Compositor(background=(0, 0, 80))
+    bottom = compositor.add_layer()
+    top = compositor.add_layer(opacity=0.5)
+    bottom.fill((200, 0, 0), rect=(0, 0, 8, 16))
+    top.fill((0, 200, 0), rect=(4, 0, 12, 16))
+    assert compositor.compose() == (0, 0, 12, 16)
+    assert tuple(compositor.frame[0, 0]) == (200, 0, 0)
+    assert tuple(compositor.frame[0, 6]) == (100, 100, 0)
+    assert tuple(compositor.frame[0, 10]) == (0, 100, 40)
+    assert tuple(compositor.frame[0, 14]) == (0, 0, 80)
+    assert compositor.compose() is None
+
+def test_removing_the_last_layer_clears_its_pixels():
+    compositor = Compositor()
+    layer = compositor.add_layer()
+    layer.fill((255, 255, 255), rect=(2, 2, 6, 6))
+    compositor.compose()
+    compositor.remove_layer(layer)
+    assert compositor.compose() == (2, 2, 6, 6)
+    assert compositor.frame.max() == 0
+
+def test_send_only_writes_the_moved_sprite():
+    client = EmulatedClient(realtime=False)
+    compositor = Compositor()
+    background = compositor.add_layer()
+    sprite = compositor.add_layer()
+    background.fill((0, 0, 80))
+    sprite.fill((255, 255, 0), rect=(0, 0, 2, 2))
+    asyncio.run(compositor.send(client))
+    assert (client.framebuffer == compositor.frame.reshape(-1, 3)).all()
+
+    writes = client.writes
+    sprite.clear()
+    sprite.fill((255, 255, 0), rect=(1, 0, 3, 2))
+    plan = asyncio.run(compositor.send(client))
+    assert (client.framebuffer == compositor.frame.reshape(-1, 3)).all()
+    assert set(plan.pixels) == {0, 2, 16, 18}
+    assert client.writes - writes == len(plan)
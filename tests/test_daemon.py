@@ -0,0 +1,147 @@
+import asyncio
+import numpy as np
+import pytest
+from codec import CHARACTERISTIC_UUID, POWER_OFF_COMMAND, decode_command, encode_set_pixels
+from daemon import DaemonClient, DisplayDaemon
+from emulator import EmulatedClient
+
+async def wait_for(condition, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition() and loop.time() < deadline:
+        await asyncio.sleep(0.01)
+    return condition()
+
+def test_updates_during_send_are_not_lost(tmp_path):
+    async def run():
+        display = EmulatedClient(latency=0.001)
+        daemon = DisplayDaemon(display, str(tmp_path / "display.sock"))
+        await daemon.start()
+        try:
+            async with DaemonClient(daemon.path) as a, DaemonClient(daemon.path) as b:
+                await a.send_frame(np.full((16, 16, 3), 40, dtype=np.uint8))
+                # Arrives while the frame is still being written
+                await asyncio.sleep(0.005)
+                await b.set_pixels([5, 200], [(255, 0, 0), (0, 255, 0)])
+                expected = np.full((256, 3), 40, dtype=np.uint8)
+                expected[5] = (255, 0, 0)
+                expected[200] = (0, 255, 0)
+                assert await wait_for(lambda: (display.framebuffer == expected).all())
+        finally:
+            await daemon.stop()
+
+    asyncio.run(run())
+
+class SnapshotClient(EmulatedClient):
+    """
+    Remembers what the display showed when it was powered off.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.at_power_off = None
+
+    async def write_gatt_char(self, char_uuid, data, response=None):
+        if bytes(data) == POWER_OFF_COMMAND:
+            self.at_power_off = self.framebuffer.copy()
+        await super().write_gatt_char(char_uuid, data, response)
+
+def test_commands_keep_their_order_relative_to_updates(tmp_path):
+    async def run():
+        display = SnapshotClient(realtime=False)
+        daemon = DisplayDaemon(display, str(tmp_path / "display.sock"))
+        await daemon.start()
+        try:
+            async with DaemonClient(daemon.path) as client:
+                await client.set_pixels([1], [(10, 20, 30)])
+                await client.write_gatt_char(CHARACTERISTIC_UUID, POWER_OFF_COMMAND)
+                await client.set_pixels([2], [(40, 50, 60)])
+                assert await wait_for(lambda: daemon.frames_sent == 2 and not daemon.events)
+        finally:
+            await daemon.stop()
+        assert tuple(display.at_power_off[1]) == (10, 20, 30)
+        assert tuple(display.at_power_off[2]) == (0, 0, 0)
+        assert tuple(display.framebuffer[2]) == (40, 50, 60)
+        assert daemon.resets == 1
+
+    asyncio.run(run())
+
+def test_raw_pixel_commands_do_not_force_full_frames(tmp_path):
+    async def run():
+        display = EmulatedClient(realtime=False)
+        daemon = DisplayDaemon(display, str(tmp_path / "display.sock"))
+        await daemon.start()
+        try:
+            async with DaemonClient(daemon.path) as a, DaemonClient(daemon.path) as b:
+                await a.send_frame(np.zeros((16, 16, 3), dtype=np.uint8))
+                await b.set_pixels([99], [(0, 0, 255)])
+                assert await wait_for(lambda: tuple(display.framebuffer[99]) == (0, 0, 255) and not daemon.events)
+                writes = display.writes
+                for index in range(20):
+                    pixel = encode_set_pixels([index], [(255, 255, 255)]).tobytes()
+                    await a.write_gatt_char(CHARACTERISTIC_UUID, pixel)
+                    await b.set_pixels([100 + index], [(0, 0, 255)])
+                assert await wait_for(lambda: daemon.commands_sent == 20 and tuple(display.framebuffer[119]) == (0, 0, 255))
+        finally:
+            await daemon.stop()
+        # At most one write per pixel, no full frame after each command
+        assert display.writes - writes <= 40
+        assert daemon.resets == 0
+        assert (display.framebuffer[:20] == 255).all()
+        assert (display.framebuffer[100:120] == (0, 0, 255)).all()
+
+    asyncio.run(run())
+
+def test_pending_events_are_capped(tmp_path):
+    async def run():
+        display = EmulatedClient(latency=0.001)
+        daemon = DisplayDaemon(display, str(tmp_path / "display.sock"), max_pending=8)
+        await daemon.start()
+        peak = 0
+        try:
+            async with DaemonClient(daemon.path) as client:
+                for index in range(50):
+                    await client.write_gatt_char(CHARACTERISTIC_UUID, encode_set_pixels([index], [(1, 1, 1)]).tobytes())
+                    peak = max(peak, len(daemon.events))
+                assert await wait_for(lambda: daemon.commands_sent == 50)
+        finally:
+            await daemon.stop()
+        assert peak <= 8
+
+    asyncio.run(run())
+
+def test_a_second_daemon_does_not_take_the_socket(tmp_path):
+    async def run():
+        path = str(tmp_path / "display.sock")
+        # A stale socket file is replaced
+        open(path, "w").close()
+        daemon = DisplayDaemon(EmulatedClient(realtime=False), path)
+        await daemon.start()
+        try:
+            second = DisplayDaemon(EmulatedClient(realtime=False), path)
+            with pytest.raises(RuntimeError):
+                await second.start()
+            # The first daemon still serves its clients
+            async with DaemonClient(path) as client:
+                assert (await client.stats())["clients"] >= 1
+        finally:
+            await daemon.stop()
+
+    asyncio.run(run())
+
+def test_stats_raise_when_the_daemon_hangs_up(tmp_path):
+    async def run():
+        path = str(tmp_path / "display.sock")
+
+        async def hang_up(reader, writer):
+            await reader.read(3)
+            writer.close()
+
+        server = await asyncio.start_unix_server(hang_up, path)
+        try:
+            async with DaemonClient(path) as client:
+                with pytest.raises(ConnectionError):
+                    await client.stats()
+        finally:
+            server.close()
+
+    asyncio.run(run())
@@ -0,0 +1,39 @@
+import asyncio
+import gc
+import numpy as np
+import delta
+from emulator import EmulatedClient
+
+def test_picture_stream_sends_only_changed_blocks():
+    client = EmulatedClient(realtime=False)
+    picture = np.zeros((256, 3), dtype=np.uint8)
+    assert asyncio.run(delta.send_picture_delta(client, picture, block_delay=0, command_delay=0)) == 8
+    picture[40] = (1, 2, 3)
+    assert asyncio.run(delta.send_picture_delta(client, picture)) == 1
+    assert (client.framebuffer == picture).all()
+
+def test_streams_are_dropped_with_their_client():
+    client = EmulatedClient(realtime=False)
+    delta.get_picture_stream(client)
+    del client
+    gc.collect()
+    assert len(delta._streams) == 0
+
+def test_scripts_write_only_changed_blocks_in_delta_mode():
+    import draw_file
+    import draw_picture
+
+    async def run(send):
+        client = EmulatedClient(realtime=False)
+        picture = np.zeros((256, 3), dtype=np.uint8)
+        await send(client, picture, True)
+        writes = client.writes
+        picture[100] = (9, 9, 9)
+        picture[255] = (9, 9, 9)
+        await send(client, picture, True)
+        assert (client.framebuffer == picture).all()
+        return client.writes - writes
+
+    # Blocks 3 and 7, plus the end command draw_picture finishes with
+    assert asyncio.run(run(draw_picture.send_picture)) == 3
+    assert asyncio.run(run(draw_file.send_image_blocks_only)) == 2
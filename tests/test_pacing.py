@@ -0,0 +1,48 @@
+import asyncio
+import gc
+import pacing
+from codec import CHARACTERISTIC_UUID, encode_set_pixels
+from emulator import EmulatedClient
+
+def test_paced_returns_one_pacer_per_client():
+    client = EmulatedClient(realtime=False)
+    pacer = pacing.paced(client)
+    assert pacing.paced(client) is pacer
+    assert pacing.paced(pacer) is pacer
+
+def test_pacers_are_dropped_with_their_client():
+    client = EmulatedClient(realtime=False)
+    pacing.paced(client)
+    del client
+    gc.collect()
+    assert len(pacing._pacers) == 0
+
+def test_gap_stays_above_the_floor():
+    client = EmulatedClient(realtime=False)
+    pacer = pacing.WritePacer(client)
+    data = encode_set_pixels([0], [(1, 2, 3)]).tobytes()
+
+    async def run():
+        for _ in range(100):
+            await pacer.write_gatt_char(CHARACTERISTIC_UUID, data)
+
+    asyncio.run(run())
+    assert pacer.gap >= pacing.MIN_GAP
+    assert pacer.probes == 100 // pacer.probe_interval
+
+def test_write_mode_is_looked_up_once():
+    client = EmulatedClient(realtime=False)
+    client.services.characteristic.properties = ["write"]
+    lookups = []
+    get_characteristic = client.services.get_characteristic
+    client.services.get_characteristic = lambda uuid: lookups.append(uuid) or get_characteristic(uuid)
+    pacer = pacing.WritePacer(client, gap=0)
+    data = encode_set_pixels([0], [(1, 2, 3)]).tobytes()
+
+    async def run():
+        for _ in range(10):
+            await pacer.write_gatt_char(CHARACTERISTIC_UUID, data)
+
+    asyncio.run(run())
+    assert lookups == [CHARACTERISTIC_UUID]
+    assert pacer.response is None and pacer.probes == 0
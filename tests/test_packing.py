@@ -0,0 +1,44 @@
+import asyncio
+import numpy as np
+from codec import encode_set_pixels, split_commands
+from emulator import EmulatedClient
+from packing import iter_packed, max_write_size, pack_commands, probe_concatenation
+
+def test_packed_writes_stay_within_the_size_and_split_back():
+    buffer = encode_set_pixels(np.arange(100), np.full((100, 3), 7))
+    commands = [row.tobytes() for row in buffer]
+    writes = pack_commands(commands, 64)
+    assert all(len(write) <= 64 for write in writes)
+    assert [command for write in writes for command in split_commands(write)] == commands
+    assert [bytes(view) for view in iter_packed(buffer, 64)] == writes
+
+def test_max_write_size_follows_the_mtu():
+    assert max_write_size(EmulatedClient(mtu_size=247)) == 244
+    assert max_write_size(object()) == 20
+
+def test_probe_tells_whether_packed_writes_apply():
+    for accept in (False, True):
+        client = EmulatedClient(realtime=False, accept_concatenated=accept)
+
+        def confirm(indices, color):
+            return bool((client.framebuffer[indices] == color).all())
+
+        assert asyncio.run(probe_concatenation(client, confirm=confirm)) is accept
+
+def test_packing_needs_a_profile_or_a_probe(monkeypatch):
+    import packing
+    # No calibrated profile, so the probe decides
+    monkeypatch.setattr(packing, "load_profile", lambda address: {"write_size": 10})
+    for accept in (False, True):
+        client = EmulatedClient(realtime=False, accept_concatenated=accept)
+
+        def confirm(indices, color):
+            return bool((client.framebuffer[indices] == color).all())
+
+        size = asyncio.run(packing.packed_write_size(client, confirm=confirm))
+        assert size == (max_write_size(client) if accept else 10)
+
+    # A profile calibrated for packing is trusted without a probe
+    monkeypatch.setattr(packing, "load_profile", lambda address: {"write_size": 120})
+    monkeypatch.setattr(packing, "probe_concatenation", None)
+    assert asyncio.run(packing.packed_write_size(EmulatedClient(realtime=False))) == 120
@@ -0,0 +1,95 @@
+import asyncio
+import numpy as np
+from codec import GRAFFITI_COMMANDS
+from emulator import EmulatedClient
+from pacing import MODE_SETTLE
+from planner import DEFAULT_WRITE_DELAYS, HybridStream, WriteCosts
+
+def new_stream():
+    client = EmulatedClient(realtime=False)
+    return client, HybridStream(client, delays=dict.fromkeys(DEFAULT_WRITE_DELAYS, 0))
+
+def test_stream_keeps_the_display_in_sync():
+    client, stream = new_stream()
+    rng = np.random.default_rng(1)
+    frame = rng.integers(0, 256, (256, 3), dtype=np.uint8)
+
+    async def run():
+        plan = await stream.send(frame)
+        assert len(plan.blocks) == 8
+        assert (client.framebuffer == frame).all()
+        for changes in (1, 3, 40, 256, 0):
+            indices = rng.choice(256, changes, replace=False)
+            frame[indices] = rng.integers(0, 256, (changes, 3), dtype=np.uint8)
+            await stream.send(frame)
+            assert (client.framebuffer == frame).all()
+
+    asyncio.run(run())
+
+def test_small_changes_use_pixels_and_large_ones_blocks():
+    client, stream = new_stream()
+    frame = np.zeros((256, 3), dtype=np.uint8)
+
+    async def run():
+        await stream.send(frame)
+        frame[[3, 200]] = 255
+        plan = await stream.send(frame)
+        assert len(plan.blocks) == 0 and set(plan.pixels) == {3, 200}
+        frame[:] = 9
+        plan = await stream.send(frame)
+        assert len(plan.blocks) == 8 and len(plan.pixels) == 0
+        assert len(await stream.send(frame)) == 0
+
+    asyncio.run(run())
+
+def test_reset_sends_the_next_frame_in_full():
+    client, stream = new_stream()
+    frame = np.zeros((256, 3), dtype=np.uint8)
+
+    async def run():
+        await stream.send(frame)
+        client.reset()
+        stream.reset()
+        frame[0] = 1
+        plan = await stream.send(frame)
+        assert len(plan.blocks) + len(plan.pixels) // 32 >= 8
+        assert (client.framebuffer == frame).all()
+
+    asyncio.run(run())
+
+def test_display_settles_in_graffiti_mode_before_pixel_writes(monkeypatch):
+    events = []
+    client = EmulatedClient(realtime=False)
+    # Fixed costs, so the plan does not follow the recorded sleeps
+    stream = HybridStream(client, costs=WriteCosts(smoothing=0))
+    write, sleep = client.write_gatt_char, asyncio.sleep
+
+    async def record_write(char_uuid, data, response=None):
+        events.append(bytes(data))
+        await write(char_uuid, data, response)
+
+    async def record_sleep(seconds):
+        # Zero sleeps are the emulator yielding, not delays
+        if seconds:
+            events.append(seconds)
+        await sleep(0)
+
+    client.write_gatt_char = record_write
+    monkeypatch.setattr(asyncio, "sleep", record_sleep)
+    frame = np.zeros((256, 3), dtype=np.uint8)
+
+    async def run():
+        plan = await stream.send(frame)
+        assert len(plan.blocks) == 8
+        events.clear()
+        frame[7] = 255
+        plan = await stream.send(frame)
+        assert list(plan.pixels) == [7]
+
+    asyncio.run(run())
+    # Every mode command is followed by the settle before the next write
+    for command in GRAFFITI_COMMANDS:
+        position = events.index(bytes(command))
+        assert events[position + 1] == MODE_SETTLE
+    assert isinstance(events[-2], bytes) and events[-2][1] == 0x01
+    assert (client.framebuffer[7] == 255).all()
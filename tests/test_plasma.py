@@ -0,0 +1,40 @@
+import asyncio
+import pytest
+import connection
+import plasma
+from emulator import EmulatedClient
+
+def test_bad_arguments_print_the_usage_and_exit(capsys):
+    with pytest.raises(SystemExit) as exit:
+        plasma.parse_args(["--dither=abc"], "draw_plasma.py")
+    assert exit.value.code == 2
+    assert "Usage: python3 draw_plasma.py" in capsys.readouterr().out
+    with pytest.raises(SystemExit):
+        plasma.parse_args(["hsv"], "draw_plasma.py")
+    assert plasma.parse_args(["gamma", "--worker"], "draw_plasma.py") == {"--worker"}
+    plasma.set_error_metric("absolute")
+
+def test_plasma_reaches_the_display_with_the_frame_hook(monkeypatch):
+    display = EmulatedClient(realtime=False)
+
+    class EmulatedConnection:
+        def __init__(self, on_connect=None):
+            self.on_connect = on_connect
+
+        async def __aenter__(self):
+            await self.on_connect(display)
+            return display
+
+        async def __aexit__(self, *exc_info):
+            pass
+
+    monkeypatch.setattr(connection, "DisplayConnection", EmulatedConnection)
+    frames = []
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(plasma.run_plasma(lambda: frames.append(1)), 1.0)
+
+    asyncio.run(run())
+    assert display.mode == "graffiti"
+    assert frames and display.framebuffer.any()
@@ -0,0 +1,44 @@
+import asyncio
+import os
+import numpy as np
+from codec import CHARACTERISTIC_UUID, encode_full_picture
+from emulator import EmulatedClient
+from replay import MAX, SCALED, Capture, RecordingClient, load_capture, replay
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+def test_capture_keeps_commands_and_times():
+    capture = Capture([b"\xbc\x00\x01\x01\x55", b"\xbc\x00\x0d\x0d\x55"], [10.0, 10.5])
+    assert len(capture) == 2
+    assert bytes(capture.views[1]) == b"\xbc\x00\x0d\x0d\x55"
+    assert capture.duration == 0.5
+    assert capture.kinds() == ["mode", "mode"]
+
+def test_hex_files_with_and_without_timestamps(tmp_path):
+    path = tmp_path / "commands.txt"
+    path.write_text("// comment\n0.0 bc 00 01 01 55\n\n# another\n0.25 bc000d0d55\n")
+    capture = Capture.from_hex_file(str(path))
+    assert len(capture) == 2 and capture.duration == 0.25
+    path.write_text("bc00010155\nbc000d0d55\n")
+    assert Capture.from_hex_file(str(path)).duration == 0.0
+
+def test_replaying_a_snoop_shows_its_last_picture():
+    capture = load_capture(os.path.join(ROOT, "snoops", "two_pictures.txt"))
+    client = EmulatedClient(realtime=False)
+    asyncio.run(replay(client, capture, MAX))
+    blocks = [bytes(view) for view, kind in zip(capture.views, capture.kinds()) if kind == "block"]
+    last = np.frombuffer(b"".join(block[3:3 + 96] for block in blocks[-8:]), dtype=np.uint8).reshape(-1, 3)
+    assert (client.framebuffer == last).all()
+
+def test_recorded_session_replays_the_same():
+    frame = np.random.default_rng(2).integers(0, 256, (256, 3), dtype=np.uint8)
+    recorder = RecordingClient(EmulatedClient(realtime=False))
+
+    async def record():
+        for block in encode_full_picture(frame):
+            await recorder.write_gatt_char(CHARACTERISTIC_UUID, block.tobytes())
+
+    asyncio.run(record())
+    client = EmulatedClient(realtime=False)
+    asyncio.run(replay(client, recorder.capture(), SCALED, scale=0.0))
+    assert (client.framebuffer == frame).all()
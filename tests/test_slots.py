@@ -0,0 +1,23 @@
+import os
+import numpy as np
+from codec import SLIDESHOW_COMMAND
+from replay import Capture
+from slots import load_manifest, picture_hash, save_manifest, store_commands
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+def test_store_sequence_matches_the_vendor_app():
+    expected = [bytes(view) for view in Capture.from_hex_file(os.path.join(ROOT, "store_image_commands.txt")).views]
+    blocks = [command for command in expected if command[1] == 0x0F and 1 <= command[2] <= 8]
+    picture = np.frombuffer(b"".join(block[3:3 + 96] for block in blocks), dtype=np.uint8)
+    # The capture ends by starting the slideshow, which is not part of storing
+    assert expected[-1] == SLIDESHOW_COMMAND
+    assert store_commands(picture) == expected[:-1]
+
+def test_manifest_round_trip(tmp_path):
+    path = str(tmp_path / "slots.json")
+    assert load_manifest("AA:BB", path) == []
+    entries = [{"hash": picture_hash(np.zeros(768, dtype=np.uint8)), "name": "black.png"}]
+    save_manifest("AA:BB", entries, path)
+    assert load_manifest("AA:BB", path) == entries
+    assert load_manifest("CC:DD", path) == []
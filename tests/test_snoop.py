@@ -0,0 +1,36 @@
+import glob
+import os
+from snoop import read_commands
+
+SNOOP_DIR = os.path.join(os.path.dirname(__file__), "..", "snoops")
+
+def snoop_path(name):
+    return os.path.join(SNOOP_DIR, name)
+
+def test_every_export_parses():
+    paths = sorted(glob.glob(os.path.join(SNOOP_DIR, "*.txt")))
+    assert paths
+    for path in paths:
+        commands = list(read_commands(path))
+        assert commands, path
+        assert any(command.kind != "unknown" for command in commands), path
+
+def test_export_formats_give_the_same_commands():
+    # The same capture, exported with and without the packet summary lines
+    plain = list(read_commands(snoop_path("saves_to_device.txt")))
+    summary = list(read_commands(snoop_path("saves_to_device_with_summary.txt")))
+    assert [command.data for command in plain] == [command.data for command in summary]
+    assert all(command.time is None for command in plain)
+    assert all(command.time is not None for command in summary)
+
+def test_two_pictures_is_two_full_pictures():
+    commands = [command for command in read_commands(snoop_path("two_pictures.txt"))
+                if command.kind != "mode"]
+    kinds = [command.kind for command in commands]
+    assert kinds == (["picture_start"] + ["block"] * 8 + ["picture_end"]) * 2
+    assert [command.fields["index"] for command in commands if command.kind == "block"] == list(range(8)) * 2
+
+def test_reads_lines_as_well_as_files():
+    with open(snoop_path("pixels.txt")) as f:
+        from_lines = [command.data for command in read_commands(f)]
+    assert from_lines == [command.data for command in read_commands(snoop_path("pixels.txt"))]
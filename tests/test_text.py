@@ -0,0 +1,55 @@
+import asyncio
+import numpy as np
+from emulator import EmulatedClient
+from text import FONT, Ticker, blit, scroll, start_ticker
+
+def reference_blend(value, color, alpha):
+    # The per-pixel blend plasma.draw_alpha_pixel used before the atlas
+    return max(0, min(255, int((1 - alpha) * value + alpha * color)))
+
+def test_blit_matches_the_per_pixel_blend():
+    values = np.arange(256, dtype=np.uint8)
+    for level in range(16):
+        mask = np.full((1, 256), level / 15.0)
+        for color in (0, 255, 100):
+            frame = np.repeat(values[None, :, None], 3, axis=2)
+            blit(frame, mask, 0, 0, (color, color, color))
+            expected = [reference_blend(int(value), color, 1 * level / 15.0) for value in values]
+            assert frame[0, :, 0].tolist() == expected
+
+def test_font_masks_keep_the_digit_levels():
+    assert FONT.glyph("0")[0].tolist() == [12 / 15.0, 1.0, 12 / 15.0]
+    assert FONT.glyph("a") is FONT.glyph("A")
+    assert FONT.render("11").shape == (5, 7)
+
+def test_ticker_only_reports_changed_pixels():
+    ticker = Ticker("HI")
+    assert len(ticker.step()) == 256
+    changed = ticker.step()
+    assert 0 < len(changed) < 256
+    # Each step reports exactly the pixels that differ from the last one,
+    # and after a whole scroll the ticker has wrapped to where it was
+    offset = ticker.offset
+    previous = ticker.frame.copy()
+    for _ in range(len(ticker)):
+        changed = ticker.step()
+        assert changed.tolist() == np.flatnonzero((ticker.frame != previous).any(axis=2)).tolist()
+        if ticker.offset == 0:
+            # Only background in view
+            assert (ticker.frame == 0).all()
+        previous = ticker.frame.copy()
+    assert ticker.offset == offset
+
+def test_ticker_repaints_after_a_reconnect():
+    client = EmulatedClient(realtime=False)
+    ticker = Ticker("HI", color=(255, 0, 0))
+
+    async def run():
+        await scroll(client, ticker, speed=1000.0, loops=0.5)
+        # A reconnect leaves a blank display in another mode
+        client.reset()
+        await start_ticker(client, ticker)
+        assert client.mode == "graffiti"
+        assert len(ticker.step()) == 256
+
+    asyncio.run(run())
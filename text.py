@@ -0,0 +1,243 @@
+"""
+Text rendering for the 16x16 display.
+
+Fonts are given as rows of hex digits per glyph, where each digit is the
+alpha (0-f) of that pixel and a space is transparent, like DIGIT_MAP. A Font
+compiles them once into an atlas of float64 alpha masks, so drawing text is
+a few array operations per glyph instead of parsing and blending pixel by
+pixel. The blend is done in float64 like the per-pixel code, so with full
+alpha the result is the same to the last bit.
+
+A Ticker scrolls a line of text horizontally. The whole line is rendered
+once into a strip, each step is a window into it, and only the pixels of
+the columns that changed are sent.
+
+Usage:
+    python3 text.py "HELLO WORLD"
+    python3 text.py "12:34 OK" --emulator
+"""
+import argparse
+import asyncio
+import numpy as np
+from codec import CHARACTERISTIC_UUID, GRAFFITI_COMMANDS, WIDTH, HEIGHT, encode_frame_pixels, iter_commands
+from pacing import MODE_SETTLE, paced
+
+# 3x5 pixel representations of digits 0-9
+DIGIT_MAP = {
+    '0': ["cfc", "f f", "f f", "f f", "cfc"],
+    '1': [" f ", "ff ", " f ", " f ", "fff"],
+    '2': ["cfc", "  f", "cfc", "f  ", "fff"],
+    '3': ["ffc", "  f", " ff", "  f", "ffc"],
+    '4': ["c f", "f f", "fff", "  f", "  f"],
+    '5': ["fff", "f  ", "ffc", "  f", "ffc"],
+    '6': ["cff", "f  ", "ffc", "f f", "cfc"],
+    '7': ["fff", "  f", " f ", " f ", " f "],
+    '8': ["cfc", "f f", "cfc", "f f", "cfc"],
+    '9': ["cfc", "f f", "cff", "  f", "ffc"],
+}
+
+# 3x5 letters and punctuation in the same style, for tickers
+LETTER_MAP = {
+    'A': ["cfc", "f f", "fff", "f f", "f f"],
+    'B': ["ffc", "f f", "ffc", "f f", "ffc"],
+    'C': ["cff", "f  ", "f  ", "f  ", "cff"],
+    'D': ["ffc", "f f", "f f", "f f", "ffc"],
+    'E': ["fff", "f  ", "ff ", "f  ", "fff"],
+    'F': ["fff", "f  ", "ff ", "f  ", "f  "],
+    'G': ["cff", "f  ", "f f", "f f", "cff"],
+    'H': ["f f", "f f", "fff", "f f", "f f"],
+    'I': ["fff", " f ", " f ", " f ", "fff"],
+    'J': ["  f", "  f", "  f", "f f", "cfc"],
+    'K': ["f f", "f f", "ff ", "f f", "f f"],
+    'L': ["f  ", "f  ", "f  ", "f  ", "fff"],
+    'M': ["f f", "fff", "fff", "f f", "f f"],
+    'N': ["ffc", "f f", "f f", "f f", "f f"],
+    'O': ["cfc", "f f", "f f", "f f", "cfc"],
+    'P': ["ffc", "f f", "ffc", "f  ", "f  "],
+    'Q': ["cfc", "f f", "f f", "ff ", "cff"],
+    'R': ["ffc", "f f", "ffc", "f f", "f f"],
+    'S': ["cff", "f  ", "cfc", "  f", "ffc"],
+    'T': ["fff", " f ", " f ", " f ", " f "],
+    'U': ["f f", "f f", "f f", "f f", "cfc"],
+    'V': ["f f", "f f", "f f", "cfc", " f "],
+    'W': ["f f", "f f", "fff", "fff", "f f"],
+    'X': ["f f", "f f", " f ", "f f", "f f"],
+    'Y': ["f f", "f f", "cfc", " f ", " f "],
+    'Z': ["fff", "  f", " f ", "f  ", "fff"],
+    ' ': ["   ", "   ", "   ", "   ", "   "],
+    '.': ["   ", "   ", "   ", "   ", " f "],
+    ',': ["   ", "   ", "   ", " f ", "f  "],
+    ':': ["   ", " f ", "   ", " f ", "   "],
+    '-': ["   ", "   ", "fff", "   ", "   "],
+    '+': ["   ", " f ", "fff", " f ", "   "],
+    '!': [" f ", " f ", " f ", "   ", " f "],
+    '?': ["ffc", "  f", " f ", "   ", " f "],
+    '%': ["f f", "  f", " f ", "f  ", "f f"],
+    '/': ["  f", "  f", " f ", "f  ", "f  "],
+    '°': ["ff ", "ff ", "   ", "   ", "   "],
+}
+
+class Font:
+    """
+    A fixed-height font compiled into alpha masks.
+
+    `glyphs` maps characters to rows of hex alpha digits. Characters that
+    are not in the font are drawn as `fallback`.
+    """
+    def __init__(self, glyphs, spacing=1, fallback=" "):
+        self.height = len(next(iter(glyphs.values())))
+        self.spacing = spacing
+        self.fallback = fallback
+        self.masks = {}
+        for char, rows in glyphs.items():
+            mask = np.zeros((self.height, max(len(row) for row in rows)), dtype=np.float64)
+            for y, row in enumerate(rows):
+                for x, pixel in enumerate(row):
+                    if pixel != " ":
+                        mask[y, x] = int(pixel, 16) / 15.0
+            self.masks[char] = mask
+
+    def glyph(self, char) -> np.ndarray:
+        mask = self.masks.get(char)
+        if mask is None:
+            mask = self.masks.get(char.upper(), self.masks.get(self.fallback))
+        return mask
+
+    def render(self, text) -> np.ndarray:
+        """
+        Returns the alpha mask of a line of text, glyphs separated by
+        `spacing` transparent columns.
+        """
+        masks = [self.glyph(char) for char in text]
+        masks = [mask for mask in masks if mask is not None]
+        if not masks:
+            return np.zeros((self.height, 0), dtype=np.float64)
+        width = sum(mask.shape[1] for mask in masks) + self.spacing * (len(masks) - 1)
+        line = np.zeros((self.height, width), dtype=np.float64)
+        x = 0
+        for mask in masks:
+            line[:, x:x + mask.shape[1]] = mask
+            x += mask.shape[1] + self.spacing
+        return line
+
+DIGIT_FONT = Font(DIGIT_MAP)
+FONT = Font({**DIGIT_MAP, **LETTER_MAP})
+
+def blit(frame, mask, x, y, color, alpha=1.0):
+    """
+    Blends `color` into a (height, width, 3) uint8 frame through an alpha
+    mask placed with its top left corner at (x, y), clipped to the frame.
+    Like draw_alpha_pixel, blended values are truncated to integers.
+    """
+    height, width = frame.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + mask.shape[1], width), min(y + mask.shape[0], height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    a = mask[y0 - y:y1 - y, x0 - x:x1 - x, None] * alpha
+    region = frame[y0:y1, x0:x1]
+    region[:] = region * (1 - a) + np.asarray(color, dtype=np.float64) * a
+
+def draw_text(frame, text, x, y, color, font=FONT, alpha=1.0):
+    blit(frame, font.render(text), x, y, color, alpha)
+
+class Ticker:
+    """
+    A line of text scrolling right to left across the display.
+
+    The text is rendered once into a strip with a display width of
+    background on either side, so it scrolls in from the right and out to
+    the left; step() moves the window one column and returns the pixel
+    positions that changed.
+    """
+    def __init__(self, text, color=(255, 255, 255), background=(0, 0, 0), y=None, font=FONT):
+        mask = font.render(text)
+        if y is None:
+            y = (HEIGHT - font.height) // 2
+        self.strip = np.empty((HEIGHT, mask.shape[1] + 2 * WIDTH, 3), dtype=np.uint8)
+        self.strip[:] = background
+        blit(self.strip, mask, WIDTH, y, color)
+        self.offset = 0
+        self.shown = None
+
+    def __len__(self):
+        # Steps until the text has scrolled out and the ticker wraps
+        return self.strip.shape[1] - WIDTH
+
+    @property
+    def frame(self) -> np.ndarray:
+        return self.strip[:, self.offset:self.offset + WIDTH]
+
+    def step(self) -> np.ndarray:
+        """
+        Scrolls one column and returns the flat indices of the pixels that
+        differ from what was shown before. Columns of plain background
+        that stay plain background are never sent.
+        """
+        self.offset = (self.offset + 1) % len(self)
+        frame = self.frame
+        if self.shown is None:
+            self.shown = frame.copy()
+            return np.arange(WIDTH * HEIGHT)
+        indices = np.flatnonzero((frame != self.shown).any(axis=2))
+        self.shown[:] = frame
+        return indices
+
+async def start_ticker(client, ticker):
+    """
+    Puts the display in graffiti mode and makes the ticker send its next
+    step in full, e.g. after a reconnect.
+    """
+    await paced(client).write_commands(GRAFFITI_COMMANDS, settle=MODE_SETTLE)
+    ticker.shown = None
+
+async def scroll(client, ticker, speed=8.0, loops=None, start=True):
+    """
+    Scrolls a ticker on the display in graffiti mode at `speed` columns per
+    second, sending only the changed pixels of each step. When the link is
+    slower than that, steps take as long as their writes. Pass `start=False`
+    when the connection already calls start_ticker on connect.
+    """
+    pacer = paced(client)
+    if start:
+        await start_ticker(pacer, ticker)
+    loop = asyncio.get_running_loop()
+    next_step = loop.time()
+    steps = 0
+    while loops is None or steps < loops * len(ticker):
+        indices = ticker.step()
+        frame = ticker.shown.reshape(-1, 3)
+        for command in iter_commands(encode_frame_pixels(frame, indices)):
+            await pacer.write_gatt_char(CHARACTERISTIC_UUID, command)
+        steps += 1
+        next_step += 1 / speed
+        await asyncio.sleep(max(0, next_step - loop.time()))
+
+async def run(args):
+    ticker = Ticker(args.text, tuple(bytes.fromhex(args.color)), tuple(bytes.fromhex(args.background)))
+    if args.emulator:
+        from emulator import EmulatedClient
+        client = EmulatedClient()
+        await scroll(client, ticker, args.speed, loops=1)
+        print(f"{client.writes} writes for {len(ticker)} steps")
+    else:
+        from connection import DisplayConnection
+        async def on_connect(client):
+            # After a reconnect the display is out of graffiti mode and no
+            # longer shows what the ticker last sent
+            await start_ticker(client, ticker)
+
+        async with DisplayConnection(on_connect=on_connect) as connection:
+            await scroll(connection, ticker, args.speed, start=False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Scroll a line of text on the MI Matrix Display.")
+    parser.add_argument("text")
+    parser.add_argument("--speed", type=float, default=8.0, help="columns per second")
+    parser.add_argument("--color", default="ffffff", help="text color as hex RGB")
+    parser.add_argument("--background", default="000000", help="background color as hex RGB")
+    parser.add_argument("--emulator", action="store_true", help="scroll once on the emulator")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
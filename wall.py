@@ -0,0 +1,139 @@
+"""
+Drive a wall of displays as one larger canvas.
+
+A DisplayWall connects to several displays concurrently on one event loop
+and treats them as tiles of a (rows * 16, columns * 16) canvas, e.g. four
+displays side by side make a 64x16 wall. Each frame is split into tiles and
+the tiles are sent in parallel, every display over its own paced connection
+with its own delta stream, so updating the whole wall takes about as long as
+updating one display.
+
+The display addresses are saved in order in ~/.mi_led_display.json under
+"wall" after the first scan. Edit that list to match the physical layout,
+left to right and top to bottom.
+
+Usage:
+    python3 wall.py --columns 4
+    python3 wall.py --columns 2 --rows 2 --emulator
+"""
+import argparse
+import asyncio
+import time
+import numpy as np
+from codec import WIDTH, HEIGHT
+from connection import ADDRESS_CACHE, DEVICE_NAME, DisplayConnection, find_devices, load_cached_address, save_cached_address
+from delta import PictureStream
+from pacing import paced
+from plasma import Plasma
+
+WALL_CACHE_KEY = "wall"
+
+class DisplayWall:
+    """
+    A grid of displays addressed as one canvas.
+
+    `clients` are connected clients (or DisplayConnections) in row-major
+    tile order. Use DisplayWall.connect to create a wall from addresses or
+    by scanning.
+    """
+    def __init__(self, clients, columns, rows=1):
+        if len(clients) != columns * rows:
+            raise ValueError(f"A {columns}x{rows} wall needs {columns * rows} displays, got {len(clients)}.")
+        self.clients = clients
+        self.columns = columns
+        self.rows = rows
+        self.width = columns * WIDTH
+        self.height = rows * HEIGHT
+        self.streams = [PictureStream(paced(client), block_delay=0, command_delay=0) for client in clients]
+        self.failures = [0] * len(clients)
+
+    @classmethod
+    async def connect(cls, columns, rows=1, addresses=None, name=DEVICE_NAME, cache_path=ADDRESS_CACHE,
+                      scan_timeout=20.0, **kwargs):
+        """
+        Connects to all displays of a wall at the same time. Without
+        `addresses` the cached wall layout is used, or the displays are
+        found by scanning and their addresses cached, sorted by address.
+        Extra keyword arguments go to each DisplayConnection.
+        """
+        count = columns * rows
+        if addresses is None:
+            addresses = load_cached_address(WALL_CACHE_KEY, cache_path)
+        if not addresses or len(addresses) != count:
+            devices = await find_devices(name, count, scan_timeout)
+            if len(devices) < count:
+                raise RuntimeError(f"Found {len(devices)} of {count} displays.")
+            addresses = sorted(device.address for device in devices)
+            save_cached_address(addresses, WALL_CACHE_KEY, cache_path)
+
+        connections = [DisplayConnection(name, cache_path, address=address, **kwargs) for address in addresses]
+        await asyncio.gather(*(connection.connect() for connection in connections))
+        return cls(connections, columns, rows)
+
+    async def disconnect(self):
+        await asyncio.gather(*(client.disconnect() for client in self.clients), return_exceptions=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    def tiles(self, frame) -> np.ndarray:
+        """
+        Splits a (height, width, 3) frame into a (tiles, 256, 3) array, one
+        tile per display in row-major order.
+        """
+        frame = np.asarray(frame, dtype=np.uint8).reshape(self.rows, HEIGHT, self.columns, WIDTH, 3)
+        return frame.transpose(0, 2, 1, 3, 4).reshape(self.rows * self.columns, WIDTH * HEIGHT, 3)
+
+    async def send(self, frame) -> int:
+        """
+        Sends a frame to all displays in parallel and returns the number of
+        blocks written. A display that fails is counted in `failures` and
+        gets its next tile in full, without holding up the others.
+        """
+        tiles = self.tiles(frame)
+        results = await asyncio.gather(*(stream.send(tile) for stream, tile in zip(self.streams, tiles)),
+                                       return_exceptions=True)
+        blocks = 0
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                self.failures[index] += 1
+                self.streams[index].reset()
+                print(f"Display {index} failed: {result}")
+            else:
+                blocks += result
+        return blocks
+
+async def run(args):
+    if args.emulator:
+        from emulator import EmulatedClient
+        clients = [EmulatedClient(latency=args.latency) for _ in range(args.columns * args.rows)]
+        wall = DisplayWall(clients, args.columns, args.rows)
+    else:
+        wall = await DisplayWall.connect(args.columns, args.rows, args.addresses)
+
+    async with wall:
+        effect = Plasma(wall.width, wall.height)
+        canvas = np.empty((wall.height, wall.width, 3), dtype=np.uint8)
+        start = time.perf_counter()
+        for frame in range(args.frames):
+            frame_start = time.perf_counter()
+            blocks = await wall.send(effect.render(frame * 0.5, canvas))
+            print(f"Frame {frame}: {blocks} blocks in {(time.perf_counter() - frame_start) * 1000:.1f} ms")
+        seconds = time.perf_counter() - start
+        print(f"{args.frames / seconds:.1f} frames/s on a {wall.width}x{wall.height} wall")
+
+def main():
+    parser = argparse.ArgumentParser(description="Show a plasma on a wall of MI Matrix Displays.")
+    parser.add_argument("--columns", type=int, default=2)
+    parser.add_argument("--rows", type=int, default=1)
+    parser.add_argument("--addresses", nargs="+", help="display addresses in row-major tile order")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--emulator", action="store_true", help="use emulated displays")
+    parser.add_argument("--latency", type=float, default=0.003, help="emulated per-write latency in seconds")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()